@@ -0,0 +1,28 @@
+"""Helpers for running the previous driver implementations as benchmark baselines."""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from stgctl.lib.reader import ReplyReader
+from stgctl.lib.vmx import VMX
+
+
+@contextmanager
+def without_reader(vmx: VMX) -> Iterator[None]:
+    """Stop the VMX reader thread, so a baseline can read the port directly like the old driver did.
+
+    Args:
+        vmx (VMX): driver to detach the reader from
+
+    Yields:
+        None: while the reader is stopped
+    """
+    vmx._reader.stop()
+    try:
+        yield
+    finally:
+        # Whatever the baseline did bypassed the driver's bookkeeping
+        vmx._outstanding = 0
+        vmx._runs.clear()
+        vmx._reader = ReplyReader(vmx._serial)
+        vmx._reader.start()
@@ -0,0 +1,80 @@
+"""Benchmark limit switch calibration: four corners in turn against two-speed diagonal legs.
+
+The four-corner sequence is XYStage.startup as it was: home both motors, then index to each
+corner in turn, one axis at a time. The two-speed startup approaches the -X,-Y and +X,+Y
+limit switches with both motors at once, backing off and approaching again slowly.
+Both approach the switches at the same speed and acceleration, for each of LIMITS in turn,
+so the difference is the sequence alone. They run on the simulator, sped up by TIME_SCALE,
+and are reported in simulated seconds, along with the limit switch positions each records.
+
+Run with `python benchmarks/bench_calibration.py`.
+"""
+
+import time
+
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.vmx import VMX, Motor
+
+TIME_SCALE = 0.02
+# Speed (idx/s) and acceleration (AmMx setting) both methods approach the switches at:
+# the defaults, and a faster approach
+LIMITS = [(2000, 2), (4000, 4)]
+
+
+def four_corners(stg: XYStage) -> list[tuple[int, int]]:
+    """Calibrate as XYStage.startup did, one corner at a time."""
+    stg.VMX.clear()
+    for motor, accel in zip((Motor.X, Motor.Y), settings.ACCEL_LIMIT, strict=True):
+        stg.VMX.speed(motor=motor, speed=settings.HOMING_FAST_SPEED).accel(
+            motor=motor, accel=accel
+        )
+    stg.VMX.to_limits(limits={Motor.X: True, Motor.Y: True}).run().send()
+    stg.VMX.wait_for_complete(timeout=None)
+    stg.VMX.clear().origin().send()
+    positions = [(0, 0)]
+    for x, y in [(True, False), (False, False), (False, True), (True, True)]:
+        stg.VMX.clear().to_limits(limits={Motor.X: x, Motor.Y: y}).run().send()
+        stg.VMX.wait_for_complete(timeout=None)
+        positions.append(
+            tuple(
+                int(stg.VMX.posn(axis=m).decode().strip()) for m in (Motor.X, Motor.Y)
+            )
+        )
+    return positions
+
+
+def two_speed(stg: XYStage) -> list[tuple[int, int]]:
+    """Calibrate with XYStage.startup."""
+    stg.startup()
+    return stg.limit_switch_positions
+
+
+def calibrate(method) -> tuple[float, list[tuple[int, int]]]:
+    """Time a calibration method on a fresh simulator, in simulated seconds."""
+    with SimulatedVMX(time_scale=TIME_SCALE) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        start = time.perf_counter()
+        try:
+            positions = method(stg)
+        finally:
+            stg.VMX.close()
+        return (time.perf_counter() - start) / TIME_SCALE, positions
+
+
+def main() -> None:
+    """Print the time each calibration takes, and what it records."""
+    logger.remove()
+    for speed, accel in LIMITS:
+        settings.HOMING_FAST_SPEED = speed
+        settings.ACCEL_LIMIT = (accel, accel)
+        print(f"Approaching at {speed} idx/s, acceleration {accel}:")
+        for name, method in (("four corners", four_corners), ("two-speed", two_speed)):
+            seconds, positions = calibrate(method)
+            print(f"{name:>12}: {seconds:6.1f} s  {positions}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark raster time with a fixed dwell against dwelling until the DAQ is done.
+
+A simulated DAQ takes ACQUIRE seconds per point, against an observing time of OBSERVE seconds,
+so the fixed pause spends the worst case at every point. The handshake dwell waits for the DAQ
+(here, a UDP datagram sent once it is done) and continues the program with G. Both are timed
+over a packed raster in real time, on a small stage so moves are short.
+
+Run with `python benchmarks/bench_dwell.py`.
+"""
+
+import socket
+import threading
+import time
+
+from loguru import logger
+from stgctl.lib.dwell import (
+    DaqEvent,
+    DwellStrategy,
+    FixedDwell,
+    HandshakeDwell,
+    SocketEvent,
+)
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.vmx import VMX
+from stgctl.schema.models import Size
+
+GRID = Size(10, 10)
+# A small stage, so moves between points take about 10 ms in real time
+LIMIT_SWITCH_POSITIONS = [(0, 0), (0, -100), (-100, -100), (-100, 0), (0, 0)]
+OBSERVE = 0.05
+ACQUIRE = 0.01
+
+
+class SimulatedDaq(DaqEvent):
+    """A DAQ that sends a UDP datagram ACQUIRE seconds after the stages reach a point."""
+
+    def __init__(self) -> None:
+        """Listen for the datagram, and open the socket to send it from."""
+        self.event = SocketEvent()
+        self._daq = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def arm(self, point: int) -> None:
+        """Start acquiring."""
+        self.event.arm(point)
+        threading.Timer(
+            ACQUIRE, self._daq.sendto, (b"done", self.event.address)
+        ).start()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for the datagram."""
+        return self.event.wait(timeout)
+
+    def close(self) -> None:
+        """Close both sockets."""
+        self._daq.close()
+        self.event.close()
+
+
+def raster(dwell: DwellStrategy) -> float:
+    """Time a packed raster with a dwell strategy."""
+    with SimulatedVMX(time_scale=1) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port), dwell=dwell)
+        stg.grid_size = GRID
+        stg.observing_time = OBSERVE
+        stg.limit_switch_positions = LIMIT_SWITCH_POSITIONS
+        start = time.perf_counter()
+        try:
+            stg.raster(signal=False, mode=RasterMode.PACKED)
+        finally:
+            stg.VMX.close()
+            dwell.close()
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    """Print ms per point for each dwell."""
+    logger.remove()
+    points = GRID.X * GRID.Y
+    fixed = raster(FixedDwell(OBSERVE))
+    handshake = raster(HandshakeDwell(SimulatedDaq(), timeout=OBSERVE))
+    print(f"observing time {1e3 * OBSERVE:.0f} ms, acquisition {1e3 * ACQUIRE:.0f} ms")
+    print(f"fixed pause: {1e3 * fixed / points:6.2f} ms per point")
+    print(f"handshake:   {1e3 * handshake / points:6.2f} ms per point")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark compiling raster trajectories into packed VMX programs.
+
+Compares pack_points with the per-point compiler it replaced, which formatted every
+command from its template, optimized it against the program so far, and re-encoded the
+whole program to check its size. Both must produce the same programs.
+
+Run with `python benchmarks/bench_encode.py`.
+"""
+
+import copy
+import time
+
+from stgctl.lib.optimize import AxisState, optimize
+from stgctl.lib.program import PackedProgram, pack_points, point_commands
+from stgctl.lib.vmx import BaseVMX, SerialCommand
+from stgctl.schema.models import Size
+from stgctl.util.trajectory import gen_2d_trajectory
+
+GRIDS = [Size(60, 60), Size(200, 200)]
+PAUSE = 15
+
+
+def pack_points_per_point(trajectory, pause, budget=BaseVMX.PROGRAM_BYTES):
+    """The per-point compiler, as a baseline."""
+    reserve = len("," + BaseVMX.JUMP_PROG.format(n=0))
+
+    def fits(program, cmd):
+        added = len(cmd.encode()) + (1 if program.commands else 0)
+        return len(program.commands.encode()) + added + reserve <= budget
+
+    programs = [PackedProgram()]
+    state = AxisState()
+    for coord in trajectory:
+        program = programs[-1]
+        known = copy.deepcopy(state)
+        cmd = SerialCommand(optimize(point_commands(coord, pause), known))
+        if not fits(program, cmd):
+            program = PackedProgram()
+            known = AxisState()
+            cmd = SerialCommand(optimize(point_commands(coord, pause), known))
+            programs.append(program)
+        program.commands.extend(cmd)
+        program.points += 1
+        state = known
+    return programs
+
+
+def best_of(func, *args, repeat=3):
+    """Best wall-clock time of a few calls, and the result of the last."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main() -> None:
+    """Compile rasters of a few sizes both ways and report throughput."""
+    for grid in GRIDS:
+        trajectory = -gen_2d_trajectory(grid, Size(311, 311)).astype(int)
+        points = len(trajectory)
+        old, expected = best_of(pack_points_per_point, trajectory, PAUSE)
+        new, programs = best_of(pack_points, trajectory, PAUSE)
+        assert [p.commands.encode() for p in programs] == [
+            p.commands.encode() for p in expected
+        ]
+        size = sum(p.size for p in programs)
+        print(
+            f"{grid.X}x{grid.Y}: per-point {points / old / 1e3:7.1f} kpoints/s, "
+            f"vectorized {points / new / 1e3:7.1f} kpoints/s "
+            f"({size / new / 1e6:.1f} MB/s), {len(programs)} programs"
+        )
+
+
+if __name__ == "__main__":
+    main()
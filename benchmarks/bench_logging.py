@@ -0,0 +1,69 @@
+"""Benchmark per-point host overhead of logging, at DEBUG versus INFO.
+
+Rasters one program per point (RasterMode.POINT) against the simulated controller with motion
+taking no time, logging to a file like a production run, once at each level.
+Also times a single filtered-out debug call on a program, formatted eagerly with an f-string
+as the driver used to, and with its argument passed to loguru to format only if needed.
+
+Run with `python benchmarks/bench_logging.py`.
+"""
+
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+from loguru import logger
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.vmx import VMX, SerialCommand
+from stgctl.schema.models import Size
+
+GRID = Size(20, 20)
+# Limit switch positions as recorded by XYStage.startup for a 40000 x 40000 idx stage
+LIMIT_SWITCH_POSITIONS = [(0, 0), (0, -40000), (-40000, -40000), (-40000, 0), (0, 0)]
+CALLS = 100_000
+
+
+def raster(level: str, log: Path) -> float:
+    """Raster with logging at level, returning the time per point."""
+    logger.remove()
+    logger.add(log, level=level, enqueue=True)
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        stg.grid_size = GRID
+        stg.observing_time = 0
+        stg.limit_switch_positions = LIMIT_SWITCH_POSITIONS
+        try:
+            stg.home()
+            start = time.perf_counter()
+            stg.raster(signal=False, mode=RasterMode.POINT)
+            elapsed = time.perf_counter() - start
+        finally:
+            stg.VMX.close()
+    logger.complete()
+    return elapsed / len(stg.trajectory)
+
+
+def main() -> None:
+    """Print per-point overhead at each level, and the cost of a filtered debug call."""
+    log = Path(tempfile.mkdtemp()) / "bench.log"
+    for level in ("DEBUG", "INFO"):
+        per_point = raster(level, log)
+        print(f"{level:>5}: {1e3 * per_point:6.3f} ms per point")
+    logger.remove()
+    logger.add(log, level="INFO")
+    cmd = SerialCommand(["C", "IA1M-1867", "IA2M-3734", "P150", "R"])
+    eager = timeit.timeit(lambda: logger.debug(f"Writing command: {cmd}"), number=CALLS)
+    deferred = timeit.timeit(
+        lambda: logger.debug("Writing command: {}", cmd), number=CALLS
+    )
+    print(
+        f"filtered debug call: eager {1e6 * eager / CALLS:5.2f} us, "
+        f"deferred {1e6 * deferred / CALLS:5.2f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
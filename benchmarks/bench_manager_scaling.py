@@ -0,0 +1,79 @@
+"""Benchmark how host overhead scales with the number of controllers driven at once.
+
+Each round runs a one-move program on every controller and waits for all to complete.
+ControllerManager drives the simulated controllers from one event loop; the baseline drives
+one VMX per controller in turn, as separate XYStage instances in one process would.
+With instant motion the time per round is host and protocol overhead, which should stay flat
+per controller; with motion taking time, driving in parallel should keep a round as long as one move.
+The simulators run in the same process, so their work is counted too.
+
+Run with `python benchmarks/bench_manager_scaling.py`.
+"""
+
+import asyncio
+import time
+from contextlib import ExitStack
+
+from loguru import logger
+from stgctl.lib.manager import ControllerManager
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX
+
+CONTROLLERS = (1, 2, 4, 8, 16)
+ROUNDS = 20
+# A 100 idx move at the default speed and acceleration takes 0.16 s of simulated time
+MOVE = 100
+
+
+def move(vmx):
+    """The program run each round."""
+    return vmx.clear().move(idx=MOVE)
+
+
+async def managed(ports: list[str]) -> float:
+    """Time ROUNDS rounds with ControllerManager."""
+    async with ControllerManager(ports) as controllers:
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            await controllers.run(move)
+        return (time.perf_counter() - start) / ROUNDS
+
+
+def sequential(ports: list[str]) -> float:
+    """Time ROUNDS rounds with one VMX per controller, in turn."""
+    vmxs = [VMX(port=port) for port in ports]
+    try:
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for vmx in vmxs:
+                move(vmx).run().send()
+                vmx.wait_for_complete()
+        return (time.perf_counter() - start) / ROUNDS
+    finally:
+        for vmx in vmxs:
+            vmx.close()
+
+
+def main() -> None:
+    """Print ms per round for each number of controllers."""
+    logger.remove()
+    for time_scale in (0, 0.1):
+        print(f"time scale {time_scale}:")
+        for n in CONTROLLERS:
+            with ExitStack() as stack:
+                sims = [
+                    stack.enter_context(SimulatedVMX(time_scale=time_scale))
+                    for _ in range(n)
+                ]
+                ports = [sim.port for sim in sims]
+                parallel = asyncio.run(managed(ports))
+                baseline = sequential(ports)
+            print(
+                f"{n:>3} controllers: manager {1e3 * parallel:7.2f} ms per round "
+                f"({1e3 * parallel / n:5.2f} per controller), "
+                f"sequential {1e3 * baseline:7.2f} ms per round"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark controller idle time between raster segments, packed versus pipelined upload.
+
+Runs a raster against the simulated controller at 9600 baud, with motion sped up.
+Packed rasters stop after each batch of programs: the controller is idle from that batch's `^`
+until the next `R` arrives, while the host uploads the next batch. Pipelined rasters upload each
+segment while the previous one runs, and chain them on the controller: it is idle only from the
+`W` ending each segment until the host's `G`.
+
+Run with `python benchmarks/bench_pipelined_upload.py`.
+"""
+
+import statistics
+
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.schema.models import Size
+
+GRID = Size(10, 10)
+# Limit switch positions as recorded by XYStage.startup for a 40000 x 40000 idx stage
+LIMIT_SWITCH_POSITIONS = [(0, 0), (0, -40000), (-40000, -40000), (-40000, 0), (0, 0)]
+
+
+def main() -> None:
+    """Raster in each mode and report controller idle time between segments."""
+    logger.remove()
+    settings.PIPELINED_UPLOADS = True
+    sim = SimulatedVMX(time_scale=0.02, baud=9600)
+    settings.VMX_DEVICE_PORT = sim.port
+    stg = XYStage()
+    stg.grid_size = GRID
+    stg.observing_time = 0
+    stg.limit_switch_positions = LIMIT_SWITCH_POSITIONS
+    try:
+        stg.home()
+        for mode in (RasterMode.PACKED, RasterMode.PIPELINED):
+            first = len(sim.runs)
+            stg.raster(signal=False, mode=mode)
+            # The first R of a raster sets the speed, the rest run segments
+            runs = sim.runs[first + 1 :]
+            if mode == RasterMode.PACKED:
+                idle = [
+                    1e3 * (run.started - previous.completed)
+                    for previous, run in zip(runs, runs[1:])
+                ]
+            else:
+                # Every user wait chains segments, as there is no dwell
+                idle = [1e3 * (go - wait) for run in runs for wait, go in run.holds]
+            print(
+                f"{mode:>9}: idle at {len(idle)} hand-offs between segments, "
+                f"median {statistics.median(idle):6.2f} ms, max {max(idle):6.2f} ms"
+            )
+    finally:
+        stg.VMX.close()
+        sim.close()
+
+
+if __name__ == "__main__":
+    main()
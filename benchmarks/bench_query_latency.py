@@ -0,0 +1,76 @@
+"""Benchmark per-query latency of VMX immediate commands.
+
+Compares the framed reply reader against the old fixed 0.1 s sleep
+followed by a buffer drain, using the simulated controller.
+
+Run with `python benchmarks/bench_query_latency.py`.
+"""
+
+import statistics
+import time
+from collections.abc import Callable
+
+from baselines import without_reader
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX, Motor
+
+N_QUERIES = 20
+
+
+def sleep_readall(vmx: VMX) -> Callable[..., bytes]:
+    """The original reader, kept here as the baseline."""
+
+    def reader(*_) -> bytes:
+        vmx._serial.timeout = 0
+        time.sleep(0.1)
+        return vmx._serial.read(vmx._serial.in_waiting)
+
+    return reader
+
+
+def measure(query: Callable[[], bytes]) -> list[float]:
+    """Time N_QUERIES calls of query."""
+    latencies = []
+    for _ in range(N_QUERIES):
+        start = time.perf_counter()
+        query()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(reader_name: str, queries: dict[str, Callable[[], bytes]]) -> None:
+    """Time each query and print a summary."""
+    for name, query in queries.items():
+        lat_ms = [lat * 1e3 for lat in measure(query)]
+        print(
+            f"{reader_name:>6} {name:>6}: median {statistics.median(lat_ms):7.2f} ms, "
+            f"max {max(lat_ms):7.2f} ms"
+        )
+
+
+def main() -> None:
+    """Time verify and posn with both readers."""
+    logger.remove()
+    # Ask the VMX every time, rather than answering from the shadow state
+    settings.SHADOW_TTL = 0
+    sim = SimulatedVMX()
+    vmx = VMX(port=sim.port)
+    queries = {
+        "verify": vmx.verify,
+        "posn": lambda: vmx.posn(axis=Motor.X),
+    }
+    try:
+        with without_reader(vmx):
+            vmx._read_reply = sleep_readall(vmx)
+            run("sleep", queries)
+        del vmx._read_reply
+        run("framed", queries)
+    finally:
+        vmx.close()
+        sim.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Benchmark per-point host overhead of XYStage.raster in each RasterMode.
+
+Runs a raster with no dwell against the simulated controller with motion taking no time,
+so the wall-clock time per point is host and protocol overhead.
+
+Run with `python benchmarks/bench_raster_packing.py`.
+"""
+
+import time
+
+import numpy
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.schema.models import Size
+
+GRID = Size(20, 20)
+# Limit switch positions as recorded by XYStage.startup for a 40000 x 40000 idx stage
+LIMIT_SWITCH_POSITIONS = [(0, 0), (0, -40000), (-40000, -40000), (-40000, 0), (0, 0)]
+
+
+def main() -> None:
+    """Raster in each mode and report overhead per point."""
+    logger.remove()
+    # Pipelined uploads are opt-in, being unverified on the VMX
+    settings.PIPELINED_UPLOADS = True
+    sim = SimulatedVMX(time_scale=0)
+    settings.VMX_DEVICE_PORT = sim.port
+    stg = XYStage()
+    stg.grid_size = GRID
+    stg.observing_time = 0
+    stg.limit_switch_positions = LIMIT_SWITCH_POSITIONS
+    try:
+        stg.home()
+        for mode in RasterMode:
+            first = len(sim.runs)
+            start = time.perf_counter()
+            stg.raster(signal=False, mode=mode)
+            elapsed = time.perf_counter() - start
+            points = len(stg.trajectory)
+            runs = sim.runs[first:]
+            dwells = numpy.array([dwell for run in runs for dwell in run.dwells])
+            # Pipelined segments also wait for the host at their last point
+            dwells = dwells[numpy.r_[True, (dwells[1:] != dwells[:-1]).any(axis=1)]]
+            print(
+                f"{mode:>9}: {1e3 * elapsed / points:7.3f} ms per point, "
+                f"{len(runs)} programs run for {points} points, "
+                f"at most {numpy.abs(dwells - stg.trajectory).max()} idx off"
+            )
+    finally:
+        stg.VMX.close()
+        sim.close()
+
+
+if __name__ == "__main__":
+    main()
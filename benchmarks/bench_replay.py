@@ -0,0 +1,79 @@
+"""Benchmark host-side overhead of XYStage.raster by replaying captured serial traffic.
+
+Replies come from the capture as soon as they are due, so the elapsed time is the driver's
+and raster code's own overhead, and a change in what they send fails the replay outright.
+
+With no argument, a home and packed raster against the simulated controller are captured first.
+A real raster can be captured by running `stgctl stages run raster --use-saved` with
+STGCTL_CAPTURE set; pass the capture's path and run from the same directory and .env.
+
+Run with `python benchmarks/bench_replay.py [capture]`.
+"""
+
+import json
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.transport import ReplayTransport
+from stgctl.lib.vmx import VMX
+from stgctl.schema.models import Size
+
+GRID = Size(20, 20)
+# Limit switch positions as recorded by XYStage.startup for a 40000 x 40000 idx stage
+LIMIT_SWITCH_POSITIONS = [(0, 0), (0, -40000), (-40000, -40000), (-40000, 0), (0, 0)]
+
+
+def raster(vmx: VMX, simulated: bool) -> tuple[float, int]:
+    """Home and raster, as `stgctl stages run raster --use-saved` does.
+
+    Returns:
+        tuple[float, int]: elapsed time, and number of points
+    """
+    stg = XYStage(vmx=vmx)
+    if simulated:
+        stg.grid_size = GRID
+        stg.observing_time = 0
+        stg.limit_switch_positions = LIMIT_SWITCH_POSITIONS
+    else:
+        with open("limit_switch_positions.json") as f:
+            stg.limit_switch_positions = json.load(f)
+    start = time.perf_counter()
+    try:
+        stg.home()
+        stg.raster(signal=False, mode=RasterMode.PACKED)
+    finally:
+        vmx.close()
+    return time.perf_counter() - start, len(stg.trajectory)
+
+
+def main() -> None:
+    """Replay a capture and report the host-side time."""
+    logger.remove()
+    simulated = len(sys.argv) == 1
+    if simulated:
+        path = Path(tempfile.mkdtemp()) / "raster.cap"
+        settings.CAPTURE = str(path)
+        with SimulatedVMX(time_scale=0.01) as sim:
+            captured, _ = raster(VMX(port=sim.port), simulated)
+        settings.CAPTURE = ""
+        print(f"captured: {1e3 * captured:8.1f} ms")
+    else:
+        path = Path(sys.argv[1])
+    transport = ReplayTransport(path, speed=math.inf)
+    elapsed, points = raster(VMX(transport=transport), simulated)
+    print(
+        f"replayed: {1e3 * elapsed:8.1f} ms, {1e3 * elapsed / points:.3f} ms per point, "
+        f"{'all' if transport.finished else 'not all'} of the capture replayed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Benchmark connect-to-ready latency of VMX.startup.
+
+Compares the probe-first startup, connecting to a freshly powered on simulated controller
+and then reconnecting to it, with the previous unconditional sequence of jog, reset,
+a one second sleep, and polling for ready.
+
+Run with `python benchmarks/bench_startup.py`.
+"""
+
+import time
+
+from loguru import logger
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX
+
+RUNS = 5
+
+
+def old_startup(vmx: VMX) -> None:
+    """The previous startup sequence, as a baseline."""
+    vmx.jog()
+    vmx.reset()
+    time.sleep(1)
+    vmx.echo(echo_state=True)
+    while not vmx.isready():
+        time.sleep(0.1)
+
+
+def main() -> None:
+    """Connect repeatedly and report median connect-to-ready time."""
+    logger.remove()
+    sim = SimulatedVMX()
+    try:
+        probe = []
+        for _ in range(RUNS + 1):
+            vmx = VMX(port=sim.port)
+            probe.append(vmx.startup_time)
+            vmx.close()
+        vmx = VMX(port=sim.port)
+        old = []
+        for _ in range(RUNS):
+            start = time.monotonic()
+            old_startup(vmx)
+            old.append(time.monotonic() - start)
+        vmx.close()
+    finally:
+        sim.close()
+    cold, warm = probe[0], sorted(probe[1:])[RUNS // 2]
+    print(f"reset every time: {1e3 * sorted(old)[RUNS // 2]:8.1f} ms to ready")
+    print(f"probe, power on:  {1e3 * cold:8.1f} ms to ready")
+    print(f"probe, reconnect: {1e3 * warm:8.1f} ms to ready")
+
+
+if __name__ == "__main__":
+    main()
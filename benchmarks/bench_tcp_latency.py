@@ -0,0 +1,78 @@
+"""Benchmark round-trip latency of VMX over TCP, against the simulated controller.
+
+The simulator is served over TCP by TcpBridge, a local stand-in for a serial-to-Ethernet bridge.
+Compares the pty directly, SocketTransport, SocketTransport with Nagle's algorithm left on,
+and pyserial's own socket:// handler. Besides a status query, times two sends in a row
+followed by a wait for completion, where Nagle's algorithm holds back the second write
+until the first is acknowledged.
+
+Run with `python benchmarks/bench_tcp_latency.py`.
+"""
+
+import statistics
+import time
+from collections.abc import Callable
+
+import serial
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.simulator import SimulatedVMX, TcpBridge
+from stgctl.lib.transport import SocketTransport
+from stgctl.lib.vmx import VMX, Motor
+
+N_QUERIES = 200
+
+
+def two_sends(vmx: VMX) -> None:
+    """Set a speed, then move, as separate programs, and wait for both."""
+    vmx.clear().speed(speed=2000, motor=Motor.X).run().send()
+    vmx.clear().move(idx=1).run().send()
+    vmx.wait_for_complete(timeout=5)
+
+
+def measure(query: Callable[[], object]) -> list[float]:
+    """Time N_QUERIES calls of query, in ms."""
+    latencies = []
+    for _ in range(N_QUERIES):
+        start = time.perf_counter()
+        query()
+        latencies.append(1e3 * (time.perf_counter() - start))
+    return latencies
+
+
+def run(name: str, vmx: VMX) -> None:
+    """Time verify and two_sends, and print a summary."""
+    # Two sends without the optimizer dropping the repeated speed
+    vmx._optimize = lambda: None
+    for query_name, query in [
+        ("verify", vmx.verify),
+        ("two sends", lambda: two_sends(vmx)),
+    ]:
+        lat = measure(query)
+        print(
+            f"{name:>18} {query_name:>9}: median {statistics.median(lat):6.2f} ms, "
+            f"p99 {statistics.quantiles(lat, n=100)[98]:6.2f} ms"
+        )
+    vmx.close()
+
+
+def main() -> None:
+    """Time each transport against its own simulated controller."""
+    logger.remove()
+    # Ask the VMX every time, rather than answering from the shadow state
+    settings.SHADOW_TTL = 0
+    with SimulatedVMX(time_scale=0) as sim:
+        run("pty", VMX(port=sim.port))
+    transports = {
+        "SocketTransport": lambda url: SocketTransport.from_url(url),
+        "Nagle on": lambda url: SocketTransport.from_url(url, nodelay=False),
+        "pyserial socket://": lambda url: serial.serial_for_url(url, timeout=0),
+    }
+    for name, transport in transports.items():
+        # The bridge reads from the pty, so nothing else may
+        with SimulatedVMX(time_scale=0) as sim, TcpBridge(sim.port) as bridge:
+            run(name, VMX(transport=transport(bridge.url)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark CPU usage and wake latency of VMX.wait_for_complete.
+
+Compares the blocking waiter against the old busy-spinning read loop,
+using the simulated controller.
+
+Run with `python benchmarks/bench_wait_for_complete.py`.
+"""
+
+import statistics
+import time
+
+from baselines import without_reader
+from loguru import logger
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX
+
+N_PROGRAMS = 20
+RUN_TIME = 0.25
+
+
+def busy_wait_for_complete(vmx: VMX, timeout: float = 60.0) -> None:
+    """The original spinning implementation, kept here as the baseline."""
+    start = time.time()
+    vmx._serial.timeout = 0
+    vmx._serial.reset_input_buffer()
+    while abs(time.time() - start) < timeout:
+        if vmx._serial.read(1).decode() == "^":
+            return
+    raise TimeoutError
+
+
+def measure(vmx: VMX, sim: SimulatedVMX, waiter) -> tuple[list[float], float]:
+    """Run N_PROGRAMS programs and measure wake latency and CPU share of the waiter."""
+    latencies = []
+    cpu = wall = 0.0
+    for _ in range(N_PROGRAMS):
+        vmx.clear().pause(time=RUN_TIME).run().send()
+        wall_start, cpu_start = time.monotonic(), time.thread_time()
+        waiter(vmx)
+        woke = time.monotonic()
+        cpu += time.thread_time() - cpu_start
+        wall += woke - wall_start
+        latencies.append(woke - sim.runs[-1].completed)
+    return latencies, cpu / wall
+
+
+def report(name: str, latencies: list[float], cpu_share: float) -> None:
+    """Print a one-line summary."""
+    lat_us = sorted(lat * 1e6 for lat in latencies)
+    print(
+        f"{name:>8}: wake latency median {statistics.median(lat_us):8.1f} us, "
+        f"max {lat_us[-1]:8.1f} us, CPU {100 * cpu_share:5.1f} %"
+    )
+
+
+def main() -> None:
+    """Run both waiters against the same simulated controller."""
+    logger.remove()
+    sim = SimulatedVMX()
+    vmx = VMX(port=sim.port)
+    try:
+        with without_reader(vmx):
+            report("spin", *measure(vmx, sim, busy_wait_for_complete))
+        report("blocking", *measure(vmx, sim, VMX.wait_for_complete))
+    finally:
+        vmx.close()
+        sim.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
 """Command line interface for stgctl."""
 
 import json
+import time
 from importlib import metadata
+from pathlib import Path
 from typing import Annotated, Optional
 
 import typer
 from loguru import logger as logger
 
+from stgctl.core.settings import settings
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.latency import LatencyStats
+from stgctl.lib.plan import ROUND_TRIP, describe_motion, fastest_motion, plan_raster
+from stgctl.lib.program import RasterMode
 from stgctl.lib.stage import XYStage
 from stgctl.schema.models import Size
+from stgctl.util.trajectory import limit_travel, raster_geometry, stage_trajectory
 
 cli = typer.Typer()
 
@@ -44,6 +52,9 @@ def run(
         "--use-saved",
         help="Use saved limit switch positions. Must be in proper format.",
     ),
+    mode: RasterMode = typer.Option(
+        RasterMode.PACKED, "--mode", help="How raster points are sent to the VMX."
+    ),
 ):
     """Run stage sequences.
 
@@ -72,33 +83,32 @@ def run(
     typer.echo(f"Running {sequence} sequence.")
 
     logger.info("Initializing stages.")
-    stg = XYStage()
-
-    # switch based on sequence argument
-    match sequence:
-        case "startup":
-            # startup logic
-            logger.info("Running startup squence.")
-            stg.startup(save=save_ls_posns)
-        case "raster":
-            # rastering logic
-            logger.info("Entering rastering mode.")
-            if use_saved:
-                logger.info("Loading limit switch positions.")
-                with open("limit_switch_positions.json") as f:
-                    stg.limit_switch_positions = json.load(f)
+    with XYStage() as stg:
+        # switch based on sequence argument
+        match sequence:
+            case "startup":
+                # startup logic
+                logger.info("Running startup squence.")
+                stg.startup(save=save_ls_posns)
+            case "raster":
+                # rastering logic
+                logger.info("Entering rastering mode.")
+                if use_saved:
+                    logger.info("Loading limit switch positions.")
+                    with open("limit_switch_positions.json") as f:
+                        stg.limit_switch_positions = json.load(f)
+                    stg.home()
+                else:
+                    stg.startup()
+                stg.raster(signal=not no_signal, mode=mode)
+            case "home":
+                # homing logic
+                logger.info("Entering homing mode.")
                 stg.home()
-            else:
-                stg.startup()
-            stg.raster(signal=not no_signal)
-        case "home":
-            # homing logic
-            logger.info("Entering homing mode.")
-            stg.home()
-        case "test-signal":
-            # test signal logic
-            logger.info("Running signal test sequence.")
-            stg.test_signal_setup()
+            case "test-signal":
+                # test signal logic
+                logger.info("Running signal test sequence.")
+                stg.test_signal_setup()
 
 
 @stages_cli.command()
@@ -116,11 +126,141 @@ def goto(
     )
 
     # Initialize the XYStage instance
-    stg = XYStage()
+    with XYStage() as stg:
+        # Call the goto method with the passed coordinates
+        coord = Size(X=x, Y=y)
+        stg.goto(coord=coord, relative=relative, speed=speed)
+
+
+@stages_cli.command()
+def plan(
+    mode: Optional[list[RasterMode]] = typer.Option(
+        None, "--mode", help="Raster mode to plan, repeatable. Defaults to all."
+    ),
+    round_trip: float = typer.Option(
+        1e3 * ROUND_TRIP, "--round-trip", help="Host round trip to the VMX, in ms."
+    ),
+    use_saved: bool = typer.Option(
+        False,
+        "--use-saved",
+        help="Use saved limit switch positions. Must be in proper format.",
+    ),
+):
+    """Plan a raster from the current settings, without touching the stages.
+
+    The grid is spread between saved limit switch positions, as a raster after startup
+    would be, unless STGCTL_STEP_SIZE is set.
+    """
+    grid_size = Size(*settings.GRID_SIZE)
+    travel = None
+    if use_saved:
+        with open("limit_switch_positions.json") as f:
+            travel = limit_travel(json.load(f))
+    try:
+        step_size, travel = raster_geometry(
+            grid_size, Size(*settings.STEP_SIZE) if settings.STEP_SIZE else None, travel
+        )
+    except ValueError as e:
+        raise typer.BadParameter(f"{e} Pass --use-saved to use a saved file.") from e
+    trajectory = stage_trajectory(grid_size, step_size, travel)
+    speed, accel = fastest_motion(
+        trajectory, Size(*settings.SPEED_LIMIT), Size(*settings.ACCEL_LIMIT)
+    )
+    plans = []
+    for raster_mode in mode or list(RasterMode):
+        try:
+            plans.append(
+                plan_raster(
+                    trajectory,
+                    grid_size,
+                    settings.OBSERVE_TIME,
+                    raster_mode,
+                    speed,
+                    accel,
+                    round_trip=round_trip / 1e3,
+                )
+            )
+        except InvalidVMXCommandError as e:
+            typer.echo(f"{raster_mode}: {e}")
+    if not plans:
+        raise typer.Exit(1)
+    typer.echo(
+        f"{plans[0].points} points on a {grid_size.X}x{grid_size.Y} grid, "
+        f"travel X {plans[0].travel.X} idx, Y {plans[0].travel.Y} idx."
+    )
+    typer.echo(f"Rastering at {describe_motion(trajectory, speed, accel)}.")
+    typer.echo(
+        f"{'mode':>10} {'uploads':>8} {'trips':>8} {'bytes':>9} "
+        f"{'moving':>9} {'dwelling':>9} {'waiting':>9} {'total':>9}"
+    )
+    for p in plans:
+        times = " ".join(
+            f"{_hms(t):>9}" for t in (p.moving, p.dwelling, p.waiting, p.duration)
+        )
+        typer.echo(
+            f"{p.mode:>10} {p.uploads:>8} {p.round_trips:>8} {p.program_bytes:>9} {times}"
+        )
 
-    # Call the goto method with the passed coordinates
-    coord = Size(X=x, Y=y)
-    stg.goto(coord=coord, relative=relative, speed=speed)
+
+def _hms(seconds: float) -> str:
+    """Format a duration as h:mm:ss.
+
+    Args:
+        seconds (float): duration
+
+    Returns:
+        str: the duration
+    """
+    minutes, secs = divmod(round(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02}:{secs:02}"
+
+
+@cli.command()
+def simulate(
+    time_scale: float = typer.Option(
+        1.0, "--time-scale", help="Wall-clock seconds per simulated second."
+    ),
+):
+    """Run a simulated VMX on a pseudo-terminal until interrupted."""
+    # pty is not available on every platform
+    from stgctl.lib.simulator import SimulatedVMX
+
+    with SimulatedVMX(time_scale=time_scale) as sim:
+        typer.echo(
+            f"Simulated VMX on {sim.port}. Use it with STGCTL_VMX_DEVICE_PORT={sim.port}"
+        )
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command()
+def latency(
+    path: str = typer.Option(
+        settings.LATENCY_FILE, "--file", help="Saved latency histograms."
+    ),
+    reset: bool = typer.Option(
+        False, "--reset", help="Delete the histograms after printing them."
+    ),
+):
+    """Print VMX round trip latencies saved by earlier runs, in ms."""
+    file = Path(path).expanduser()
+    if not path or not file.exists():
+        typer.echo("No latencies saved. Set STGCTL_LATENCY_FILE to save them.")
+        raise typer.Exit(1)
+    typer.echo(
+        f"{'command':>10} {'to':>10} {'count':>8} {'mean':>8} {'p50':>8} "
+        f"{'p90':>8} {'p99':>8} {'max':>8}"
+    )
+    for row in LatencyStats.load(file).summary():
+        times = " ".join(
+            f"{1e3 * row[k]:8.3f}" for k in ("mean", "p50", "p90", "p99", "max")
+        )
+        typer.echo(f"{row['command']:>10} {row['to']:>10} {row['count']:>8} {times}")
+    if reset:
+        file.unlink()
 
 
 @cli.command()
@@ -1,7 +1,9 @@
 """Global settings for stgctl, including logs."""
 
 import atexit
+import contextlib
 import functools
+import sys
 from datetime import datetime
 from pathlib import Path
 from re import Pattern
@@ -14,9 +16,6 @@ log_path = Path("./logs") / Path(
     f'stgctl_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.log'
 )
 
-# add a file handler
-logger.add(log_path.absolute(), enqueue=True)
-
 
 def delete_empty_logs(log_file: Path) -> None:
     """If an empty logfile is created, delete it.
@@ -26,7 +25,7 @@ def delete_empty_logs(log_file: Path) -> None:
     Args:
         log_file (Path): Path to logfile created this run.
     """
-    if log_file.stat().st_size == 0:
+    if log_file.exists() and log_file.stat().st_size == 0:
         log_file.unlink()
 
 
@@ -40,14 +39,33 @@ class Settings(BaseSettings):
 
     VMX_DEVICE_PORT: str = ""
     VMX_DEVICE_REGEX: str | Pattern[str] = "USB-to-Serial"
+    VMX_DEVICE_SERIAL: str = ""
+    CONNECT_TIMEOUT: float = 5.0
+    RECONNECT_ATTEMPTS: int = 3
+    PORT_CACHE: str = str(Path.home() / ".cache" / "stgctl" / "ports.json")
     LOGURU_LEVEL: str = "DEBUG"
+    LOG_INTERVAL: float = 10.0
     GRID_SIZE: tuple[int, int] = (60, 60)
     STEP_SIZE: tuple[int, int] | None = None
     OBSERVE_TIME: int = 15
+    SPEED_LIMIT: tuple[int, int] = (1500, 1500)
+    ACCEL_LIMIT: tuple[int, int] = (2, 2)
+    HOMING_FAST_SPEED: int = 2000
+    HOMING_SPEED: int = 250
+    HOMING_BACKOFF: int = 400
+    TIMEOUT_SCALE: float = 1.25
+    TIMEOUT_MARGIN: float = 5.0
+    DAQ_EVENT: str = ""
     SIGNAL_HOST: str = "localhost"
     SIGNAL_USER: str = ""
     START_AQ_CMD: str = "hostname"
     END_AQ_CMD: str = "hostname"
+    OPTIMIZE_PROGRAMS: bool = True
+    PIPELINED_UPLOADS: bool = False
+    SHADOW_TTL: float = 1.0
+    CAPTURE: str = ""
+    TELEMETRY_INTERVAL: float = 0.0
+    LATENCY_FILE: str = ""
 
     class Config:
         env_prefix = "STGCTL_"
@@ -60,3 +78,31 @@ class Settings(BaseSettings):
 
 
 settings = Settings()
+
+
+# Handlers added by configure_logging, so it can replace them without touching anyone else's
+_handler_ids: list[int] = []
+
+
+def configure_logging(level: str) -> None:
+    """Log to stderr and to this run's log file, at level and above.
+
+    Messages below level are then dropped before they are formatted,
+    as long as they pass their arguments to loguru rather than formatting them first.
+    Handlers from an earlier call are replaced; handlers added elsewhere are left alone.
+
+    Args:
+        level (str): loguru level name, eg "DEBUG" or "INFO"
+    """
+    for handler_id in _handler_ids:
+        logger.remove(handler_id)
+    _handler_ids[:] = [
+        logger.add(sys.stderr, level=level),
+        logger.add(log_path.absolute(), level=level, enqueue=True),
+    ]
+
+
+# loguru's default stderr handler, which our own replaces at the configured level
+with contextlib.suppress(ValueError):
+    logger.remove(0)
+configure_logging(settings.LOGURU_LEVEL)
@@ -0,0 +1,302 @@
+"""Asyncio driver for VMX motor controller."""
+import asyncio
+import time
+from collections.abc import Awaitable
+from pprint import pformat
+from typing import Self
+
+from loguru import logger
+from stgctl.core.settings import settings
+from stgctl.lib.exceptions import VmxNotReadyError
+from stgctl.lib.reader import Received, Reply, ReplyDemux, ReplyKind
+from stgctl.lib.transport import open_port
+from stgctl.lib.vmx import BaseVMX, SerialCommand
+
+
+class AsyncVMX(BaseVMX):
+    """Asyncio-native driver for VMX motor controller.
+
+    Mirrors the VMX builder API. Queued commands are built and sent exactly as with VMX,
+    while anything that reads a reply (immediate commands, `now=True`, and wait_for_complete)
+    returns an awaitable instead of blocking. Status requests are sent one at a time, as each
+    awaitable is awaited, so queries gathered together each get their own reply.
+
+    The serial file descriptor is watched with `loop.add_reader`, so motion, signalling,
+    and telemetry can all run concurrently in one event loop without threads.
+    Incoming bytes are sorted by the same ReplyDemux the VMX reader thread uses.
+
+    Example:
+        async with AsyncVMX(port) as vmx:
+            vmx.clear().move(idx=-400, motor=Motor.X).run().send()
+            await vmx.wait_for_complete()
+            x = await vmx.posn(axis=Motor.X)
+    """
+
+    def __init__(self, port: str | None = None) -> None:
+        """Initialize an AsyncVMX instance.
+
+        The port is opened immediately, but nothing is read until `connect` is awaited
+        (or the instance is used as an async context manager).
+
+        Args:
+            port (str, optional): The port on which the motor controller is connected, or socket://host:port for a serial-to-Ethernet bridge. If not provided, the port will be determined automatically.
+        """
+        logger.opt(lazy=True).debug(
+            "Using settings:\n{}", lambda: pformat(settings.dict())
+        )
+        port = self._find_port(port)
+        logger.debug(f"Using serial port '{port}'")
+        super().__init__()
+        # The event loop watches the port's file descriptor, which a reconnect would change
+        self._serial = open_port(
+            port, connect_timeout=settings.CONNECT_TIMEOUT, reconnect_attempts=0
+        )
+        self._demux = ReplyDemux()
+        self._queues: dict[ReplyKind, asyncio.Queue[Received]] = {
+            kind: asyncio.Queue() for kind in ReplyKind
+        }
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Held from sending a status request until its reply is read, as the demux
+        # and the STATUS queue can only wait for one reply at a time
+        self._status_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> Self:
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self.close()
+
+    async def connect(self) -> None:
+        """Start watching the serial port and run the startup sequence."""
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._serial.fileno(), self._on_readable)
+        await self.startup()
+
+    async def startup(self) -> None:
+        """Initialize VMX.
+
+        Same sequence as VMX.startup, without blocking the event loop.
+
+        Raises:
+            VmxNotReadyError: Returns error if VMX does not send ready response
+        """
+        start_time = time.monotonic()
+        await self.echo(echo_state=True)
+        state = await self.verify()
+        if state != b"R":
+            logger.info(f"VMX reports {state!r} rather than ready, resetting it.")
+            await self._recover()
+        self.startup_time = time.monotonic() - start_time
+        logger.info(f"VMX ready {1e3 * self.startup_time:.0f} ms after connecting.")
+
+    async def _recover(self) -> None:
+        """Private method resetting the VMX until it reports ready.
+
+        Raises:
+            VmxNotReadyError: Raised when the VMX is not ready after RESET_ATTEMPTS resets.
+        """
+        for attempt in range(1, BaseVMX.RESET_ATTEMPTS + 1):
+            # See VMX._recover for why jog comes first
+            await self.jog()
+            await self.reset()
+            deadline = time.monotonic() + BaseVMX.RESET_TIMEOUT
+            while time.monotonic() < deadline:
+                await self.echo(echo_state=True)
+                state = await self.verify()
+                if state == b"R":
+                    return
+                await asyncio.sleep(BaseVMX.READY_POLL)
+            logger.warning(
+                f"VMX reports {state!r} after reset {attempt} of {BaseVMX.RESET_ATTEMPTS}."
+            )
+        raise VmxNotReadyError("Connecting to the VMX has timed out.")
+
+    def close(self) -> None:
+        """Stop watching the serial port and close it."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self._serial.fileno())
+        self._loop = None
+        self._save_latency()
+        self._log_durations()
+        logger.debug("Closing serial connection to VMX.")
+        self._serial.close()
+
+    def _on_readable(self) -> None:
+        """Private callback run by the event loop when the serial port has data."""
+        data = self._serial.read(max(1, self._serial.in_waiting))
+        self._route(self._demux.feed(data, time.monotonic()))
+
+    def _route(self, received: list[Received]) -> None:
+        """Private method queueing replies by kind.
+
+        Args:
+            received (list[Received]): replies from the demux
+        """
+        for reply in received:
+            self._queues[reply.kind].put_nowait(reply)
+
+    def _clear(self, kind: ReplyKind) -> None:
+        """Private method dropping every queued reply of one kind.
+
+        Args:
+            kind (ReplyKind): kind of reply to drop
+        """
+        q = self._queues[kind]
+        while not q.empty():
+            q.get_nowait()
+
+    def _write(self, cmd: SerialCommand) -> None:
+        """Private method for writing commands to VMX.
+
+        Args:
+            cmd (SerialCommand): Serial command to send to VMX
+        """
+        logger.debug("Writing command: {}", cmd)
+        data = cmd.encode()
+        if self._echoing:
+            self._demux.expect_echo(data)
+        self._serial.write(data)
+
+    def _transact(self) -> Awaitable[bytes]:
+        """Private method sending the queued command and returning an awaitable of its reply.
+
+        Commands with no reply are sent right away. Status requests are taken off the command
+        queue now, but sent once no other status request is waiting on its reply, so queries
+        gathered together each get their own reply.
+
+        Returns:
+            Awaitable[bytes]: VMX reply
+        """
+        local = self._local_reply()
+        if local is not None:
+            logger.debug("Answered {} from shadow state: {}", self._cmd, local)
+            self._reset()
+            return self._answered(local)
+        reply = self._expected_reply()
+        if reply[0] is Reply.NONE:
+            cmd = list(self._cmd)
+            self.send()
+            self._observe(cmd, b"")
+            return self._answered(b"")
+        cmd = self._cmd
+        self._reset()
+        return self._exchange(cmd, reply)
+
+    @staticmethod
+    async def _answered(reply: bytes) -> bytes:
+        """Private coroutine returning a reply that is already known.
+
+        Args:
+            reply (bytes): reply
+
+        Returns:
+            bytes: the same reply
+        """
+        return reply
+
+    async def _exchange(self, cmd: SerialCommand, reply: tuple[Reply, float]) -> bytes:
+        """Private coroutine sending a status request and reading its reply, one request at a time.
+
+        Args:
+            cmd (SerialCommand): status request
+            reply (tuple[Reply, float]): shape of the expected reply, and time to wait for it
+
+        Returns:
+            bytes: VMX reply
+        """
+        async with self._status_lock:
+            # Drop stale replies and tell the demux what to look for before the VMX can answer
+            self._clear(ReplyKind.STATUS)
+            self._demux.expect(reply[0])
+            # Leave any program being built meanwhile where it was
+            pending, self._cmd = self._cmd, cmd
+            try:
+                self.send()
+            finally:
+                self._cmd = pending
+            readout = await self._read_reply(*reply)
+        self._observe(list(cmd), readout)
+        return readout
+
+    async def _read_reply(self, reply: Reply, timeout: float) -> bytes:
+        """Private method for reading a single framed reply.
+
+        Args:
+            reply (Reply): shape of the expected reply
+            timeout (float): time, in seconds, to wait for a complete reply
+
+        Returns:
+            bytes: Reply bytes. May be partial if the deadline passed.
+        """
+        if reply is Reply.NONE:
+            return b""
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    try:
+                        received = await asyncio.wait_for(
+                            self._queues[ReplyKind.STATUS].get(), ReplyDemux.TEXT_QUIET
+                        )
+                        self._record_reply(received)
+                        readout = received.data
+                        break
+                    except TimeoutError:
+                        # TEXT replies end when the port goes quiet
+                        self._route(self._demux.idle(time.monotonic()))
+        except TimeoutError:
+            logger.warning(f"Timed out waiting for {reply.name} reply.")
+            readout = self._demux.cancel()
+        logger.debug("Serial read: {}", readout)
+        return readout
+
+    async def wait_for_complete(self, timeout: float | None = 60.0) -> None:
+        """Wait until VMX program returns program-complete response.
+
+        Args:
+            timeout (float | None): Time to wait until program considered a failure. Defaults to 60.0.
+                None waits as long as the motion model predicts, plus a margin (see VMX.wait_for_complete).
+
+        Raises:
+            TimeoutError: Raised when program takes longer than timeout.
+        """
+        # See VMX.wait_for_complete: earlier programs' completions are consumed too
+        try:
+            async with asyncio.timeout(self._complete_within(timeout)):
+                while True:
+                    self._record_complete(await self._queues[ReplyKind.COMPLETE].get())
+                    self._outstanding = max(0, self._outstanding - 1)
+                    if not self._outstanding:
+                        self._runs.clear()
+                        return
+        except TimeoutError:
+            self.shadow.forget()
+            msg = "Waiting for program to complete timed out."
+            raise TimeoutError(msg) from None
+
+    async def wait_for_user(self, timeout: float = 60.0) -> None:
+        """Wait until a running program reaches `user_wait` and sends W.
+
+        Args:
+            timeout (float): Time to wait, in seconds. Defaults to 60.0.
+
+        Raises:
+            TimeoutError: Raised when no W arrives within timeout.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                received = await self._queues[ReplyKind.USER_WAIT].get()
+            self._held_since = received.end
+        except TimeoutError:
+            msg = "Waiting for program to reach a user wait timed out."
+            raise TimeoutError(msg) from None
+
+    async def isready(self) -> bool:
+        """Checks for VMX ready response.
+
+        Returns:
+            bool: If the VMX returns R, returns True.
+        """
+        state = await self.verify()
+        logger.debug("isready state is {!r}", state)
+        return state == b"R"
@@ -0,0 +1,311 @@
+"""How a raster dwells at each point: a fixed pause, or until the DAQ is done with it."""
+import os
+import select
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from pathlib import Path
+from urllib.parse import urlparse
+
+from loguru import logger
+from stgctl.lib.program import dwell_command
+from stgctl.lib.vmx import VMX, BaseVMX
+
+
+class DaqEvent(ABC):
+    """Signal from the data acquisition system that it is done with a raster point."""
+
+    def arm(self, point: int) -> None:  # noqa: B027
+        """Start watching for the DAQ to be done with a point.
+
+        Called once the stages are at the point, so before the DAQ can be done with it.
+
+        Args:
+            point (int): index of the point in the trajectory
+        """
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        """Wait for the DAQ to be done with the armed point.
+
+        Args:
+            timeout (float): Time to wait, in seconds.
+
+        Returns:
+            bool: True once the DAQ is done, False if it was not within timeout
+        """
+
+    def close(self) -> None:  # noqa: B027
+        """Release anything held open."""
+
+
+class CallbackEvent(DaqEvent):
+    """DAQ done when a callback says so, eg one that runs the acquisition itself."""
+
+    def __init__(self, callback: Callable[[int, float], bool]) -> None:
+        """Initialize CallbackEvent.
+
+        Args:
+            callback (Callable[[int, float], bool]): given the point and the timeout,
+                returns True once the DAQ is done with the point, or False if it timed out.
+        """
+        self.callback = callback
+        self._point = 0
+
+    def arm(self, point: int) -> None:
+        """Note the point to pass to the callback.
+
+        Args:
+            point (int): index of the point in the trajectory
+        """
+        self._point = point
+
+    def wait(self, timeout: float) -> bool:
+        """Run the callback.
+
+        Args:
+            timeout (float): Time to wait, in seconds.
+
+        Returns:
+            bool: what the callback returned
+        """
+        return self.callback(self._point, timeout)
+
+
+class FileEvent(DaqEvent):
+    """DAQ done when it touches a file."""
+
+    # Time between checks of the file, in seconds
+    POLL: float = 0.005
+
+    def __init__(self, path: str | Path) -> None:
+        """Initialize FileEvent.
+
+        Args:
+            path (str | Path): file the DAQ touches (or writes) when it is done with a point
+        """
+        self.path = Path(path)
+        self._armed: int | None = None
+
+    def arm(self, point: int) -> None:
+        """Note when the file was last touched.
+
+        Args:
+            point (int): index of the point in the trajectory
+        """
+        self._armed = self._mtime()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for the file to be touched after arming.
+
+        Args:
+            timeout (float): Time to wait, in seconds.
+
+        Returns:
+            bool: True once touched, False if not touched within timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self._mtime() == self._armed:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL)
+        return True
+
+    def _mtime(self) -> int | None:
+        """Private method for the file's modification time, or None if it does not exist.
+
+        Returns:
+            int | None: modification time in ns
+        """
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+class SocketEvent(DaqEvent):
+    """DAQ done when it sends a UDP datagram, of any content, to a local port."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """Initialize SocketEvent, listening on host:port.
+
+        Args:
+            host (str): Address to listen on. Defaults to 127.0.0.1.
+            port (int): Port to listen on. Defaults to 0, any free port (see `address`).
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.setblocking(False)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """Host and port the DAQ sends to.
+
+        Returns:
+            tuple[str, int]: address listened on
+        """
+        return self._socket.getsockname()
+
+    def arm(self, point: int) -> None:
+        """Drop datagrams sent before the stages got to the point.
+
+        Args:
+            point (int): index of the point in the trajectory
+        """
+        try:
+            while True:
+                self._socket.recv(1024)
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for a datagram.
+
+        Args:
+            timeout (float): Time to wait, in seconds.
+
+        Returns:
+            bool: True once one arrives, False if none arrived within timeout
+        """
+        ready, _, _ = select.select([self._socket], [], [], timeout)
+        if not ready:
+            return False
+        self._socket.recv(1024)
+        return True
+
+    def close(self) -> None:
+        """Stop listening."""
+        self._socket.close()
+
+
+def event_from_url(url: str) -> DaqEvent:
+    """Make the DaqEvent a URL describes.
+
+    Args:
+        url (str): udp://host:port to wait for a datagram, or file:///path (or a plain path)
+            to wait for a file to be touched
+
+    Raises:
+        ValueError: Raised when the scheme is not understood.
+
+    Returns:
+        DaqEvent: the event
+    """
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "udp":
+            return SocketEvent(parsed.hostname or "127.0.0.1", parsed.port or 0)
+        case "file":
+            return FileEvent(parsed.path)
+        case "":
+            return FileEvent(url)
+    raise ValueError(f"Unsupported DAQ event {url!r}, use udp://host:port or a path.")
+
+
+class DwellStrategy(ABC):
+    """How the stages dwell at each raster point.
+
+    Programs dwell at each point with `command` (or, built one point at a time, with `queue`).
+    After running a program, the host calls `serve` with the number of points it visits,
+    before waiting for it to complete.
+    """
+
+    @property
+    @abstractmethod
+    def command(self) -> str:
+        """Command run at every point, once the stages are there."""
+
+    def queue(self, vmx: VMX) -> None:
+        """Append the dwell to the VMX command queue.
+
+        Args:
+            vmx (VMX): VMX instance
+        """
+        vmx.command_queue.append(self.command)
+
+    def serve(self, vmx: VMX, points: int, timeout: float = 600.0) -> None:  # noqa: B027
+        """Do whatever the host does while a program dwells at its points.
+
+        Args:
+            vmx (VMX): VMX running the program
+            points (int): number of points the program visits
+            timeout (float): Time to wait for the stages to reach a point, in seconds. Defaults to 600.0.
+        """
+
+    def close(self) -> None:  # noqa: B027
+        """Release anything held open."""
+
+
+class FixedDwell(DwellStrategy):
+    """Pause for a fixed time at every point, with no host involvement."""
+
+    def __init__(self, seconds: float) -> None:
+        """Initialize FixedDwell.
+
+        Args:
+            seconds (float): time to pause at each point
+        """
+        self.seconds = seconds
+
+    @property
+    def command(self) -> str:
+        """The pause."""
+        return dwell_command(self.seconds)
+
+
+class HandshakeDwell(DwellStrategy):
+    """Dwell at every point until the DAQ is done with it, using the VMX user wait.
+
+    Each point ends with U6: the VMX sends W and waits. The host then waits for `event`
+    and sends G as soon as it fires, so a point costs one byte each way on top of however
+    long acquisition actually takes. If the event does not fire within `timeout`, a warning is
+    logged and the stages move on, so no point dwells much longer than a FixedDwell would.
+
+    Attributes:
+        points (int): Points dwelt at so far.
+        waited (float): Total time spent waiting for the DAQ, in seconds.
+    """
+
+    def __init__(self, event: DaqEvent, timeout: float) -> None:
+        """Initialize HandshakeDwell.
+
+        Args:
+            event (DaqEvent): fires when the DAQ is done with a point
+            timeout (float): longest time to wait for it at each point, in seconds
+        """
+        self.event = event
+        self.timeout = timeout
+        self.points = 0
+        self.waited = 0.0
+
+    @property
+    def command(self) -> str:
+        """The user wait, U6."""
+        return BaseVMX.USER_WAIT
+
+    def serve(self, vmx: VMX, points: int, timeout: float = 600.0) -> None:
+        """Answer the W at each point once the DAQ is done with it.
+
+        Args:
+            vmx (VMX): VMX running the program
+            points (int): number of points the program visits
+            timeout (float): Time to wait for the stages to reach a point, in seconds. Defaults to 600.0.
+        """
+        for _ in range(points):
+            vmx.wait_for_user(timeout=timeout)
+            start = time.monotonic()
+            self.event.arm(self.points)
+            if not self.event.wait(self.timeout):
+                logger.warning(
+                    f"DAQ did not finish point {self.points} within {self.timeout} s, moving on."
+                )
+            vmx.go()
+            waited = time.monotonic() - start
+            logger.debug("Dwelt {:.3f} s at point {}.", waited, self.points)
+            self.waited += waited
+            self.points += 1
+
+    def close(self) -> None:
+        """Release the event."""
+        self.event.close()
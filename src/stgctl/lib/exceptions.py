@@ -17,3 +17,9 @@ class InvalidVMXCommandError(Exception):
     """Raised when a command is invalid."""
 
     pass
+
+
+class ReplayMismatchError(Exception):
+    """Raised when the host writes something other than what a replayed capture expects."""
+
+    pass
@@ -0,0 +1,252 @@
+"""Fixed-memory latency histograms for VMX round trips."""
+import bisect
+import itertools
+import json
+import math
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from loguru import logger
+
+# What a latency is measured to: the first byte of the reply, or its end
+FIRST_BYTE: str = "first_byte"
+COMPLETE: str = "complete"
+
+
+class LatencyHistogram:
+    """HDR-style histogram of latencies, in fixed memory.
+
+    Buckets are spaced logarithmically, BUCKETS_PER_OCTAVE to each doubling, from RESOLUTION
+    up to RESOLUTION * 2**OCTAVES, so any recorded latency is known to within about 4.5%.
+    Latencies outside that range are counted in the first or last bucket;
+    the exact minimum and maximum are kept as well.
+    """
+
+    # Smallest latency told apart from zero, in seconds
+    RESOLUTION: float = 1e-6
+    BUCKETS_PER_OCTAVE: int = 16
+    # 2**30 us is about 18 minutes
+    OCTAVES: int = 30
+
+    def __init__(self) -> None:
+        """Initialize an empty LatencyHistogram."""
+        # A list rather than an array, as incrementing it is several times faster
+        self.counts = [0] * (self.BUCKETS_PER_OCTAVE * self.OCTAVES + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, latency: float) -> None:
+        """Count one latency.
+
+        Args:
+            latency (float): latency in seconds
+        """
+        ratio = latency / self.RESOLUTION
+        bucket = (
+            int(math.log2(ratio) * self.BUCKETS_PER_OCTAVE) + 1 if ratio >= 1 else 0
+        )
+        if bucket >= len(self.counts):
+            bucket = len(self.counts) - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += latency
+        if latency < self.min:
+            self.min = latency
+        if latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self) -> float:
+        """Mean latency in seconds, or nan if nothing was recorded."""
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, q: float) -> float:
+        """Latency below which a fraction of recorded latencies fall.
+
+        Args:
+            q (float): percentile, 0 to 100
+
+        Returns:
+            float: latency in seconds, at the middle of its bucket and within the recorded
+            minimum and maximum, which are exact. nan if nothing was recorded.
+        """
+        if not self.count:
+            return math.nan
+        if q <= 0:
+            return self.min
+        if q >= 100:
+            return self.max
+        rank = max(1, math.ceil(q / 100 * self.count))
+        bucket = bisect.bisect_left(list(itertools.accumulate(self.counts)), rank)
+        if bucket == 0:
+            estimate = self.RESOLUTION / 2
+        else:
+            estimate = self.RESOLUTION * 2 ** ((bucket - 0.5) / self.BUCKETS_PER_OCTAVE)
+        return min(max(estimate, self.min), self.max)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add the latencies counted by another histogram.
+
+        Args:
+            other (LatencyHistogram): histogram to add
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts, strict=True)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> dict:
+        """Compact representation, with only the buckets in use.
+
+        Returns:
+            dict: suitable for JSON
+        """
+        return {
+            "buckets": {i: n for i, n in enumerate(self.counts) if n},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        """Rebuild a histogram from to_dict.
+
+        Args:
+            data (dict): as returned by to_dict
+
+        Returns:
+            LatencyHistogram: the histogram
+        """
+        histogram = cls()
+        for i, n in data["buckets"].items():
+            histogram.counts[int(i)] = n
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = math.inf if data["min"] is None else data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class LatencyStats:
+    """Latency histograms by command and by what the latency is measured to.
+
+    Commands are named by `command_name`. Latencies are measured from the write, to the
+    FIRST_BYTE of the reply and to the COMPLETE reply; for programs run, COMPLETE is the ^.
+    """
+
+    def __init__(self) -> None:
+        """Initialize LatencyStats with no histograms."""
+        self.histograms: dict[tuple[str, str], LatencyHistogram] = {}
+        # Histograms are created on the thread sending commands, and read from others
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def command_name(cmd: list[str]) -> str:
+        """Name latencies of a command are grouped under.
+
+        Args:
+            cmd (list[str]): commands sent together
+
+        Returns:
+            str: "run" for programs that are run, "program" for other multi-command sends,
+            else the command itself, eg "V" or "X"
+        """
+        if "R" in cmd:
+            return "run"
+        if len(cmd) > 1:
+            return "program"
+        return cmd[0] if cmd else ""
+
+    def record(self, command: str, to: str, latency: float) -> None:
+        """Count one latency.
+
+        Args:
+            command (str): command name
+            to (str): FIRST_BYTE or COMPLETE
+            latency (float): latency in seconds
+        """
+        histogram = self.histograms.get((command, to))
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(
+                    (command, to), LatencyHistogram()
+                )
+        histogram.record(latency)
+
+    def summary(self) -> list[dict]:
+        """Count, mean, percentiles and maximum of every histogram.
+
+        Returns:
+            list[dict]: one row per histogram, latencies in seconds, sorted by command
+        """
+        with self._lock:
+            items = sorted(self.histograms.items())
+        return [
+            {
+                "command": command,
+                "to": to,
+                "count": h.count,
+                "mean": h.mean,
+                "p50": h.percentile(50),
+                "p90": h.percentile(90),
+                "p99": h.percentile(99),
+                "max": h.max,
+            }
+            for (command, to), h in items
+        ]
+
+    def save(self, path: str | Path) -> None:
+        """Merge the histograms into a JSON file, creating it if needed.
+
+        The file is replaced in one rename. Two processes saving at once do not corrupt it,
+        but the last to save may drop what the other merged.
+
+        Args:
+            path (str | Path): file to merge into
+        """
+        path = Path(path).expanduser()
+        merged = LatencyStats.load(path) if path.exists() else LatencyStats()
+        with self._lock:
+            items = list(self.histograms.items())
+        for key, histogram in items:
+            merged.histograms.setdefault(key, LatencyHistogram()).merge(histogram)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written beside the file and renamed over it, so a reader never sees it half written
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        f"{c}|{t}": h.to_dict()
+                        for (c, t), h in merged.histograms.items()
+                    },
+                    f,
+                )
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        logger.debug(f"Saved latency histograms to {path}")
+
+    @classmethod
+    def load(cls, path: str | Path) -> "LatencyStats":
+        """Read histograms saved with save.
+
+        Args:
+            path (str | Path): saved file
+
+        Returns:
+            LatencyStats: the histograms
+        """
+        stats = cls()
+        for key, data in json.loads(Path(path).expanduser().read_text()).items():
+            command, to = key.rsplit("|", 1)
+            stats.histograms[(command, to)] = LatencyHistogram.from_dict(data)
+        return stats
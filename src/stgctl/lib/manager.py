@@ -0,0 +1,142 @@
+"""Driving several VMX motor controllers concurrently from one event loop."""
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable, Iterator, Mapping
+from typing import Self, TypeVar
+
+from loguru import logger
+from stgctl.lib.async_vmx import AsyncVMX
+
+T = TypeVar("T")
+# Queues a program on a controller, eg lambda vmx: vmx.clear().move(idx=100)
+Program = Callable[[AsyncVMX], object]
+
+
+class ControllerManager:
+    """Opens several VMX controllers and drives them in parallel.
+
+    Every controller is an AsyncVMX, so the serial ports of all of them are watched by the
+    running event loop's single selector, and a program or query on each is issued without
+    waiting for the others.
+
+    Example:
+        ports = {"left": "/dev/ttyUSB0", "right": "socket://bridge:4001"}
+        async with ControllerManager(ports) as controllers:
+            await controllers.run(lambda vmx: vmx.clear().move(idx=-400, motor=Motor.X))
+            positions = await controllers.query(lambda vmx: vmx.posn(axis=Motor.X))
+    """
+
+    def __init__(self, ports: Mapping[str, str] | Iterable[str]) -> None:
+        """Initialize a ControllerManager, opening every port.
+
+        Nothing is read until `connect` is awaited (or the instance is used as an async context manager).
+
+        Args:
+            ports (Mapping[str, str] | Iterable[str]): port of each controller, by name.
+                If not a mapping, each controller is named by its port.
+        """
+        if not isinstance(ports, Mapping):
+            ports = {port: port for port in ports}
+        self.controllers: dict[str, AsyncVMX] = {}
+        try:
+            for name, port in ports.items():
+                self.controllers[name] = AsyncVMX(port=port)
+        except Exception:
+            self.close()
+            raise
+
+    async def __aenter__(self) -> Self:
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __getitem__(self, name: str) -> AsyncVMX:
+        return self.controllers[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.controllers)
+
+    def __len__(self) -> int:
+        return len(self.controllers)
+
+    async def connect(self) -> None:
+        """Run the startup sequence of every controller concurrently.
+
+        Raises:
+            VmxNotReadyError: Raised when any controller does not become ready. All are closed.
+        """
+        try:
+            await asyncio.gather(*(vmx.connect() for vmx in self.controllers.values()))
+        except Exception:
+            self.close()
+            raise
+        logger.info(f"{len(self)} controllers ready.")
+
+    def close(self) -> None:
+        """Close every controller."""
+        for vmx in self.controllers.values():
+            vmx.close()
+
+    async def run(
+        self,
+        programs: Program | Mapping[str, Program],
+        timeout: float | None = 60.0,
+    ) -> None:
+        """Run a program on several controllers at once, and wait for all of them to complete.
+
+        Args:
+            programs (Program | Mapping[str, Program]): queues the program to run, given the controller.
+                A mapping runs a program only on the controllers it names; otherwise it runs on all.
+            timeout (float | None): Time to wait until a program is considered a failure. Defaults to 60.0.
+                None waits as long as each controller's motion model predicts, plus a margin.
+
+        Raises:
+            TimeoutError: Raised when any program takes longer than timeout.
+        """
+        if not isinstance(programs, Mapping):
+            programs = dict.fromkeys(self.controllers, programs)
+        for name, program in programs.items():
+            vmx = self.controllers[name]
+            program(vmx)
+            vmx.run().send()
+        await self.wait_for_complete(timeout=timeout, names=programs)
+
+    async def wait_for_complete(
+        self, timeout: float | None = 60.0, names: Iterable[str] | None = None
+    ) -> None:
+        """Wait until programs sent to several controllers have completed.
+
+        Args:
+            timeout (float | None): Time to wait until a program is considered a failure. Defaults to 60.0.
+                None waits as long as each controller's motion model predicts, plus a margin.
+            names (Iterable[str], optional): Controllers to wait for. Defaults to all.
+
+        Raises:
+            TimeoutError: Raised when any program takes longer than timeout.
+        """
+        names = self.controllers if names is None else names
+        await asyncio.gather(
+            *(self.controllers[name].wait_for_complete(timeout) for name in names)
+        )
+
+    async def query(
+        self,
+        request: Callable[[AsyncVMX], Awaitable[T]],
+        names: Iterable[str] | None = None,
+    ) -> dict[str, T]:
+        """Send the same immediate command to several controllers at once.
+
+        Args:
+            request (Callable[[AsyncVMX], Awaitable[T]]): sends the command, given the controller,
+                eg lambda vmx: vmx.posn(axis=Motor.X)
+            names (Iterable[str], optional): Controllers to query. Defaults to all.
+
+        Returns:
+            dict[str, T]: reply of each controller, by name
+        """
+        names = list(self.controllers if names is None else names)
+        replies = await asyncio.gather(
+            *(request(self.controllers[name]) for name in names)
+        )
+        return dict(zip(names, replies, strict=True))
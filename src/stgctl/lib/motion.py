@@ -0,0 +1,187 @@
+"""Motion-time model of VMX programs, and how its predictions compare to the real thing."""
+import math
+from collections import deque
+
+import numpy
+from stgctl.lib.optimize import ACCEL, GROUP, INDEX, NEUTRAL, PAUSE, SPEED, AxisState
+
+# Acceleration in idx/s^2 per unit of the AmMx setting
+ACCEL_UNIT: float = 2000.0
+# AmMx settings range from 1 to 127; the slowest is assumed when a motor's is unknown
+SLOWEST_ACCEL: int = 1
+# Speed (idx/s) and AmMx setting of every motor after power on or a reset
+POWER_ON_SPEED: int = 2000
+POWER_ON_ACCEL: int = 2
+# Default raster speed limit (idx/s); time saved by faster settings is reported against it,
+# at the power-on acceleration
+RASTER_SPEED: int = 1500
+
+
+def move_time(distance: float, speed: float, accel: float) -> float:
+    """Time for a trapezoidal move from rest to rest.
+
+    Args:
+        distance (float): distance to move, in idx
+        speed (float): top speed, in idx/s
+        accel (float): acceleration and deceleration, in idx/s^2
+
+    Returns:
+        float: time in seconds
+    """
+    distance = abs(distance)
+    if not distance:
+        return 0.0
+    if distance >= speed**2 / accel:
+        # Reaches top speed
+        return distance / speed + speed / accel
+    # Triangular: decelerates before reaching top speed
+    return 2 * math.sqrt(distance / accel)
+
+
+def move_times(distances: numpy.ndarray, speed: float, accel: float) -> numpy.ndarray:
+    """Vectorized move_time, for many moves at the same speed and acceleration.
+
+    Args:
+        distances (numpy.ndarray): distances to move, in idx
+        speed (float): top speed, in idx/s
+        accel (float): acceleration and deceleration, in idx/s^2
+
+    Returns:
+        numpy.ndarray: time of each move, in seconds
+    """
+    distances = numpy.abs(distances)
+    return numpy.where(
+        distances >= speed**2 / accel,
+        distances / speed + speed / accel,
+        2 * numpy.sqrt(distances / accel),
+    )
+
+
+class MotionModel:
+    """Predicts how long VMX commands take to run.
+
+    Moves are trapezoidal, at each motor's speed and acceleration. Where the distance is unknown,
+    as for limit moves or absolute moves from an unknown position, the full travel is assumed,
+    so predictions are upper bounds rather than estimates. Without a measured travel, such
+    moves cannot be predicted, nor can a move with an unknown speed, or anything the model
+    does not understand. Jumps and loops are
+    followed by ShadowState, which asks the model about each command as it is run.
+    User waits (U6) take no time: time the host holds the program there is its own.
+    """
+
+    def __init__(self, travel: int | None = None) -> None:
+        """Initialize MotionModel.
+
+        Args:
+            travel (int, optional): longest move the stages can make, in idx, as measured
+                between the limit switches. Defaults to unknown.
+        """
+        self.travel = travel
+
+    def command_time(
+        self, cmd: str, axes: AxisState, accels: dict[int, int]
+    ) -> float | None:
+        """Time one program command takes to run.
+
+        Args:
+            cmd (str): program command
+            axes (AxisState): positions and speeds before the command
+            accels (dict[int, int]): AmMx setting of each motor
+
+        Returns:
+            float | None: time in seconds, or None if it cannot be predicted
+        """
+        if group := GROUP.match(cmd):
+            times = [self._index_time(c, axes, accels) for c in group[1].split(",")]
+            return None if None in times else max(times, default=0.0)
+        if INDEX.match(cmd):
+            return self._index_time(cmd, axes, accels)
+        if PAUSE.match(cmd):
+            tenths = float(cmd[1:])
+            return tenths / 10 if tenths >= 0 else -tenths / 10000
+        if cmd in NEUTRAL or SPEED.match(cmd) or ACCEL.match(cmd):
+            return 0.0
+        return None
+
+    def _index_time(
+        self, cmd: str, axes: AxisState, accels: dict[int, int]
+    ) -> float | None:
+        """Private method for the time an index command takes.
+
+        Args:
+            cmd (str): index command
+            axes (AxisState): positions and speeds before the command
+            accels (dict[int, int]): AmMx setting of each motor
+
+        Returns:
+            float | None: time in seconds, or None if it cannot be predicted
+        """
+        match = INDEX.match(cmd)
+        if match is None:
+            return None
+        absolute, m, x = match.groups()
+        motor = int(m)
+        speed = axes.speeds.get(motor)
+        if speed is None:
+            return None
+        position = axes.positions.get(motor)
+        if absolute and x == "-0":
+            # Sets the zero, without moving
+            return 0.0
+        if absolute and position is not None:
+            distance = int(x) - position
+        elif not absolute and int(x) != 0:
+            distance = int(x)
+        elif self.travel is not None:
+            # Limit moves, and absolute moves from an unknown position
+            distance = self.travel
+        else:
+            return None
+        accel = accels.get(motor, SLOWEST_ACCEL) * ACCEL_UNIT
+        return move_time(distance, speed, accel)
+
+
+class DurationStats:
+    """Predicted against actual durations of programs.
+
+    Attributes:
+        count (int): Programs recorded.
+    """
+
+    def __init__(self, keep: int = 1000) -> None:
+        """Initialize DurationStats.
+
+        Args:
+            keep (int): Number of most recent programs to keep. Defaults to 1000.
+        """
+        self._pairs: deque[tuple[float, float]] = deque(maxlen=keep)
+        self.count = 0
+
+    def record(self, predicted: float, actual: float) -> None:
+        """Record one program.
+
+        Args:
+            predicted (float): predicted duration, in seconds
+            actual (float): actual duration, from R to ^, in seconds
+        """
+        self._pairs.append((predicted, actual))
+        self.count += 1
+
+    def summary(self) -> dict:
+        """How far actual durations are from predicted ones, over the kept programs.
+
+        Returns:
+            dict: count, total predicted and actual time, and the median and largest
+            differences (actual minus predicted), in seconds. Empty if nothing was recorded.
+        """
+        if not self._pairs:
+            return {}
+        predicted, actual = numpy.array(self._pairs).T
+        error = actual - predicted
+        return {
+            "count": len(self._pairs),
+            "predicted": float(predicted.sum()),
+            "actual": float(actual.sum()),
+            "median_error": float(numpy.median(error)),
+            "max_error": float(error[numpy.abs(error).argmax()]),
+        }
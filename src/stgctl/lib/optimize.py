@@ -0,0 +1,103 @@
+"""Peephole optimization of VMX programs."""
+import re
+from dataclasses import dataclass, field
+
+# IAmMx, ImMx
+INDEX = re.compile(r"^I(A?)(\d)M(-?\d+)$")
+# SmMx
+SPEED = re.compile(r"^S(\d)M(\d+)$")
+# AmMx
+ACCEL = re.compile(r"^A(\d)M(\d+)$")
+# Px
+PAUSE = re.compile(r"^P-?[\d.]+$")
+# (cmd,cmd,)
+GROUP = re.compile(r"^\((.*),\)$")
+# Commands that leave what is known of the motors untouched
+NEUTRAL: tuple[str, ...] = ("C", "R", "U6")
+
+
+@dataclass
+class AxisState:
+    """What the host knows of each motor. Motors missing from a dict are unknown.
+
+    Attributes:
+        positions (dict[int, int]): Absolute position of each motor, in idx.
+        speeds (dict[int, int]): Speed of each motor, in idx/s.
+    """
+
+    positions: dict[int, int] = field(default_factory=dict)
+    speeds: dict[int, int] = field(default_factory=dict)
+
+    def forget(self) -> None:
+        """Forget everything known."""
+        self.positions.clear()
+        self.speeds.clear()
+
+
+def optimize(cmds: list[str], state: AxisState | None = None) -> list[str]:
+    """Drop commands that would not change anything on the VMX.
+
+    Absolute moves to where a motor already is, and speeds a motor is already set to, are dropped.
+    Relative moves are always kept, since ImM0 indexes to a limit switch rather than doing nothing.
+    Anything not understood (loops, jumps, origin, ...) makes the pass forget what it knows.
+
+    Args:
+        cmds (list[str]): program commands, in order
+        state (AxisState, optional): what is known before the program, updated in place.
+            Defaults to knowing nothing.
+
+    Returns:
+        list[str]: the commands that are needed
+    """
+    state = state if state is not None else AxisState()
+    optimized: list[str] = []
+    for cmd in cmds:
+        group = GROUP.match(cmd)
+        if group and all(INDEX.match(c) for c in group[1].split(",")):
+            kept = [c for c in group[1].split(",") if _index(c, state)]
+            if len(kept) > 1:
+                optimized.append(f"({','.join(kept)},)")
+            else:
+                optimized.extend(kept)
+        elif INDEX.match(cmd):
+            if _index(cmd, state):
+                optimized.append(cmd)
+        elif speed := SPEED.match(cmd):
+            motor, value = int(speed[1]), int(speed[2])
+            if state.speeds.get(motor) != value:
+                state.speeds[motor] = value
+                optimized.append(cmd)
+        elif PAUSE.match(cmd) or ACCEL.match(cmd) or cmd in NEUTRAL:
+            optimized.append(cmd)
+        else:
+            state.forget()
+            optimized.append(cmd)
+    return optimized
+
+
+def _index(cmd: str, state: AxisState) -> bool:
+    """Private function tracking an index command, and deciding whether it is needed.
+
+    Args:
+        cmd (str): index command
+        state (AxisState): what is known, updated in place
+
+    Returns:
+        bool: False if the command would not move the motor
+    """
+    absolute, m, x = INDEX.match(cmd).groups()
+    motor = int(m)
+    if absolute:
+        # IAmM-0 sets the current position as zero
+        if x == "-0":
+            state.positions[motor] = 0
+            return True
+        if state.positions.get(motor) == int(x):
+            return False
+        state.positions[motor] = int(x)
+    elif int(x) == 0:
+        # ImM0 and ImM-0 index to a limit switch
+        state.positions.pop(motor, None)
+    elif motor in state.positions:
+        state.positions[motor] += int(x)
+    return True
@@ -0,0 +1,321 @@
+"""Dry-run planning of rasters: what each RasterMode sends to the VMX, and how long it takes."""
+from dataclasses import dataclass
+
+import numpy
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.motion import ACCEL_UNIT, POWER_ON_ACCEL, RASTER_SPEED, move_times
+from stgctl.lib.program import RasterMode, dwell_command, loop_programs
+from stgctl.lib.vmx import BaseVMX
+from stgctl.schema.models import Size
+
+# Time each byte takes on the serial line, at the VMX's 9600 baud with 8N1 framing
+BYTE_TIME: float = 10 / 9600
+# Host round trip for each query, and each wait for a program to complete, in seconds
+ROUND_TRIP: float = 0.01
+# 10, 100, ... for counting decimal digits
+_POWERS = 10 ** numpy.arange(1, 19, dtype=numpy.int64)
+
+
+@dataclass
+class RasterPlan:
+    """What a raster sends to the VMX, and a prediction of how long it takes.
+
+    Attributes:
+        mode (RasterMode): How points are sent to the VMX.
+        points (int): Raster points visited.
+        travel (Size): Total idx moved on X and Y, starting from the origin.
+        uploads (int): Programs uploaded.
+        round_trips (int): Host waits on the VMX: memory queries and program completions.
+        program_bytes (int): Bytes of program uploaded.
+        moving (float): Predicted time moving between points, in seconds.
+        dwelling (float): Time dwelling at points, in seconds.
+        waiting (float): Predicted time the stages wait on the host, for round trips
+            and for programs to cross the serial line, in seconds.
+    """
+
+    mode: RasterMode
+    points: int
+    travel: Size
+    uploads: int
+    round_trips: int
+    program_bytes: int
+    moving: float
+    dwelling: float
+    waiting: float
+
+    @property
+    def duration(self) -> float:
+        """Predicted wall-clock time of the raster.
+
+        Returns:
+            float: time in seconds
+        """
+        return self.moving + self.dwelling + self.waiting
+
+
+def plan_raster(
+    trajectory: numpy.ndarray,
+    grid_size: Size,
+    pause: float,
+    mode: RasterMode,
+    speed: Size,
+    accel: Size | None = None,
+    round_trip: float = ROUND_TRIP,
+) -> RasterPlan:
+    """Plan a raster without a VMX, as XYStage.raster would run it.
+
+    Everything is computed from the lengths of the commands, in a few vectorized passes,
+    rather than by building the programs, so planning a million points takes a fraction of a second.
+    Moves are timed as in MotionModel.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+        grid_size (Size): number of raster points in (x,y)
+        pause (float): time, in seconds, to pause at each point
+        mode (RasterMode): how points are sent to the VMX
+        speed (Size): speed of each motor, in idx/s
+        accel (Size, optional): AmMx setting of each motor. Defaults to the power-on setting.
+        round_trip (float): host round trip, in seconds. Defaults to ROUND_TRIP.
+
+    Raises:
+        InvalidVMXCommandError: Raised when a single point does not fit a program,
+            or the raster cannot be looped.
+
+    Returns:
+        RasterPlan: the plan
+    """
+    # Axes are handled as separate columns, as reductions across a row are slow in numpy
+    x, y = (numpy.ascontiguousarray(trajectory[:, axis]) for axis in (0, 1))
+    moves_x, moves_y = (numpy.abs(numpy.diff(v, prepend=0)) for v in (x, y))
+    if accel is None:
+        accel = Size(POWER_ON_ACCEL, POWER_ON_ACCEL)
+    # Both axes move at once, so the slower sets the time
+    moving = _moving_time(moves_x, moves_y, speed, accel)
+    dwell = len(dwell_command(pause))
+    both, delta = _move_lengths(x, y)
+    points = len(trajectory)
+    match mode:
+        case RasterMode.POINT:
+            # C,(IA1Mx,IA2My,),Px,R
+            uploads = points
+            program_bytes = int(both.sum()) + points * (dwell + len("C,,,R"))
+            round_trips = points
+            wire = program_bytes
+        case RasterMode.PACKED:
+            sizes = _pack(both, delta, dwell, BaseVMX.PROGRAM_BYTES)
+            uploads = len(sizes)
+            batches = -(-uploads // BaseVMX.PROGRAM_SLOTS)
+            # All but the last program of each batch jump to the next slot
+            program_bytes = sum(sizes) + (uploads - batches) * len(",JM0")
+            # Memory queries, with one up front for the budget, and a completion per batch
+            round_trips = uploads + 1 + batches
+            wire = program_bytes
+        case RasterMode.PIPELINED:
+            sizes = _pack(
+                both, delta, dwell, BaseVMX.PROGRAM_BYTES - len("," + BaseVMX.USER_WAIT)
+            )
+            uploads = len(sizes)
+            # All but the last program wait for the host, then jump to the other slot
+            program_bytes = sum(sizes) + (uploads - 1) * len(",U6,JM0")
+            # One memory query up front, a W and G between programs, and the completion
+            round_trips = uploads + 1
+            # Later uploads are made while the previous program runs
+            wire = sizes[0] if sizes else 0
+        case RasterMode.LOOPED:
+            looped = loop_programs(trajectory, grid_size, pause)
+            uploads = len(looped.programs)
+            program_bytes = sum(program.size for program in looped.programs)
+            round_trips = uploads + len(looped.schedule)
+            wire = program_bytes
+    return RasterPlan(
+        mode=mode,
+        points=points,
+        travel=Size(int(moves_x.sum()), int(moves_y.sum())),
+        uploads=uploads,
+        round_trips=round_trips,
+        program_bytes=program_bytes,
+        moving=moving,
+        dwelling=points * pause,
+        waiting=round_trips * round_trip + wire * BYTE_TIME,
+    )
+
+
+def fastest_motion(
+    trajectory: numpy.ndarray, speed_limit: Size, accel_limit: Size
+) -> tuple[Size, Size]:
+    """Speed and acceleration of each motor that move through a raster in the least time.
+
+    Faster acceleration never makes a move slower, so each motor gets its limit. Speed only
+    helps up to the top speed a move reaches before it has to decelerate, so each motor
+    gets the lowest speed, up to its limit, at which the raster takes no longer than at the limit.
+    For a serpentine raster X only moves within rows and Y only between them, so this is also
+    the best choice for each kind of move. The motors start at the origin.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+        speed_limit (Size): fastest speed of each motor, in idx/s
+        accel_limit (Size): largest AmMx setting of each motor
+
+    Returns:
+        tuple[Size, Size]: speed, in idx/s, and AmMx setting of each motor
+    """
+    moves = [numpy.abs(numpy.diff(trajectory[:, axis], prepend=0)) for axis in (0, 1)]
+    speed = list(speed_limit)
+    accels = list(accel_limit)
+    for axis in (0, 1):
+        # Top speeds that each distinct move just reaches, below the limit
+        reached = numpy.ceil(
+            numpy.sqrt(numpy.unique(moves[axis]) * accels[axis] * ACCEL_UNIT)
+        )
+        best = _moving_time(*moves, Size(*speed), accel_limit)
+        for candidate in numpy.unique(reached[(reached > 0) & (reached < speed[axis])]):
+            trial = list(speed)
+            trial[axis] = int(candidate)
+            # Rounding aside, as fast as at the limit
+            if _moving_time(*moves, Size(*trial), accel_limit) <= best * (1 + 1e-9):
+                speed = trial
+                break
+    return Size(*speed), accel_limit
+
+
+def describe_motion(trajectory: numpy.ndarray, speed: Size, accel: Size) -> str:
+    """Describe the speeds and accelerations of a raster, and how long it moves for.
+
+    Any time saved over RASTER_SPEED at the power-on acceleration is included.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+        speed (Size): speed of each motor, in idx/s
+        accel (Size): AmMx setting of each motor
+
+    Returns:
+        str: the description
+    """
+    moving = moving_time(trajectory, speed, accel)
+    saved = moving_time(trajectory, Size(RASTER_SPEED, RASTER_SPEED)) - moving
+    description = (
+        f"speeds ({speed.X},{speed.Y}) idx/s and accelerations ({accel.X},{accel.Y}), "
+        f"moving for {moving:.1f} s"
+    )
+    if round(saved, 1) > 0:
+        description += f", {saved:.1f} s less than at {RASTER_SPEED} idx/s"
+    return description
+
+
+def moving_time(
+    trajectory: numpy.ndarray, speed: Size, accel: Size | None = None
+) -> float:
+    """Predicted time moving through a raster, starting at the origin.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+        speed (Size): speed of each motor, in idx/s
+        accel (Size, optional): AmMx setting of each motor. Defaults to the power-on setting.
+
+    Returns:
+        float: time in seconds
+    """
+    if accel is None:
+        accel = Size(POWER_ON_ACCEL, POWER_ON_ACCEL)
+    moves = (numpy.abs(numpy.diff(trajectory[:, axis], prepend=0)) for axis in (0, 1))
+    return _moving_time(*moves, speed, accel)
+
+
+def _moving_time(
+    moves_x: numpy.ndarray, moves_y: numpy.ndarray, speed: Size, accel: Size
+) -> float:
+    """Private function for the time moving through a raster, with both motors moving at once.
+
+    Args:
+        moves_x (numpy.ndarray): X distance of each move, in idx
+        moves_y (numpy.ndarray): Y distance of each move, in idx
+        speed (Size): speed of each motor, in idx/s
+        accel (Size): AmMx setting of each motor
+
+    Returns:
+        float: time in seconds
+    """
+    return float(
+        numpy.maximum(
+            move_times(moves_x, speed.X, accel.X * ACCEL_UNIT),
+            move_times(moves_y, speed.Y, accel.Y * ACCEL_UNIT),
+        ).sum()
+    )
+
+
+def _move_lengths(
+    x: numpy.ndarray, y: numpy.ndarray
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Private function for the lengths of the moves encode_moves would build.
+
+    Args:
+        x (numpy.ndarray): X index of each raster point
+        y (numpy.ndarray): Y index of each raster point
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: For each point, the length of the simultaneous
+        absolute move on both axes, and of the move on only the axes that change (0 if neither does).
+    """
+    lengths = []
+    changed = []
+    for values in (x.astype(numpy.int64), y.astype(numpy.int64)):
+        magnitudes = numpy.abs(values)
+        # IAmMx: a digit, plus one for each power of ten reached, and the sign
+        length = len("IA1M") + 1 + (values < 0)
+        for power in _POWERS[_POWERS <= magnitudes.max(initial=0)]:
+            length += magnitudes >= power
+        lengths.append(length)
+        changed.append(numpy.diff(values, prepend=values[:1] + 1) != 0)
+    # (IA1Mx,IA2My,)
+    both = lengths[0] + lengths[1] + len("(,,)")
+    delta = numpy.where(
+        changed[0] & changed[1],
+        both,
+        lengths[0] * changed[0] + lengths[1] * changed[1],
+    )
+    return both, delta
+
+
+def _pack(
+    both: numpy.ndarray, delta: numpy.ndarray, dwell: int, budget: int
+) -> list[int]:
+    """Private function for the sizes of the programs pack_points would build.
+
+    Where a program would end is found for every point at once, with a binary search over the
+    cumulative size of the points, so only following the programs from one to the next is a loop.
+
+    Args:
+        both (numpy.ndarray): length of the move on both axes to each point
+        delta (numpy.ndarray): length of the move from the previous point (0 if none)
+        dwell (int): length of the dwell command
+        budget (int): bytes available per program
+
+    Raises:
+        InvalidVMXCommandError: Raised when a single point does not fit the budget.
+
+    Returns:
+        list[int]: size of each program, in bytes, before chaining
+    """
+    limit = budget - len("," + BaseVMX.JUMP_PROG.format(n=0))
+    first = both + 1 + dwell
+    if not len(first):
+        return []
+    # Bytes added by each point after the first in a program; +1 for each comma
+    added = numpy.where(delta > 0, delta + 1, 0) + 1 + dwell
+    cumulative = numpy.concatenate([[0], numpy.cumsum(added)])
+    # Were a program to start at each point, it would fit points i..ends[i]-1
+    ends = (
+        numpy.searchsorted(cumulative, limit - first + cumulative[1:], side="right") - 1
+    )
+    # Indexing a memoryview gives Python ints, without converting every point to one
+    ends = memoryview(numpy.maximum(ends, numpy.arange(1, len(first) + 1)))
+    starts = [0]
+    while ends[starts[-1]] < len(ends):
+        starts.append(ends[starts[-1]])
+    starts = numpy.array(starts)
+    if (first[starts] > limit).any():
+        raise InvalidVMXCommandError(
+            f"A single raster point does not fit in {budget} bytes."
+        )
+    stops = numpy.append(starts[1:], len(first))
+    return (first[starts] + cumulative[stops] - cumulative[starts + 1]).tolist()
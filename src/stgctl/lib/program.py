@@ -0,0 +1,377 @@
+"""Compile raster trajectories into VMX programs."""
+
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from enum import StrEnum
+
+import numpy
+from loguru import logger
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.vmx import VMX, BaseVMX, Motor, SerialCommand
+from stgctl.schema.models import Size
+
+
+class RasterMode(StrEnum):
+    """How a raster is turned into VMX programs."""
+
+    # One program, and one host round trip, per point
+    POINT = "point"
+    # As many points as fit per program, chained across the program slots
+    PACKED = "packed"
+    # The whole grid as a constant-size looped program of relative moves
+    LOOPED = "looped"
+    # Packed programs alternating between two slots, the next uploaded while the current runs,
+    # chained with a user wait and a jump. Needs settings.PIPELINED_UPLOADS, as it is unverified on the VMX
+    PIPELINED = "pipelined"
+
+
+@dataclass
+class PackedProgram:
+    """A VMX program holding one or more raster points.
+
+    Attributes:
+        commands (SerialCommand): The program.
+        points (int): Number of raster points it visits.
+    """
+
+    commands: SerialCommand = field(default_factory=SerialCommand)
+    points: int = 0
+
+    @property
+    def size(self) -> int:
+        """Program size in bytes, as sent to the VMX.
+
+        Returns:
+            int: encoded length of the program
+        """
+        return self.commands.size
+
+
+def dwell_command(pause: float | str) -> str:
+    """Command run at every raster point, once the stages are there.
+
+    Args:
+        pause (float | str): time, in seconds, to pause at the point,
+            or the command to dwell with instead, eg BaseVMX.USER_WAIT
+
+    Returns:
+        str: the command
+    """
+    if isinstance(pause, str):
+        return pause
+    return BaseVMX.SET_PAUSE.format(x=round(pause, 2) * 10)
+
+
+def point_commands(coord: numpy.ndarray, pause: float | str) -> SerialCommand:
+    """Commands visiting one raster point: simultaneous absolute moves on X and Y, then a dwell.
+
+    Args:
+        coord (numpy.ndarray): (X, Y) index to move to
+        pause (float | str): time, in seconds, to pause at the point, or a dwell command (see dwell_command)
+
+    Returns:
+        SerialCommand: commands for the point
+    """
+    cmd = SerialCommand()
+    cmd.append(_move_to(coord))
+    cmd.append(dwell_command(pause))
+    return cmd
+
+
+def _move_to(coord: numpy.ndarray) -> str:
+    """Simultaneous absolute move on X and Y.
+
+    Args:
+        coord (numpy.ndarray): (X, Y) index to move to
+
+    Returns:
+        str: the move command
+    """
+    return BaseVMX.SIMULTANEOUS.format(
+        cmds=",".join(
+            [
+                BaseVMX.IDX_ABS.format(m=Motor.X, x=coord[0]),
+                BaseVMX.IDX_ABS.format(m=Motor.Y, x=coord[1]),
+            ]
+        )
+    )
+
+
+def encode_moves(trajectory: numpy.ndarray) -> tuple[list[str], list[str]]:
+    """Encode the move to every trajectory point in one vectorized pass.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+
+    Returns:
+        tuple[list[str], list[str]]: For each point, the simultaneous absolute move on both axes,
+        and the move from the previous point on only the axes that change ("" if neither does).
+    """
+    # Templates with the motor filled in, so only the index needs formatting per point
+    prefixes = [BaseVMX.IDX_ABS.format(m=motor, x="") for motor in (Motor.X, Motor.Y)]
+    x, y = (
+        numpy.char.add(prefix, trajectory[:, axis].astype(int).astype(str))
+        for axis, prefix in enumerate(prefixes)
+    )
+    # (IA1Mx,IA2My,)
+    both = numpy.char.add(
+        numpy.char.add(numpy.char.add(numpy.char.add("(", x), ","), y), ",)"
+    )
+    changed = numpy.ones(trajectory.shape, dtype=bool)
+    changed[1:] = trajectory[1:] != trajectory[:-1]
+    delta = numpy.where(
+        changed.all(axis=1),
+        both,
+        numpy.where(changed[:, 0], x, numpy.where(changed[:, 1], y, "")),
+    )
+    return both.tolist(), delta.tolist()
+
+
+def pack_points(
+    trajectory: numpy.ndarray, pause: float | str, budget: int = BaseVMX.PROGRAM_BYTES
+) -> list[PackedProgram]:
+    """Pack consecutive trajectory points into as few programs as fit the byte budget.
+
+    Room is left at the end of every program for the jump that chains it to the next slot.
+    Within a program, only axes that change are moved, eg only X along a row.
+
+    Args:
+        trajectory (numpy.ndarray): raster points, one (X, Y) row per point
+        pause (float | str): time, in seconds, to pause at each point, or a dwell command (see dwell_command)
+        budget (int): bytes available per program. Defaults to BaseVMX.PROGRAM_BYTES.
+
+    Raises:
+        InvalidVMXCommandError: Raised when a single point does not fit the budget.
+
+    Returns:
+        list[PackedProgram]: programs, in order
+    """
+    # ",JMn" is appended when chaining
+    reserve = len("," + BaseVMX.JUMP_PROG.format(n=0))
+    dwell = dwell_command(pause)
+    both, delta = encode_moves(trajectory)
+    programs: list[PackedProgram] = []
+    for move, step in zip(both, delta, strict=True):
+        program = programs[-1] if programs else None
+        # +1 for each comma
+        added = (len(step) + 1 if step else 0) + 1 + len(dwell)
+        if program is None or program.size + added + reserve > budget:
+            if len(move) + 1 + len(dwell) + reserve > budget:
+                raise InvalidVMXCommandError(
+                    f"A single raster point does not fit in {budget} bytes."
+                )
+            program = PackedProgram()
+            programs.append(program)
+            step = move
+        if step:
+            program.commands.append(step)
+        program.commands.append(dwell)
+        program.points += 1
+    return programs
+
+
+def chain(
+    programs: list[PackedProgram], slots: int = BaseVMX.PROGRAM_SLOTS
+) -> Iterator[list[PackedProgram]]:
+    """Group programs into batches that fill the program slots and run with a single R.
+
+    Every program but the last in a batch ends with a jump to the next slot.
+
+    Args:
+        programs (list[PackedProgram]): programs from pack_points
+        slots (int): program slots to use. Defaults to BaseVMX.PROGRAM_SLOTS.
+
+    Yields:
+        list[PackedProgram]: programs for slots 0, 1, ... in order
+    """
+    for start in range(0, len(programs), slots):
+        batch = programs[start : start + slots]
+        for slot, program in enumerate(batch[:-1]):
+            program.commands.append(BaseVMX.JUMP_PROG.format(n=slot + 1))
+        yield batch
+
+
+@dataclass
+class LoopedRaster:
+    """A serpentine raster expressed as looped programs of relative moves.
+
+    The program slots hold:
+        0: move to the first point on both axes at once, then jump to the row pair (or to the single row)
+        1: step to the next row, then jump to the row pair
+        2: the row pair: a forward row, a step to the next row, and a reverse row
+        3: step to the next row, then jump to the single row
+        4: a single forward row, for grids with an odd number of rows
+
+    Attributes:
+        programs (list[PackedProgram]): Contents of slots 0 to 4.
+        schedule (list[tuple[int, int]]): Slot to run, and the points it visits, for each run.
+    """
+
+    programs: list[PackedProgram]
+    schedule: list[tuple[int, int]]
+
+
+def _row(step: int, points: int, pause: float | str) -> SerialCommand:
+    """Commands dwelling at the current point, then visiting points - 1 more along X.
+
+    Args:
+        step (int): relative X step between points
+        points (int): points in the row
+        pause (float | str): time, in seconds, to pause at each point, or a dwell command
+
+    Returns:
+        SerialCommand: commands for the row
+    """
+    dwell = dwell_command(pause)
+    cmd = SerialCommand([dwell])
+    if points > 1:
+        cmd.extend(
+            [
+                BaseVMX.LOOP_START,
+                BaseVMX.IDX_INCR.format(m=Motor.X, x=step),
+                dwell,
+                BaseVMX.LOOP_END.format(x=points - 1),
+            ]
+        )
+    return cmd
+
+
+def loop_programs(
+    trajectory: numpy.ndarray, grid_size: Size, pause: float | str
+) -> LoopedRaster:
+    """Express a serpentine raster as constant-size looped programs.
+
+    Steps are taken as the average spacing of the trajectory, so points can differ
+    from the trajectory by its rounding (a few idx over a row); the largest difference is logged.
+
+    Args:
+        trajectory (numpy.ndarray): serpentine raster points, one (X, Y) row per point,
+            as from gen_2d_trajectory
+        grid_size (Size): number of raster points in (x,y)
+        pause (float | str): time, in seconds, to pause at each point, or a dwell command (see dwell_command)
+
+    Raises:
+        InvalidVMXCommandError: Raised when the trajectory does not match the grid size,
+            or a step rounds to zero (ImM0 indexes to a limit switch).
+
+    Returns:
+        LoopedRaster: programs and the order to run them in
+    """
+    if len(trajectory) != grid_size.X * grid_size.Y:
+        raise InvalidVMXCommandError(
+            f"Trajectory has {len(trajectory)} points, but grid is {grid_size}."
+        )
+    grid = trajectory.reshape(grid_size.Y, grid_size.X, 2)
+    start = grid[0, 0]
+    step_x = (
+        round((grid[0, -1, 0] - start[0]) / (grid_size.X - 1)) if grid_size.X > 1 else 0
+    )
+    step_y = (
+        round((grid[-1, 0, 1] - start[1]) / (grid_size.Y - 1)) if grid_size.Y > 1 else 0
+    )
+    if (grid_size.X > 1 and not step_x) or (grid_size.Y > 1 and not step_y):
+        raise InvalidVMXCommandError(
+            "Raster step rounds to zero, which would index to a limit switch."
+        )
+    # Where the looped program actually goes
+    looped = numpy.stack(
+        numpy.meshgrid(
+            start[0] + step_x * numpy.arange(grid_size.X),
+            start[1] + step_y * numpy.arange(grid_size.Y),
+        ),
+        axis=-1,
+    )
+    looped[1::2] = looped[1::2, ::-1]
+    logger.info(
+        f"Looped raster steps ({step_x},{step_y}) idx, at most {numpy.abs(looped - grid).max()} idx from the trajectory."
+    )
+
+    step_row = BaseVMX.IDX_INCR.format(m=Motor.Y, x=step_y)
+    pairs, odd = divmod(grid_size.Y, 2)
+    slots = [
+        SerialCommand([_move_to(start), BaseVMX.JUMP_PROG.format(n=2 if pairs else 4)]),
+        SerialCommand([step_row, BaseVMX.JUMP_PROG.format(n=2)]),
+        SerialCommand(
+            [
+                *_row(step_x, grid_size.X, pause),
+                step_row,
+                *_row(-step_x, grid_size.X, pause),
+            ]
+        ),
+        SerialCommand([step_row, BaseVMX.JUMP_PROG.format(n=4)]),
+        _row(step_x, grid_size.X, pause),
+    ]
+    points = [0, 0, 2 * grid_size.X, 0, grid_size.X]
+    programs = [PackedProgram(cmd, n) for cmd, n in zip(slots, points, strict=True)]
+
+    schedule = []
+    if pairs:
+        schedule.append((0, 2 * grid_size.X))
+        schedule += [(1, 2 * grid_size.X)] * (pairs - 1)
+        if odd:
+            schedule.append((3, grid_size.X))
+    else:
+        schedule.append((0, grid_size.X))
+    return LoopedRaster(programs, schedule)
+
+
+def memory_free(vmx: VMX, slot: int = 0) -> int:
+    """Clear a program slot and ask the VMX how much memory it has available.
+
+    Args:
+        vmx (VMX): VMX instance
+        slot (int): program slot. Defaults to 0.
+
+    Returns:
+        int: bytes available in the slot
+    """
+    vmx.program(now=True, n=slot, clear=True)
+    return int(vmx.memory().decode().strip())
+
+
+def upload_program(
+    vmx: VMX, slot: int, program: PackedProgram, free: int | None = None
+) -> None:
+    """Clear a program slot and upload a program into it.
+
+    The program is checked against the memory free in the slot. The slot is left selected.
+
+    Args:
+        vmx (VMX): VMX instance
+        slot (int): program slot
+        program (PackedProgram): program to upload
+        free (int, optional): bytes free in a cleared slot, as read earlier from memory_free.
+            Defaults to asking the VMX, which must not be done while a program runs,
+            as status requests mid-program fault the VMX.
+
+    Raises:
+        InvalidVMXCommandError: Raised when the program is larger than the slot's free memory.
+    """
+    if free is None:
+        free = memory_free(vmx, slot)
+    else:
+        vmx.program(now=True, n=slot, clear=True)
+    if program.size > free:
+        raise InvalidVMXCommandError(
+            f"Program for slot {slot} is {program.size} bytes, but only {free} bytes are free."
+        )
+    logger.debug(
+        "Uploading {} points ({} bytes) to slot {}.", program.points, program.size, slot
+    )
+    vmx.command_queue = program.commands
+    vmx.send()
+
+
+def upload(vmx: VMX, batch: list[PackedProgram]) -> None:
+    """Upload a batch of programs into slots 0, 1, ... and leave slot 0 selected.
+
+    Args:
+        vmx (VMX): VMX instance
+        batch (list[PackedProgram]): programs from chain
+
+    Raises:
+        InvalidVMXCommandError: Raised when a program is larger than its slot's free memory.
+    """
+    for slot, program in enumerate(batch):
+        upload_program(vmx, slot, program)
+    vmx.program(now=True, n=0)
@@ -0,0 +1,347 @@
+"""Demultiplexing of VMX replies, and a reader thread that owns the serial port."""
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum, auto
+
+import serial
+from loguru import logger
+
+
+class Reply(Enum):
+    """Shape of the reply the VMX sends back to an immediate command."""
+
+    # Nothing comes back, eg jog or clear
+    NONE = auto()
+    # A single state byte, eg R from V
+    STATE = auto()
+    # A signed integer terminated by a carriage return, eg from X
+    INTEGER = auto()
+    # Free-form text with no terminator, eg the program listing from lst
+    TEXT = auto()
+
+
+def reply_complete(reply: Reply, readout: bytes | bytearray) -> bool:
+    """Check whether readout holds a complete reply.
+
+    TEXT replies are never complete by content alone; they end when the port goes quiet.
+
+    Args:
+        reply (Reply): shape of the expected reply
+        readout (bytes | bytearray): bytes read so far
+
+    Returns:
+        bool: True if the reply is complete
+    """
+    match reply:
+        case Reply.STATE:
+            return len(readout) >= 1
+        case Reply.INTEGER:
+            return b"\r" in readout
+        case _:
+            return False
+
+
+class ReplyKind(Enum):
+    """Kinds of bytes the VMX sends to the host."""
+
+    # ^, sent when a program completes
+    COMPLETE = auto()
+    # Reply to a status request, eg R from V
+    STATUS = auto()
+    # W, sent when a program reaches U6 and waits for G
+    USER_WAIT = auto()
+    # Commands echoed back by the VMX when echo is on
+    ECHO = auto()
+
+
+@dataclass(frozen=True)
+class Received:
+    """A complete reply from the VMX.
+
+    Attributes:
+        kind (ReplyKind): What the bytes are.
+        data (bytes): The reply itself.
+        start (float): time.monotonic() at which the first byte was read.
+        end (float): time.monotonic() at which the last byte was read.
+    """
+
+    kind: ReplyKind
+    data: bytes
+    start: float
+    end: float
+
+
+class ReplyDemux:
+    """Splits the byte stream from the VMX into typed replies.
+
+    Does no I/O. Drivers feed it bytes as they arrive, along with the time they were read,
+    and route the returned replies wherever they are awaited.
+    Status replies are only recognised while one is expected, so the driver must call `expect`
+    before sending a status request.
+    """
+
+    # Sent by the VMX when a program completes
+    PROG_COMPLETE: bytes = b"^"
+    # Sent by the VMX when a program reaches U6
+    USER_WAIT: bytes = b"W"
+    # A TEXT reply is considered complete once the port has been quiet this long
+    TEXT_QUIET: float = 0.02
+
+    def __init__(self) -> None:
+        """Initialize ReplyDemux."""
+        self._reply = Reply.NONE
+        self._status = bytearray()
+        self._status_start = 0.0
+        self._last = 0.0
+        self._echo = b""
+        self._echoed = bytearray()
+        self._echo_start = 0.0
+
+    @property
+    def pending_text(self) -> bool:
+        """Whether a TEXT reply has started arriving and is waiting for the port to go quiet.
+
+        Returns:
+            bool: True if `idle` needs to be called to finish the reply.
+        """
+        return self._reply is Reply.TEXT and bool(self._status)
+
+    def expect(self, reply: Reply) -> None:
+        """Expect a status reply of the given shape.
+
+        Args:
+            reply (Reply): shape of the reply to the status request about to be sent
+        """
+        self._reply = reply
+        self._status.clear()
+
+    def expect_echo(self, data: bytes) -> None:
+        """Expect the VMX to echo back data that is about to be written.
+
+        Args:
+            data (bytes): bytes about to be written
+        """
+        self._echo = self._echo[len(self._echoed) :] + data
+        self._echoed.clear()
+
+    def cancel(self) -> bytes:
+        """Stop expecting a status reply.
+
+        Returns:
+            bytes: whatever part of the reply had arrived
+        """
+        partial = bytes(self._status)
+        self.expect(Reply.NONE)
+        return partial
+
+    def feed(self, data: bytes, timestamp: float) -> list[Received]:
+        """Sort newly read bytes into replies.
+
+        Args:
+            data (bytes): bytes read from the VMX
+            timestamp (float): time.monotonic() at which they were read
+
+        Returns:
+            list[Received]: replies completed by these bytes, in order
+        """
+        received: list[Received] = []
+        for byte in data:
+            char = bytes((byte,))
+            if self._feed_echo(char, timestamp, received):
+                continue
+            if char == ReplyDemux.PROG_COMPLETE:
+                received.append(
+                    Received(ReplyKind.COMPLETE, char, timestamp, timestamp)
+                )
+            elif char == ReplyDemux.USER_WAIT and self._reply is not Reply.TEXT:
+                received.append(
+                    Received(ReplyKind.USER_WAIT, char, timestamp, timestamp)
+                )
+            elif self._reply is not Reply.NONE:
+                if not self._status:
+                    self._status_start = timestamp
+                self._status += char
+                if reply_complete(self._reply, self._status):
+                    received.append(self._end_status(timestamp))
+            else:
+                logger.warning(f"Dropping unexpected byte from VMX: {char!r}")
+        self._last = timestamp
+        return received
+
+    def idle(self, timestamp: float) -> list[Received]:
+        """Finish a TEXT reply if the port has been quiet for long enough.
+
+        Args:
+            timestamp (float): current time.monotonic()
+
+        Returns:
+            list[Received]: the finished reply, if any
+        """
+        if self.pending_text and timestamp - self._last >= ReplyDemux.TEXT_QUIET:
+            return [self._end_status(self._last)]
+        return []
+
+    def _feed_echo(
+        self, char: bytes, timestamp: float, received: list[Received]
+    ) -> bool:
+        """Private method consuming char if it is the next byte of an expected echo.
+
+        Args:
+            char (bytes): single byte read from the VMX
+            timestamp (float): time.monotonic() at which it was read
+            received (list[Received]): replies completed so far, appended to
+
+        Returns:
+            bool: True if char was part of an echo
+        """
+        if not self._echo:
+            return False
+        if char[0] == self._echo[len(self._echoed)]:
+            if not self._echoed:
+                self._echo_start = timestamp
+            self._echoed += char
+            if len(self._echoed) == len(self._echo):
+                received.append(self._end_echo(timestamp))
+            return True
+        # Not an echo after all, eg echo is off
+        if self._echoed:
+            received.append(self._end_echo(timestamp))
+        self._echo = b""
+        return False
+
+    def _end_status(self, timestamp: float) -> Received:
+        received = Received(
+            ReplyKind.STATUS, bytes(self._status), self._status_start, timestamp
+        )
+        self.expect(Reply.NONE)
+        return received
+
+    def _end_echo(self, timestamp: float) -> Received:
+        received = Received(
+            ReplyKind.ECHO, bytes(self._echoed), self._echo_start, timestamp
+        )
+        self._echo = self._echo[len(self._echoed) :]
+        self._echoed.clear()
+        return received
+
+
+class ReplyReader(threading.Thread):
+    """Thread that owns reading from the VMX serial port.
+
+    Every byte is timestamped as it is read and routed by a ReplyDemux into one queue per kind,
+    so callers can wait for the reply they need without flushing anyone else's.
+    """
+
+    # How long a read blocks when nothing is pending, in seconds.
+    # Only bounds how quickly the thread notices it has been stopped.
+    POLL_INTERVAL: float = 0.1
+
+    def __init__(self, port: serial.Serial) -> None:
+        """Initialize ReplyReader. The thread must still be started.
+
+        Args:
+            port (serial.Serial): open serial port to the VMX
+        """
+        super().__init__(name="vmx-reader", daemon=True)
+        self._serial = port
+        self._demux = ReplyDemux()
+        # Guards the demux, which is also touched by the thread sending commands
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.queues: dict[ReplyKind, queue.Queue[Received]] = {
+            kind: queue.Queue() for kind in ReplyKind
+        }
+
+    def expect(self, reply: Reply) -> None:
+        """Expect a status reply of the given shape, dropping any stale ones.
+
+        Args:
+            reply (Reply): shape of the reply to the status request about to be sent
+        """
+        with self._lock:
+            self.clear(ReplyKind.STATUS)
+            self._demux.expect(reply)
+
+    def expect_echo(self, data: bytes) -> None:
+        """Expect the VMX to echo back data that is about to be written.
+
+        Args:
+            data (bytes): bytes about to be written
+        """
+        with self._lock:
+            self._demux.expect_echo(data)
+
+    def cancel(self) -> bytes:
+        """Stop expecting a status reply.
+
+        Returns:
+            bytes: whatever part of the reply had arrived
+        """
+        with self._lock:
+            return self._demux.cancel()
+
+    def clear(self, kind: ReplyKind) -> None:
+        """Drop every queued reply of one kind.
+
+        Args:
+            kind (ReplyKind): kind of reply to drop
+        """
+        q = self.queues[kind]
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+    def get(self, kind: ReplyKind, timeout: float) -> Received:
+        """Wait for the next reply of one kind.
+
+        Args:
+            kind (ReplyKind): kind of reply to wait for
+            timeout (float): time, in seconds, to wait
+
+        Returns:
+            Received: the reply
+
+        Raises:
+            TimeoutError: Raised when no reply arrives in time.
+        """
+        try:
+            return self.queues[kind].get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            raise TimeoutError(f"No {kind.name} reply from VMX.") from None
+
+    def stop(self) -> None:
+        """Stop the thread and wait for it to finish."""
+        self._stopping.set()
+        if hasattr(self._serial, "cancel_read"):
+            self._serial.cancel_read()
+        if self.is_alive():
+            self.join(timeout=1)
+
+    def run(self) -> None:
+        """Read from the port until stopped."""
+        timeout = None
+        while not self._stopping.is_set():
+            # Wake up often enough to finish TEXT replies, which have no terminator
+            wanted = (
+                ReplyDemux.TEXT_QUIET
+                if self._demux.pending_text
+                else self.POLL_INTERVAL
+            )
+            if wanted != timeout:
+                timeout = self._serial.timeout = wanted
+            try:
+                data = self._serial.read(max(1, self._serial.in_waiting))
+            except (serial.SerialException, OSError, TypeError):
+                if self._stopping.is_set():
+                    return
+                raise
+            now = time.monotonic()
+            with self._lock:
+                received = self._demux.feed(data, now) if data else []
+                received += self._demux.idle(now)
+            for reply in received:
+                self.queues[reply.kind].put(reply)
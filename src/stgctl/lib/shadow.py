@@ -0,0 +1,282 @@
+"""Host-side mirror of VMX state, kept up to date from every command sent."""
+import re
+from enum import Enum
+
+from stgctl.lib.motion import POWER_ON_ACCEL, POWER_ON_SPEED, MotionModel
+from stgctl.lib.optimize import ACCEL, AxisState, optimize
+
+# PMn, PM-n
+SELECT = re.compile(r"^PM(-?)(\d)$")
+# JMn
+JUMP = re.compile(r"^JM(\d)$")
+# LM0, Lx
+LOOP_START: str = "LM0"
+LOOP_END = re.compile(r"^L(\d+)$")
+# Commands stored in the selected program rather than acted on immediately
+STORED = re.compile(r"^(\(|I|[SA]\d|P[^M]|JM|L|U)")
+# An X or Y reply
+POSITION = re.compile(rb"^([+-]?\d+)\r$")
+# Motors the VMX has, all zeroed by N
+MOTORS: tuple[int, ...] = (1, 2, 3)
+
+
+class Mode(Enum):
+    """Mode of the VMX, as far as the host knows."""
+
+    UNKNOWN = "unknown"
+    JOG = "jog"
+    ONLINE = "online"
+
+
+class ShadowState:
+    """What the host knows of the VMX, updated from every command sent and every reply read.
+
+    Programs are followed through jumps and loops as the VMX would run them.
+    Knowledge is only ever lost conservatively: anything the model does not understand,
+    a reset, a stopped program or an unexpected reply makes it forget rather than guess.
+    Positions are the commanded ones, so a move cut short by a limit switch is not noticed;
+    limit moves themselves make the positions unknown.
+
+    Attributes:
+        mode (Mode): jog or on-line, once set by the host.
+        echo (bool | None): Whether commands are echoed, once set by the host.
+        ready_at (float | None): time.monotonic() at which the VMX last answered V with R,
+            or None if anything since might have changed that.
+        axes (AxisState): Position (in idx from the origin) and speed of each motor.
+        accels (dict[int, int]): AmMx setting of each motor.
+        origins (dict[int, int]): Offset of each motor's origin from where it was when last
+            known, summed over every N and IAmM-0 sent since.
+        programs (dict[int | None, list[str]]): Commands stored in each known program slot.
+            Until a slot is selected, the selected one is known as None.
+        current (int | None): Selected program slot, or None if unknown.
+        predicted (float | None): Duration of the last program run, in seconds, as predicted
+            by the motion model, or None if it could not be predicted.
+    """
+
+    # The VMX holds up to 5 programs
+    PROGRAM_SLOTS: int = 5
+
+    def __init__(self, model: MotionModel | None = None) -> None:
+        """Initialize ShadowState, knowing nothing.
+
+        Args:
+            model (MotionModel, optional): Predicts how long programs run take. Defaults to no predictions.
+        """
+        self.model = model
+        self.predicted: float | None = None
+        self.mode = Mode.UNKNOWN
+        self.echo: bool | None = None
+        self.ready_at: float | None = None
+        self.axes = AxisState()
+        self.accels: dict[int, int] = {}
+        self.origins: dict[int, int] = {}
+        self.programs: dict[int | None, list[str]] = {}
+        self.current: int | None = None
+
+    def forget(self) -> None:
+        """Forget the mode and the motors, keeping the programs the host uploaded."""
+        self.mode = Mode.UNKNOWN
+        self.ready_at = None
+        self.axes.forget()
+        self.accels.clear()
+        self.origins.clear()
+
+    def is_ready(self, now: float, ttl: float) -> bool:
+        """Whether the VMX can be taken to be ready without asking it.
+
+        Args:
+            now (float): time.monotonic()
+            ttl (float): how long a ready reply is trusted for, in seconds
+
+        Returns:
+            bool: True if on-line and answered ready within ttl, with nothing since that could change it
+        """
+        return (
+            self.mode is Mode.ONLINE
+            and self.ready_at is not None
+            and now - self.ready_at < ttl
+        )
+
+    def position(self, motor: int) -> int | None:
+        """Position of a motor, if known.
+
+        Args:
+            motor (int): motor number
+
+        Returns:
+            int | None: position in idx, or None if unknown
+        """
+        return self.axes.positions.get(motor)
+
+    def update(self, cmds: list[str]) -> None:
+        """Follow commands sent to the VMX, in order.
+
+        Args:
+            cmds (list[str]): commands sent
+        """
+        for cmd in cmds:
+            if STORED.match(cmd):
+                self._store(cmd)
+            elif select := SELECT.match(cmd):
+                self.current = int(select[2])
+                self.programs.pop(None, None)
+                if select[1]:
+                    self.programs[self.current] = []
+            else:
+                self._operate(cmd)
+
+    def _operate(self, cmd: str) -> None:
+        """Private method following a command acted on as soon as it is sent.
+
+        Args:
+            cmd (str): operation or status command
+        """
+        match cmd:
+            case "C":
+                self._store(None)
+            case "R":
+                self._run()
+            case "E" | "F":
+                self.mode = Mode.ONLINE
+                self.echo = cmd == "F"
+            case "J" | "Q":
+                self.mode = Mode.JOG
+                self.ready_at = None
+            case "N":
+                for motor in MOTORS:
+                    self._zero(motor)
+            case "res":
+                self._reset()
+            case "V" | "X" | "Y" | "M" | "lst" | "x" | "y" | "!" | "G":
+                pass
+            case _:
+                # K, D, and anything not understood
+                self.forget()
+
+    def observe(self, cmd: str, reply: bytes, now: float) -> None:
+        """Learn from the VMX's reply to a status request.
+
+        Args:
+            cmd (str): status request sent
+            reply (bytes): VMX reply
+            now (float): time.monotonic() at which it arrived
+        """
+        if cmd == "V":
+            if reply == b"R":
+                self.mode = Mode.ONLINE
+                self.ready_at = now
+            elif reply == b"J":
+                self.mode = Mode.JOG
+                self.ready_at = None
+            else:
+                # B, or no answer: settings sent stand, but anything could be moving
+                self.mode = Mode.UNKNOWN
+                self.ready_at = None
+                self.axes.positions.clear()
+        elif cmd in ("X", "Y"):
+            motor = 1 if cmd == "X" else 2
+            if position := POSITION.match(reply):
+                self.axes.positions[motor] = int(position[1])
+            else:
+                self.axes.positions.pop(motor, None)
+
+    def _store(self, cmd: str | None) -> None:
+        """Private method storing a command in the selected program, or clearing it.
+
+        Args:
+            cmd (str | None): command to store, or None to clear the program
+        """
+        if cmd is None:
+            self.programs[self.current] = []
+        elif (program := self.programs.get(self.current)) is not None:
+            program.append(cmd)
+
+    def _run(self) -> None:
+        """Private method following the selected program, as if it had completed."""
+        program = self.programs.get(self.current)
+        followed = {self.current}
+        self.predicted = 0.0 if self.model else None
+        # Stack of [marker index, passes left]
+        loops: list[list[int]] = []
+        i = 0
+        while program is not None:
+            if i == len(program):
+                return
+            cmd = program[i]
+            if jump := JUMP.match(cmd):
+                if int(jump[1]) in followed:
+                    # A chain that loops back never completes on its own
+                    break
+                followed.add(int(jump[1]))
+                program, loops, i = self.programs.get(int(jump[1])), [], 0
+                continue
+            if cmd == LOOP_START:
+                loops.append([i, 0])
+            elif loop_end := LOOP_END.match(cmd):
+                if not loops:
+                    break
+                marker = loops[-1]
+                marker[1] = (marker[1] or int(loop_end[1])) - 1
+                if marker[1]:
+                    i = marker[0]
+                else:
+                    loops.pop()
+            else:
+                self._predict(cmd)
+                self._follow(cmd)
+            i += 1
+        self.axes.forget()
+        self.accels.clear()
+        self.predicted = None
+
+    def _follow(self, cmd: str) -> None:
+        """Private method following one command of a program as it runs.
+
+        Args:
+            cmd (str): program command, other than a jump or loop
+        """
+        if accel := ACCEL.match(cmd):
+            self.accels[int(accel[1])] = int(accel[2])
+        elif cmd.startswith("IA") and cmd.endswith("M-0"):
+            self._zero(int(cmd[2]))
+        else:
+            # Tracks positions and speeds, forgetting them on anything not understood
+            optimize([cmd], self.axes)
+
+    def _predict(self, cmd: str) -> None:
+        """Private method adding the time a program command takes to the predicted duration.
+
+        Args:
+            cmd (str): program command, about to be followed
+        """
+        if self.predicted is None:
+            return
+        duration = self.model.command_time(cmd, self.axes, self.accels)
+        self.predicted = None if duration is None else self.predicted + duration
+
+    def _zero(self, motor: int) -> None:
+        """Private method following a motor's current position being made its zero.
+
+        Args:
+            motor (int): motor number
+        """
+        position = self.axes.positions.get(motor)
+        if position is None:
+            self.origins.pop(motor, None)
+        else:
+            self.origins[motor] = self.origins.get(motor, 0) + position
+        self.axes.positions[motor] = 0
+
+    def _reset(self) -> None:
+        """Private method following a reset to the power-on state."""
+        jog = self.mode is Mode.JOG
+        self.forget()
+        if jog:
+            self.programs = {n: [] for n in range(self.PROGRAM_SLOTS)}
+            self.current = 0
+            self.axes.speeds = dict.fromkeys(MOTORS, POWER_ON_SPEED)
+            self.accels = dict.fromkeys(MOTORS, POWER_ON_ACCEL)
+        else:
+            # A reset while on-line faults the VMX instead, see TODO.md
+            self.programs = {}
+            self.current = None
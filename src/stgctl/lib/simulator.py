@@ -0,0 +1,534 @@
+"""Simulated VMX motor controller on a pseudo-terminal, and a TCP bridge to serve it over the network."""
+import math
+import os
+import pty
+import re
+import select
+import socket
+import threading
+import time
+import tty
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Self
+
+from loguru import logger
+from stgctl.lib.motion import ACCEL_UNIT, POWER_ON_ACCEL, POWER_ON_SPEED, move_time
+from stgctl.lib.reader import ReplyDemux
+from stgctl.lib.vmx import BaseVMX, Motor
+
+# Commands are not always comma separated, eg across separate writes
+TOKEN = re.compile(
+    rb"\(|\)|IA?\dM-?\d+|[SA]\dM\d+|PM-?\d|JM\d|LM0|L\d+|P-?\d+(?:\.\d+)?"
+    rb"|U\d|res|rsm|lst|[RNKCDEFQJVXYMGxy!]"
+)
+# Commands stored in the selected program rather than acted on immediately
+PROGRAM_TOKEN = re.compile(rb"\(|\)|I|[SA]\d|P[^M]|JM|L|U")
+
+
+@dataclass
+class Motion:
+    """A move in progress on one motor.
+
+    Attributes:
+        start (float): Position at the start, in idx.
+        end (float): Position at the end, in idx.
+        speed (float): Top speed, in idx/s.
+        accel (float): Acceleration, in idx/s^2.
+        began (float): time.monotonic() at the start.
+        duration (float): Simulated duration, in seconds.
+        time_scale (float): Wall-clock seconds per simulated second.
+    """
+
+    start: float
+    end: float
+    speed: float
+    accel: float
+    began: float
+    duration: float
+    time_scale: float
+
+    def position(self, now: float) -> float:
+        """Position at a given time.
+
+        Args:
+            now (float): time.monotonic()
+
+        Returns:
+            float: position in idx
+        """
+        if not self.time_scale or not self.duration:
+            return self.end
+        elapsed = min(max((now - self.began) / self.time_scale, 0.0), self.duration)
+        distance = abs(self.end - self.start)
+        t_accel = min(self.speed / self.accel, self.duration / 2)
+        peak = self.accel * t_accel
+        if elapsed < t_accel:
+            moved = self.accel * elapsed**2 / 2
+        elif elapsed < self.duration - t_accel:
+            moved = self.accel * t_accel**2 / 2 + peak * (elapsed - t_accel)
+        else:
+            moved = distance - self.accel * (self.duration - elapsed) ** 2 / 2
+        return self.start + math.copysign(moved, self.end - self.start)
+
+
+@dataclass
+class Axis:
+    """State of one simulated motor.
+
+    Attributes:
+        position (float): Position in the controller's own frame, in idx.
+        zero (float): Position reported as zero, set by N or IAmM-0.
+        speed (int): Speed, in idx/s.
+        accel (int): Acceleration setting, 1 to 127.
+        motion (Motion | None): Move in progress, if any.
+    """
+
+    position: float = 0.0
+    zero: float = 0.0
+    speed: int = POWER_ON_SPEED
+    accel: int = POWER_ON_ACCEL
+    motion: Motion | None = None
+
+    def now(self, now: float) -> float:
+        """Position at a given time, following any move in progress.
+
+        Args:
+            now (float): time.monotonic()
+
+        Returns:
+            float: position in idx
+        """
+        return self.motion.position(now) if self.motion else self.position
+
+
+@dataclass
+class Run:
+    """Record of one program run.
+
+    Attributes:
+        started (float): time.monotonic() at which R was received.
+        completed (float | None): time.monotonic() at which ^ was sent.
+        dwells (list[tuple[int, int]]): Reported (X, Y) position at every pause or user wait.
+        holds (list[tuple[float, float]]): time.monotonic() at which W was sent, and G received,
+            at every user wait.
+    """
+
+    started: float
+    completed: float | None = None
+    dwells: list[tuple[int, int]] = field(default_factory=list)
+    holds: list[tuple[float, float]] = field(default_factory=list)
+
+
+class SimulatedVMX:
+    """Simulated VMX motor controller, serving the master side of a pseudo-terminal.
+
+    Open `port` with VMX (or AsyncVMX) as if it were the real controller.
+    Understands the commands the drivers send: index moves, simultaneous moves in
+    parentheses, speeds, accelerations, pauses, user waits (U6, continued by G), program slots, jumps and loops, the
+    V, X, Y, M and lst status requests, and positions recorded with ! and read with x and y.
+    Programs run in real time, scaled by `time_scale`, with trapezoidal motion at each
+    motor's speed and acceleration, and send `^` when complete.
+
+    Like the real controller, each program slot holds PROGRAM_BYTES, a reset while on-line
+    leaves it answering B until it is put in jog mode and reset again, and status requests
+    are answered while a program runs. Commands are not echoed back.
+
+    Example:
+        with SimulatedVMX(time_scale=0.1) as sim:
+            vmx = VMX(port=sim.port)
+    """
+
+    # Acceleration in idx/s^2 per unit of the AmMx setting
+    ACCEL_UNIT: float = ACCEL_UNIT
+    # Travel of every motor between its limit switches, in idx,
+    # in the frame of the position at power on
+    TRAVEL: tuple[int, int] = (-20000, 20000)
+    # Time to come back after a reset, in seconds
+    RESET_TIME: float = 0.5
+
+    def __init__(self, time_scale: float = 1.0, baud: int | None = None) -> None:
+        """Open the pty and start serving it.
+
+        Args:
+            time_scale (float): Wall-clock seconds per simulated second. 0 makes
+                motion and pauses instant. Defaults to 1.0.
+            baud (int, optional): If given, incoming bytes are only handled after the time
+                they would take to arrive at this baud rate (10 bits per byte).
+        """
+        self.time_scale = time_scale
+        self.baud = baud
+        self.axes = {motor: Axis() for motor in Motor}
+        self.programs: list[list[bytes]] = [[] for _ in range(BaseVMX.PROGRAM_SLOTS)]
+        self.current = 0
+        self.online = False
+        self.faulted = False
+        self.runs: list[Run] = []
+        # (X, Y) positions recorded by !, cleared when a program starts
+        self.recorded: deque[tuple[int, int]] = deque(maxlen=4)
+        # Commands dropped because a program was full
+        self.overflows: list[bytes] = []
+        self._resetting_until = 0.0
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        # Set by G, for a program waiting at U6
+        self._go = threading.Event()
+        # time.monotonic() at which the last G was received
+        self._went = 0.0
+        self._runner: threading.Thread | None = None
+        self._running = False
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._serve, name="vmx-simulator", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop any program, stop serving, and close the pty."""
+        self._halt.set()
+        if self._runner:
+            self._runner.join()
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    @property
+    def running(self) -> bool:
+        """Whether a program is running.
+
+        Returns:
+            bool: True while a program runs
+        """
+        return self._running
+
+    def position(self, motor: Motor) -> int:
+        """Position of a motor, as the controller would report it.
+
+        Args:
+            motor (Motor): motor
+
+        Returns:
+            int: position in idx
+        """
+        axis = self.axes[motor]
+        return round(axis.now(time.monotonic()) - axis.zero)
+
+    def _send(self, data: bytes) -> None:
+        with self._lock:
+            os.write(self._master, data)
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                continue
+            data = os.read(self._master, 1024)
+            if self.baud:
+                time.sleep(10 * len(data) / self.baud)
+            if time.monotonic() < self._resetting_until:
+                continue
+            for token in TOKEN.findall(data):
+                self._handle(token)
+
+    def _handle(self, token: bytes) -> None:
+        if PROGRAM_TOKEN.match(token):
+            self._store(token)
+            return
+        match token:
+            case b"V":
+                if self.faulted or self.running:
+                    self._send(b"B")
+                else:
+                    self._send(b"R" if self.online else b"J")
+            case b"X" | b"Y":
+                motor = Motor.X if token == b"X" else Motor.Y
+                self._send(b"%+08d\r" % self.position(motor))
+            case b"x" | b"y":
+                i = 0 if token == b"x" else 1
+                self._send(b"".join(b"%+08d\r" % p[i] for p in self.recorded))
+            case b"!":
+                # Only recorded while indexing
+                if any(axis.motion for axis in self.axes.values()):
+                    self.recorded.append(
+                        (self.position(Motor.X), self.position(Motor.Y))
+                    )
+            case b"M":
+                self._send(b"%+08d\r" % (BaseVMX.PROGRAM_BYTES - self._used()))
+            case b"lst":
+                self._send(b",".join(self.programs[self.current]))
+            case b"C":
+                self.programs[self.current] = []
+            case b"R":
+                self._run()
+            case b"G":
+                self._went = time.monotonic()
+                self._go.set()
+            case b"K" | b"D":
+                self._halt.set()
+            case b"N":
+                for axis in self.axes.values():
+                    axis.zero = axis.now(time.monotonic())
+            case b"E" | b"F":
+                self.online = True
+            case b"J" | b"Q":
+                self.online = False
+            case b"res":
+                self._reset()
+            case _ if token.startswith(b"PM-"):
+                self.current = int(token[3:])
+                self.programs[self.current] = []
+            case _ if token.startswith(b"PM"):
+                self.current = int(token[2:])
+            case _:
+                logger.debug(f"Simulated VMX ignoring {token!r}")
+
+    def _used(self) -> int:
+        program = self.programs[self.current]
+        # "(" is sent without a comma after it
+        return len(b",".join(program)) - program[:-1].count(b"(")
+
+    def _store(self, token: bytes) -> None:
+        if self._used() + len(token) + 1 > BaseVMX.PROGRAM_BYTES:
+            logger.warning(f"Simulated VMX program {self.current} is full.")
+            self.overflows.append(token)
+            return
+        self.programs[self.current].append(token)
+
+    def _reset(self) -> None:
+        if self.online:
+            # As on the real controller, see TODO.md
+            self.faulted = True
+            return
+        self._halt.set()
+        if self._runner:
+            self._runner.join()
+        now = time.monotonic()
+        for motor, axis in self.axes.items():
+            position = axis.now(now)
+            self.axes[motor] = Axis(position=position, zero=position)
+        self.programs = [[] for _ in range(BaseVMX.PROGRAM_SLOTS)]
+        self.current = 0
+        self.faulted = False
+        self._resetting_until = now + self.RESET_TIME * self.time_scale
+
+    def _run(self) -> None:
+        if self.running:
+            logger.warning("Simulated VMX ignoring R while a program runs.")
+            return
+        self._halt.clear()
+        self._running = True
+        self.recorded.clear()
+        run = Run(started=time.monotonic())
+        self.runs.append(run)
+        self._runner = threading.Thread(
+            target=self._execute, args=(self.current, run), daemon=True
+        )
+        self._runner.start()
+
+    def _execute(self, slot: int, run: Run) -> None:
+        program = list(self.programs[slot])
+        # Stack of [marker index, passes left]
+        loops: list[list[int]] = []
+        group: list[bytes] | None = None
+        i = 0
+        while i < len(program) and not self._halt.is_set():
+            token = program[i]
+            if token == b"(":
+                group = []
+            elif token == b")":
+                self._move(group or [])
+                group = None
+            elif token.startswith(b"I"):
+                if group is None:
+                    self._move([token])
+                else:
+                    group.append(token)
+            elif token.startswith((b"S", b"A")):
+                self._setting(token)
+            elif token.startswith(b"JM"):
+                program, loops, i = list(self.programs[int(token[2:])]), [], 0
+                continue
+            elif token.startswith(b"L"):
+                i = self._loop(token, i, loops)
+            elif token.startswith((b"P", b"U")):
+                run.dwells.append((self.position(Motor.X), self.position(Motor.Y)))
+                self._dwell(token, run)
+            i += 1
+        run.completed = time.monotonic()
+        # Ready for the next program as soon as the host can know this one is done
+        self._running = False
+        self._send(BaseVMX.PROG_COMPLETE.encode())
+
+    def _setting(self, token: bytes) -> None:
+        """Set a motor's speed (SmMx) or acceleration (AmMx)."""
+        axis = self.axes[Motor(int(token[1:2]))]
+        if token.startswith(b"S"):
+            axis.speed = int(token[3:])
+        else:
+            axis.accel = int(token[3:])
+
+    @staticmethod
+    def _loop(token: bytes, i: int, loops: list[list[int]]) -> int:
+        """Mark a loop (LM0) or loop back to the mark (Lx), returning the index of the last token run."""
+        if token == b"LM0":
+            loops.append([i, 0])
+            return i
+        marker = loops[-1]
+        marker[1] = (marker[1] or int(token[1:])) - 1
+        if marker[1]:
+            return marker[0]
+        loops.pop()
+        return i
+
+    def _move(self, tokens: list[bytes]) -> None:
+        """Move motors together, waiting for the longest move."""
+        now = time.monotonic()
+        motions = []
+        for token in tokens:
+            absolute = token.startswith(b"IA")
+            motor, value = token.removeprefix(b"IA" if absolute else b"I").split(b"M")
+            axis = self.axes[Motor(int(motor))]
+            if absolute and value == b"-0":
+                axis.zero = axis.position
+                continue
+            if absolute:
+                target = axis.zero + int(value)
+            elif int(value) == 0:
+                # ImM0 and ImM-0 index to a limit switch
+                target = self.TRAVEL[0] if value.startswith(b"-") else self.TRAVEL[1]
+            else:
+                target = axis.position + int(value)
+            target = min(max(target, self.TRAVEL[0]), self.TRAVEL[1])
+            accel = axis.accel * self.ACCEL_UNIT
+            duration = move_time(target - axis.position, axis.speed, accel)
+            axis.motion = Motion(
+                axis.position, target, axis.speed, accel, now, duration, self.time_scale
+            )
+            motions.append(axis)
+        self._wait(max((axis.motion.duration for axis in motions), default=0.0))
+        halted = time.monotonic()
+        for axis in motions:
+            axis.position = axis.motion.position(halted)
+            axis.motion = None
+
+    def _dwell(self, token: bytes, run: Run) -> None:
+        """Pause (Px), or send W and wait for G (U6), unless the program is stopped."""
+        if token.startswith(b"P"):
+            tenths = float(token[1:])
+            self._wait(tenths / 10 if tenths >= 0 else -tenths / 10000)
+            return
+        self._go.clear()
+        held = time.monotonic()
+        self._send(ReplyDemux.USER_WAIT)
+        while not self._go.wait(0.01) and not self._halt.is_set():
+            pass
+        if self._go.is_set():
+            run.holds.append((held, self._went))
+
+    def _wait(self, duration: float) -> None:
+        """Wait for simulated time to pass, unless the program is stopped."""
+        if duration * self.time_scale > 0:
+            self._halt.wait(duration * self.time_scale)
+
+
+class TcpBridge:
+    """Serves a serial device over TCP, like ser2net in raw mode.
+
+    One client is served at a time; a new connection replaces the current one.
+    Bytes from the device while no client is connected are dropped.
+
+    Example:
+        with SimulatedVMX() as sim, TcpBridge(sim.port) as bridge:
+            vmx = VMX(port=bridge.url)
+    """
+
+    def __init__(self, device: str, host: str = "127.0.0.1", port: int = 0) -> None:
+        """Open the device and start listening.
+
+        Args:
+            device (str): serial device to serve, eg SimulatedVMX.port
+            host (str): address to listen on. Defaults to localhost.
+            port (int): TCP port to listen on. Defaults to any free port.
+        """
+        self._device = os.open(device, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self._device)
+        self._server = socket.create_server((host, port))
+        self.url = f"socket://{host}:{self._server.getsockname()[1]}"
+        # Number of connections accepted
+        self.connections = 0
+        self._client: socket.socket | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._serve, name="tcp-bridge", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def drop(self) -> None:
+        """Drop the current client, as when the network goes down."""
+        if self._client:
+            self._client.shutdown(socket.SHUT_RDWR)
+
+    def close(self) -> None:
+        """Stop serving, and close the device."""
+        self._stop.set()
+        self._thread.join()
+        if self._client:
+            self._client.close()
+        self._server.close()
+        os.close(self._device)
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            watched = [self._server, self._device]
+            if self._client:
+                watched.append(self._client)
+            ready, _, _ = select.select(watched, [], [], 0.05)
+            if self._client and self._client in ready:
+                self._from_client()
+            if self._server in ready:
+                self._accept()
+            if self._device in ready:
+                self._to_client(os.read(self._device, 1024))
+
+    def _accept(self) -> None:
+        if self._client:
+            self._client.close()
+        self._client, _ = self._server.accept()
+        self._client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections += 1
+
+    def _to_client(self, data: bytes) -> None:
+        if not self._client:
+            return
+        try:
+            self._client.sendall(data)
+        except OSError:
+            # Dropped; noticed when reading from the client
+            pass
+
+    def _from_client(self) -> None:
+        try:
+            data = self._client.recv(1024)
+        except OSError:
+            data = b""
+        if data:
+            os.write(self._device, data)
+        else:
+            self._client.close()
+            self._client = None
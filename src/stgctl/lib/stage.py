@@ -1,20 +1,34 @@
 """Class to provide quick API for controlling two Velmex stages."""
 
 import json
+from typing import Self
 
 import numpy
 from loguru import logger
 from stgctl.core.settings import settings
+from stgctl.lib.dwell import DwellStrategy, FixedDwell, HandshakeDwell, event_from_url
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.plan import describe_motion, fastest_motion, moving_time
+from stgctl.lib.program import (
+    RasterMode,
+    chain,
+    loop_programs,
+    memory_free,
+    pack_points,
+    upload,
+    upload_program,
+)
 from stgctl.lib.signal import Signaller
 from stgctl.lib.vmx import VMX, Motor
 from stgctl.schema.models import Size
-from stgctl.util.trajectory import gen_2d_trajectory
+from stgctl.util.progress import ProgressLog
+from stgctl.util.trajectory import limit_travel, raster_geometry, stage_trajectory
 
 
 class XYStage:
     """Abstraction over VMX class. Useful for controlling XY stages."""
 
-    def __init__(self):
+    def __init__(self, vmx: VMX | None = None, dwell: DwellStrategy | None = None):
         """Initialize an instance of XYStage.
 
         This involves setting up the VMX, grid size, step size, observing time, and signaller based on
@@ -25,9 +39,15 @@ class XYStage:
         for the stage, and the observing time defines the time the stage spends at each grid point.
 
         The signaller is used to communicate with a remote host for controlling the data acquisition process.
+
+        Args:
+            vmx (VMX, optional): VMX to drive, eg one replaying a capture. Defaults to connecting to
+                the VMX on settings.VMX_DEVICE_PORT.
+            dwell (DwellStrategy, optional): How to dwell at each raster point. Defaults to waiting
+                for settings.DAQ_EVENT if set, for at most the observing time, else pausing for the observing time.
         """
         # Initialize VMX device
-        self.VMX = VMX(port=settings.VMX_DEVICE_PORT)
+        self.VMX = vmx if vmx is not None else VMX(port=settings.VMX_DEVICE_PORT)
         self._limit_switch_positions = None
         # Grab settings for rastering, gather into Size enum
         self.grid_size = Size(*settings.GRID_SIZE)
@@ -35,39 +55,58 @@ class XYStage:
             Size(*settings.STEP_SIZE) if settings.STEP_SIZE else settings.STEP_SIZE
         )
         self.observing_time = settings.OBSERVE_TIME
+        # None pauses for observing_time, as set when rastering
+        self.dwell = dwell
+        if dwell is None and settings.DAQ_EVENT:
+            self.dwell = HandshakeDwell(
+                event_from_url(settings.DAQ_EVENT), timeout=self.observing_time
+            )
         # Set up remote command execution
         self.signaller = Signaller(settings.SIGNAL_HOST, settings.SIGNAL_USER)
 
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the dwell strategy, eg its DAQ event socket, and close the VMX."""
+        if self.dwell is not None:
+            self.dwell.close()
+        self.VMX.close()
+
     def startup(self, save: bool = False):
         """Run startup sequence.
 
         Homes the stages to +X,+Y limit switches.
         Records locations of limit switches.
+
+        Both motors index together, to the -X,-Y limit switches and back to +X,+Y, so each
+        axis is measured there and back, as it was when visiting the four corners in turn.
+        Each motor's limit switch does not depend on where the other motor is, so the
+        +X,-Y and -X,+Y corners are recorded from the same readings.
         """
         logger.info(
-            "Sending stages to the four limit switches to get index counts for raster."
+            "Sending stages to the limit switches to get index counts for raster."
         )
 
         # Go to +X, +Y limit switches, set origin
-        self.home()
+        if not self.home():
+            return
         # +X,+Y is (0,0) by definition
-        limit_switch_positions = [(0, 0)]
+        positions = []
 
-        # +X,+Y > +X,-Y > -X,-Y > -X,+Y > +X,+Y
-        switch_values = [(True, False), (False, False), (False, True), (True, True)]
-        for switch_value in switch_values:
-            #  Go to -X, -Y limit switches then record position
-            self.VMX.clear().to_limit(motor=Motor.X, pos=switch_value[0]).to_limit(
-                motor=Motor.Y, pos=switch_value[1]
-            ).run().send()
+        # +X,+Y > -X,-Y > +X,+Y
+        for pos in (False, True):
             # VMX.wait_for_complete can timeout
-            # Timeout needs to be reasonably longer than individual commands.
+            # Limit moves are only predicted once the travel is known from earlier limit switch
+            # positions, so a stall is noticed within seconds; until then they get VMX.UNPREDICTED_TIMEOUT.
             try:
-                self.VMX.wait_for_complete(timeout=600)
+                self._approach_limits(pos)
                 logger.info(
                     f"Stages have finished indexing to \
-                    ({'+' if switch_value[0] else '-'}X,{'+' if switch_value[1] else '-'}Y) \
-                    limit switches."
+                    ({'+' if pos else '-'}X,{'+' if pos else '-'}Y) limit switches."
                 )
                 # Get motor positions after
                 x_motor_idx = int(self.VMX.posn(axis=Motor.X).decode().strip())
@@ -75,13 +114,21 @@ class XYStage:
                 logger.debug(
                     f"VMX reports stage position ({x_motor_idx},{y_motor_idx})."
                 )
-                limit_switch_positions.append((x_motor_idx, y_motor_idx))
+                positions.append((x_motor_idx, y_motor_idx))
             except TimeoutError:
                 logger.debug("Waiting for VMX program to complete timed out.")
                 return
 
         logger.info("Stages have recorded limit switch positions.")
-        self.limit_switch_positions = limit_switch_positions
+        (x_min, y_min), (x_max, y_max) = positions
+        # +X,+Y > +X,-Y > -X,-Y > -X,+Y > +X,+Y
+        self.limit_switch_positions = [
+            (0, 0),
+            (0, y_min),
+            (x_min, y_min),
+            (x_min, y_max),
+            (x_max, y_max),
+        ]
 
         if save:
             save_path = "limit_switch_positions.json"
@@ -89,32 +136,62 @@ class XYStage:
                 json.dump(self.limit_switch_positions, f)
             logger.info(f"Saved limit switch positions to {save_path}")
 
-    def home(self) -> None:
+    def home(self) -> bool:
         """Run homing sequence.
 
         Indexes to positive limit switches. Once there, sets it as the origin.
+
+        Returns:
+            bool: Whether the stages got there, rather than timing out.
         """
         logger.info("Sending stages to positive limit switches.")
-        self.VMX.clear().speed(motor=Motor.X, speed=2000).speed(
-            motor=Motor.Y, speed=2000
-        ).to_limit(motor=Motor.X, pos=True).to_limit(
-            motor=Motor.Y, pos=True
-        ).run().send()
         # VMX.wait_for_complete can timeout
-        # Timeout needs to be reasonably longer than individual commands.
+        # Predicted from the travel between limit switches, if known, else VMX.UNPREDICTED_TIMEOUT
         try:
-            self.VMX.wait_for_complete(timeout=600)
+            self._approach_limits(True)
             logger.info("Stages have finished indexing to the positive limit switches.")
             # Set origin to current location (should be +X,+Y limit switches)
             self.VMX.clear().origin().send()
             logger.info("Origin set.")
-            return
+            return True
         except TimeoutError:
             logger.warning(
                 "Waiting for VMX program to complete timed out. The stages could be anywhere."
             )
+            return False
 
-    def raster(self, signal: bool = True) -> None:
+    def _approach_limits(self, pos: bool) -> None:
+        """Private method indexing both motors to their positive or negative limit switches.
+
+        The motors approach at settings.HOMING_FAST_SPEED and settings.ACCEL_LIMIT, back off
+        settings.HOMING_BACKOFF idx, and approach again at settings.HOMING_SPEED,
+        so where they stop depends on the switch rather than on how fast they hit it.
+        The fast approach has its own speed, so raising the raster speed limit does not
+        raise the speed the stages hit the switches at.
+        It is all one program, waited on once.
+
+        Args:
+            pos (bool): Whether to index to the positive limit switches.
+
+        Raises:
+            TimeoutError: Raised when the program does not complete in the time predicted for it.
+        """
+        motors = (Motor.X, Motor.Y)
+        limits = dict.fromkeys(motors, pos)
+        backoff = -settings.HOMING_BACKOFF if pos else settings.HOMING_BACKOFF
+        self.VMX.clear()
+        for motor, accel in zip(motors, settings.ACCEL_LIMIT, strict=True):
+            self.VMX.speed(motor=motor, speed=settings.HOMING_FAST_SPEED).accel(
+                motor=motor, accel=accel
+            )
+        self.VMX.to_limits(limits=limits)
+        self.VMX.move_many(moves=dict.fromkeys(limits, backoff), relative=True)
+        for motor in motors:
+            self.VMX.speed(motor=motor, speed=settings.HOMING_SPEED)
+        self.VMX.to_limits(limits=limits).run().send()
+        self.VMX.wait_for_complete(timeout=None)
+
+    def raster(self, signal: bool = True, mode: RasterMode = RasterMode.PACKED) -> None:
         """Perform a grid raster.
 
         If step size omitted, calculates stage side lengths in idx in order to compute
@@ -122,16 +199,24 @@ class XYStage:
 
         Args:
             signal (bool): Whether to execute aq signal remote commands. Defaults to True.
+            mode (RasterMode): How points are sent to the VMX. Defaults to RasterMode.PACKED.
         """
+        if mode == RasterMode.PIPELINED and not settings.PIPELINED_UPLOADS:
+            raise InvalidVMXCommandError(
+                "Pipelined rasters upload programs while one runs, which is not verified "
+                "on the VMX. Set STGCTL_PIPELINED_UPLOADS=true to use them anyway."
+            )
         # Use gen_trajectory to get a trajectory (X(t), Y(t))
         self.gen_trajectory()
-        # May want to fine-tune
-        raster_idx_speed = 1500
-
-        logger.debug(f"Setting motor speed to {raster_idx_speed} for both motors.")
+        speed, accel = fastest_motion(
+            self._trajectory, Size(*settings.SPEED_LIMIT), Size(*settings.ACCEL_LIMIT)
+        )
+        logger.info(f"Rastering at {describe_motion(self._trajectory, speed, accel)}.")
 
-        self.VMX.clear().speed(motor=Motor.X, speed=raster_idx_speed).speed(
-            motor=Motor.Y, speed=raster_idx_speed
+        self.VMX.clear().speed(motor=Motor.X, speed=speed.X).speed(
+            motor=Motor.Y, speed=speed.Y
+        ).accel(motor=Motor.X, accel=accel.X).accel(
+            motor=Motor.Y, accel=accel.Y
         ).run().send()
 
         if signal:
@@ -145,20 +230,17 @@ class XYStage:
         logger.info(f"Starting a raster with {len(self._trajectory)} points.")
         # Since any wait_for_complete can time out, wrap whole loop in try-finally
         # We want the timeouterror to be raised and crash the script
+        dwell = self.dwell or FixedDwell(self.observing_time)
         try:
-            for i, coord in enumerate(self._trajectory):
-                logger.info(f"Now indexing to {coord}.")
-                self.VMX.clear()
-                self.VMX.move(motor=Motor.X, idx=coord[0], relative=False)
-                self.VMX.move(motor=Motor.Y, idx=coord[1], relative=False)
-                self.VMX.pause(time=self.observing_time)
-                self.VMX.run().send()
-                logger.info(
-                    f"Starting (now/total rows, now/total columns).\n \
-                      ({divmod(i,self.grid_size.X)[1]+1}/{self.grid_size.X},{divmod(i,self.grid_size.X)[0]+1}/{self.grid_size.Y})"
-                )
-                self.VMX.wait_for_complete(timeout=600)
-                logger.info("Program complete, moving to next position.")
+            match mode:
+                case RasterMode.POINT:
+                    self._raster_points(dwell)
+                case RasterMode.PACKED:
+                    self._raster_packed(dwell)
+                case RasterMode.LOOPED:
+                    self._raster_looped(dwell)
+                case RasterMode.PIPELINED:
+                    self._raster_pipelined(dwell, speed, accel)
         # Even if the rastering fails, send end signal
         finally:
             if signal:
@@ -168,6 +250,145 @@ class XYStage:
 
         logger.info(f"Completed {self.grid_size} raster.")
 
+    def _raster_points(self, dwell: DwellStrategy) -> None:
+        """Raster with one program, and one round trip, per point.
+
+        Args:
+            dwell (DwellStrategy): how to dwell at each point
+        """
+        progress = ProgressLog(len(self._trajectory))
+        for i, coord in enumerate(self._trajectory):
+            row, column = divmod(i, self.grid_size.X)
+            logger.debug(
+                "Now indexing to {} (column {}/{}, row {}/{}).",
+                coord,
+                column + 1,
+                self.grid_size.X,
+                row + 1,
+                self.grid_size.Y,
+            )
+            self.VMX.clear()
+            self.VMX.move_many(
+                moves={Motor.X: coord[0], Motor.Y: coord[1]}, relative=False
+            )
+            dwell.queue(self.VMX)
+            self.VMX.run().send()
+            dwell.serve(self.VMX, 1)
+            self.VMX.wait_for_complete(timeout=None)
+            progress.update(i + 1)
+
+    def _raster_packed(self, dwell: DwellStrategy) -> None:
+        """Raster with as many points per program as fit, chained across the program slots.
+
+        The host only waits on the VMX once per batch of programs.
+
+        Args:
+            dwell (DwellStrategy): how to dwell at each point
+        """
+        # Pack against what the VMX says it can hold, not just the documented limit
+        budget = min(VMX.PROGRAM_BYTES, memory_free(self.VMX))
+        programs = pack_points(self._trajectory, dwell.command, budget=budget)
+        logger.info(
+            f"Packed {len(self._trajectory)} points into {len(programs)} programs of up to {budget} bytes."
+        )
+        done = 0
+        for batch in chain(programs):
+            points = sum(program.points for program in batch)
+            upload(self.VMX, batch)
+            self.VMX.run(now=True)
+            logger.info(
+                f"Running points {done + 1}-{done + points} of {len(self._trajectory)}."
+            )
+            dwell.serve(self.VMX, points)
+            # Timeout is predicted from the batch itself
+            self.VMX.wait_for_complete(timeout=None)
+            done += points
+        # Leave a single, empty program selected for whatever runs next
+        self.VMX.program(now=True, n=0, clear=True)
+
+    def _raster_looped(self, dwell: DwellStrategy) -> None:
+        """Raster with constant-size looped programs of relative moves.
+
+        The programs are uploaded once, and the host waits on the VMX once per pair of rows.
+
+        Args:
+            dwell (DwellStrategy): how to dwell at each point
+        """
+        looped = loop_programs(self._trajectory, self.grid_size, dwell.command)
+        upload(self.VMX, looped.programs)
+        done = 0
+        for slot, points in looped.schedule:
+            self.VMX.program(n=slot).run().send()
+            logger.info(
+                f"Running points {done + 1}-{done + points} of {len(self._trajectory)}."
+            )
+            dwell.serve(self.VMX, points)
+            self.VMX.wait_for_complete(timeout=None)
+            done += points
+        self.VMX.program(now=True, n=0, clear=True)
+
+    def _raster_pipelined(self, dwell: DwellStrategy, speed: Size, accel: Size) -> None:
+        """Raster with packed programs chained on the VMX, each uploaded while the previous one runs.
+
+        Programs alternate between slots 0 and 1, and all but the last end with a user wait and
+        a jump to the other slot. The host uploads the next program while one runs, then answers
+        its W with G, so the VMX goes straight on to the next program: the gap between programs
+        is a byte each way, rather than waiting for ^ then selecting and running the next.
+        Memory is read once, before anything runs, since status requests fault a running program.
+
+        Uploading while a program runs is not yet verified on the VMX, so raster only uses this
+        mode when settings.PIPELINED_UPLOADS is set.
+
+        The motion model cannot follow a jump into a slot uploaded after the run, so the wait
+        for the last program is timed from its G, by what that program alone is predicted to take.
+
+        Args:
+            dwell (DwellStrategy): how to dwell at each point
+            speed (Size): speed of each motor, in idx/s
+            accel (Size): AmMx setting of each motor
+        """
+        free = min(VMX.PROGRAM_BYTES, memory_free(self.VMX))
+        # Leave room for the user wait ahead of the jump pack_points makes room for
+        budget = free - len("," + VMX.USER_WAIT)
+        programs = pack_points(self._trajectory, dwell.command, budget=budget)
+        logger.info(
+            f"Packed {len(self._trajectory)} points into {len(programs)} programs of up to {budget} bytes."
+        )
+        slots = (0, 1)
+        for i, program in enumerate(programs[:-1]):
+            program.commands.extend(
+                [VMX.USER_WAIT, VMX.JUMP_PROG.format(n=slots[(i + 1) % 2])]
+            )
+        upload_program(self.VMX, slots[0], programs[0], free)
+        self.VMX.run(now=True)
+        done = 0
+        for i, program in enumerate(programs):
+            logger.info(
+                f"Running points {done + 1}-{done + program.points} of {len(self._trajectory)}."
+            )
+            last = i + 1 == len(programs)
+            # The slot was last used by the program before this one, which has jumped out of it
+            if not last:
+                upload_program(self.VMX, slots[(i + 1) % 2], programs[i + 1], free)
+            dwell.serve(self.VMX, program.points)
+            if not last:
+                self.VMX.wait_for_user(timeout=VMX.UNPREDICTED_TIMEOUT)
+                self.VMX.go()
+            done += program.points
+        # From the point before the last program, or the origin
+        segment = self._trajectory[max(0, done - programs[-1].points - 1) : done]
+        if len(segment) > programs[-1].points:
+            segment = segment - segment[0]
+        predicted = (
+            moving_time(segment, speed, accel)
+            + programs[-1].points * self.observing_time
+        )
+        self.VMX.wait_for_complete(
+            timeout=predicted * settings.TIMEOUT_SCALE + settings.TIMEOUT_MARGIN
+        )
+        self.VMX.program(now=True, n=slots[1], clear=True)
+        self.VMX.program(now=True, n=slots[0], clear=True)
+
     def test_signal_setup(self) -> None:
         """Moves stages to home, signals start, moves back to home, then signals end.
 
@@ -191,14 +412,13 @@ class XYStage:
         test_idx = -5000
         logger.info(f"Moving to {test_idx}.")
         self.VMX.clear()
-        self.VMX.move(motor=Motor.X, idx=test_idx, relative=True)
-        self.VMX.move(motor=Motor.Y, idx=test_idx, relative=True)
+        self.VMX.move_many(moves={Motor.X: test_idx, Motor.Y: test_idx}, relative=True)
         self.VMX.pause(time=self.observing_time)
         self.VMX.run().send()
         # Since any wait_for_complete can time out, wrap whole loop in try-finally
         # We want the timeouterror to be raised and crash the script
         try:
-            self.VMX.wait_for_complete(timeout=600)
+            self.VMX.wait_for_complete(timeout=None)
         finally:
             # Signal end
             logger.info("Sending end signal.")
@@ -211,55 +431,34 @@ class XYStage:
         self.home()
 
     def gen_trajectory(self) -> None:
-        """Generate grid raster trajectory."""
+        """Generate grid raster trajectory.
+
+        Raises:
+            ValueError: Raised when there is neither a step size in settings nor limit switch
+                positions to spread the grid between.
+        """
+        travel = self.measured_travel()
         # GRID_SIZE is required/has a default. If step size given,
         # we do not use the values from homing
-        if settings.GRID_SIZE and settings.STEP_SIZE:
+        if settings.STEP_SIZE:
             logger.info("Using grid and step size from settings.")
-
-        elif hasattr(self, "limit_switch_positions"):
+        elif travel is not None:
             logger.info(
                 "Using grid and step size generated from limit switch positions."
             )
-            # gather positions into array where each row is a coordinate
-            lsp = numpy.array(self.limit_switch_positions)
-            logger.debug(f"Using this array of limit switch positions:\n {lsp}")
-            # diff sequential rows to get coordinate distance between points
-            stg_len = numpy.abs(numpy.diff(lsp, axis=0))
-            # Since we traveled on each side twice, might as well average them.
-            # Sometimes the VMX reports a 1-10 index difference at the limit switches.
-            # Just ignore anything below the mean, should catch these small glitches
-            x_total_idx = numpy.mean(
-                stg_len[:, 0][stg_len[:, 0] > numpy.mean(numpy.abs(stg_len[:, 0]))]
-            )
-            y_total_idx = numpy.mean(
-                stg_len[:, 1][stg_len[:, 1] > numpy.mean(numpy.abs(stg_len[:, 1]))]
-            )
-            # To not hit the limit switches in normal operation, we offset by an inch
-            logger.debug(f"Number of indexes in (x,y):\n ({x_total_idx},{y_total_idx}")
-            x_reduced_idx = x_total_idx - x_total_idx * (2 * 1 / 30)
-            y_reduced_idx = y_total_idx - y_total_idx * (2 * 1 / 30)
-            # We now split each dimension
-            self.step_size = Size(
-                x_reduced_idx / self.grid_size.X, y_reduced_idx / self.grid_size.Y
-            )
-
         else:
             logger.warning("Either set raster parameters manually or run startup.")
-            return
+        # To not hit the limit switches in normal operation, we offset by an inch
+        self.step_size, travel = raster_geometry(
+            self.grid_size,
+            Size(*settings.STEP_SIZE) if settings.STEP_SIZE else None,
+            travel,
+        )
 
         logger.debug(
             f"Generating 2D raster trajectory with grid size {self.grid_size} and step size {self.step_size}."
         )
-        self._trajectory = gen_2d_trajectory(self.grid_size, self.step_size)
-        # Need to offset from limit switches
-        offset = [
-            numpy.array(x_total_idx * (1 * 1 / 30)).astype(int),
-            numpy.array(y_total_idx * (1 * 1 / 30)).astype(int),
-        ]
-        self._trajectory += offset
-        # Since the origin is at +X,+Y limit switches, we can only index to negative numbers
-        self._trajectory = -self._trajectory
+        self._trajectory = stage_trajectory(self.grid_size, self.step_size, travel)
 
     def goto(self, coord: Size, relative: bool = False, speed: int = 1500):
         """Go to a commanded coordinate, in (X,Y) indexes.
@@ -278,13 +477,14 @@ class XYStage:
         # Go to index
         logger.info(f"Moving to {coord}.")
         self.VMX.clear()
-        self.VMX.move(motor=Motor.X, idx=coord.X, relative=relative)
-        self.VMX.move(motor=Motor.Y, idx=coord.Y, relative=relative)
+        self.VMX.move_many(
+            moves={Motor.X: coord.X, Motor.Y: coord.Y}, relative=relative
+        )
         self.VMX.run().send()
         # Since any wait_for_complete can time out, wrap whole loop in try-finally
         # We want the timeouterror to be raised and crash the script
         try:
-            self.VMX.wait_for_complete(timeout=600)
+            self.VMX.wait_for_complete(timeout=None)
         except TimeoutError:
             logger.warning(
                 "Waiting for VMX program to complete timed out. The stages could be anywhere."
@@ -308,6 +508,26 @@ class XYStage:
 
         """
         self._limit_switch_positions = value
+        # Moves of unknown length, eg to the limit switches, can then be timed out
+        # within seconds rather than after VMX.UNPREDICTED_TIMEOUT
+        travel = self.measured_travel()
+        if travel is not None:
+            self.VMX.shadow.model.travel = int(numpy.ceil(max(travel)))
+
+    def measured_travel(self) -> Size | None:
+        """Travel of each stage between its limit switches, from the limit switch positions.
+
+        Returns:
+            Size | None: travel in (x,y) idx, or None if the limit switch positions are unknown
+        """
+        if not self.limit_switch_positions:
+            return None
+        logger.debug(
+            f"Using this array of limit switch positions:\n {numpy.array(self.limit_switch_positions)}"
+        )
+        travel = limit_travel(self.limit_switch_positions)
+        logger.debug(f"Number of indexes in (x,y):\n ({travel.X},{travel.Y}")
+        return travel
 
     @property
     def trajectory(self) -> numpy.ndarray:
@@ -0,0 +1,220 @@
+"""Position telemetry sampled during motion, kept in a NumPy ring buffer."""
+import re
+import threading
+from collections import deque
+
+import numpy
+
+# One position sample: time.monotonic() at which ! was sent, and the recorded X and Y, in idx
+SAMPLE = numpy.dtype([("time", "f8"), ("x", "i4"), ("y", "i4")])
+# A recorded position in an x or y reply
+RECORDED = re.compile(rb"[+-]?\d+")
+
+
+class TelemetryBuffer:
+    """Fixed-size ring buffer of position samples.
+
+    Pushing copies the samples in under a short lock and never waits on consumers,
+    so it is cheap enough for the control path. Consumers read through a Subscription.
+    """
+
+    def __init__(self, capacity: int = 4096) -> None:
+        """Initialize TelemetryBuffer.
+
+        Args:
+            capacity (int): Number of samples kept. Defaults to 4096.
+        """
+        self._data = numpy.zeros(capacity, dtype=SAMPLE)
+        # Samples pushed since the buffer was made, including overwritten ones
+        self._count = 0
+        self._cond = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        """Number of samples kept."""
+        return len(self._data)
+
+    @property
+    def count(self) -> int:
+        """Number of samples pushed, including ones since overwritten."""
+        return self._count
+
+    def push(self, samples: numpy.ndarray) -> None:
+        """Append samples, overwriting the oldest once full.
+
+        Args:
+            samples (numpy.ndarray): samples of dtype SAMPLE
+        """
+        with self._cond:
+            kept = samples[-self.capacity :]
+            first = self._count + len(samples) - len(kept)
+            self._data[(first + numpy.arange(len(kept))) % self.capacity] = kept
+            self._count += len(samples)
+            self._cond.notify_all()
+
+    def latest(self, n: int | None = None) -> numpy.ndarray:
+        """Copy of the most recent samples, oldest first.
+
+        Args:
+            n (int, optional): Number of samples. Defaults to all that are kept.
+
+        Returns:
+            numpy.ndarray: samples of dtype SAMPLE
+        """
+        with self._cond:
+            n = min(self.capacity if n is None else n, self._count)
+            return self._since(self._count - n)
+
+    def subscribe(self) -> "Subscription":
+        """Start following samples pushed from now on.
+
+        Returns:
+            Subscription: reads new samples
+        """
+        with self._cond:
+            return Subscription(self, self._count)
+
+    def _since(self, start: int) -> numpy.ndarray:
+        """Private method copying samples from a position in the stream. The lock must be held.
+
+        Args:
+            start (int): position of the first sample, no older than capacity samples ago
+
+        Returns:
+            numpy.ndarray: samples of dtype SAMPLE
+        """
+        return self._data[numpy.arange(start, self._count) % self.capacity]
+
+
+class Subscription:
+    """A consumer's position in a TelemetryBuffer.
+
+    Attributes:
+        missed (int): Samples overwritten before this subscription read them.
+    """
+
+    def __init__(self, buffer: TelemetryBuffer, start: int) -> None:
+        """Initialize Subscription. Use TelemetryBuffer.subscribe.
+
+        Args:
+            buffer (TelemetryBuffer): buffer to follow
+            start (int): position in the stream to read from
+        """
+        self._buffer = buffer
+        self._next = start
+        self.missed = 0
+
+    def read(self) -> numpy.ndarray:
+        """Samples pushed since the last read, without waiting.
+
+        Returns:
+            numpy.ndarray: samples of dtype SAMPLE, oldest first. Empty if there are none.
+        """
+        buffer = self._buffer
+        with buffer._cond:
+            oldest = buffer.count - buffer.capacity
+            if self._next < oldest:
+                self.missed += oldest - self._next
+                self._next = oldest
+            samples = buffer._since(self._next)
+            self._next = buffer.count
+        return samples
+
+    def wait(self, timeout: float | None = None) -> numpy.ndarray:
+        """Wait for samples to be pushed, then read them.
+
+        Args:
+            timeout (float, optional): Time to wait, in seconds. Defaults to waiting until there are some.
+
+        Returns:
+            numpy.ndarray: samples of dtype SAMPLE, oldest first. Empty if none arrived in time.
+        """
+        with self._buffer._cond:
+            self._buffer._cond.wait_for(
+                lambda: self._buffer.count > self._next, timeout
+            )
+        return self.read()
+
+
+class PositionTelemetry:
+    """Samples motor positions during programs, without status requests mid-program.
+
+    A status request like X sent while a program runs puts the VMX in an error state, but
+    ! (VMX.record_posn) is allowed: it records the positions of all motors into a small FIFO.
+    While VMX.wait_for_complete waits, it sends ! every `interval` and stamps the time, and once
+    nothing is left running it reads the FIFO back with x and y and pushes the samples.
+
+    The FIFO keeps the last FIFO_DEPTH recordings of a program, so a program gives at most that
+    many samples, from its end. The VMX only records while indexing, and does not say when,
+    so samples are stamped by matching the last recordings to the last ! sent. Stamps are only
+    exact for programs that end while indexing; for one that ends in a pause, they are late by
+    up to the length of the pause.
+
+    Example:
+        vmx.telemetry = PositionTelemetry(interval=0.05)
+        samples = vmx.telemetry.subscribe()
+        vmx.clear().move(idx=4000).run().send()
+        vmx.wait_for_complete()
+        samples.read()["x"]
+    """
+
+    # Recordings the VMX keeps between programs
+    FIFO_DEPTH: int = 4
+
+    def __init__(self, interval: float = 0.1, capacity: int = 4096) -> None:
+        """Initialize PositionTelemetry.
+
+        Args:
+            interval (float): Time between recordings during a program, in seconds. Defaults to 0.1.
+            capacity (int): Number of samples kept. Defaults to 4096.
+        """
+        self.interval = interval
+        self.buffer = TelemetryBuffer(capacity)
+        self._stamps: deque[float] = deque(maxlen=self.FIFO_DEPTH)
+
+    def subscribe(self) -> Subscription:
+        """Start following samples collected from now on.
+
+        Returns:
+            Subscription: reads new samples
+        """
+        return self.buffer.subscribe()
+
+    @property
+    def pending(self) -> bool:
+        """Whether ! was sent since the recordings were last collected.
+
+        Returns:
+            bool: True if there may be recordings to read back
+        """
+        return bool(self._stamps)
+
+    def stamp(self, now: float) -> None:
+        """Note that ! was sent.
+
+        Args:
+            now (float): time.monotonic() at which it was sent
+        """
+        self._stamps.append(now)
+
+    def collect(self, x: bytes, y: bytes) -> int:
+        """Push the recorded positions read back from the VMX.
+
+        Args:
+            x (bytes): reply to x
+            y (bytes): reply to y
+
+        Returns:
+            int: number of samples pushed
+        """
+        xs = [int(p) for p in RECORDED.findall(x)]
+        ys = [int(p) for p in RECORDED.findall(y)]
+        n = min(len(xs), len(ys), len(self._stamps))
+        samples = numpy.zeros(n, dtype=SAMPLE)
+        if n:
+            samples["time"] = list(self._stamps)[-n:]
+            samples["x"] = xs[-n:]
+            samples["y"] = ys[-n:]
+            self.buffer.push(samples)
+        self._stamps.clear()
+        return n
@@ -0,0 +1,562 @@
+"""Transports for VMX serial traffic: over TCP, recording it to a capture file, and replaying a capture.
+
+A transport stands in for the serial.Serial port that VMX and its reader thread use,
+so it provides the subset of that interface they rely on: read, write, in_waiting,
+timeout, cancel_read and close.
+
+Capture files start with CAPTURE_MAGIC, followed by one record per read or write.
+Each record is a RECORD header (direction, seconds since the capture started, length)
+followed by the bytes themselves.
+"""
+import math
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+from typing import Self
+from urllib.parse import urlsplit
+
+import serial
+from loguru import logger
+from stgctl.lib.exceptions import ReplayMismatchError, VmxNotReadyError
+
+# Identifies a capture file, and its format version
+CAPTURE_MAGIC: bytes = b"STGCAP\x01"
+# direction, time since the capture started in seconds, length of the data
+RECORD = struct.Struct("<BdI")
+
+
+def open_port(
+    port: str, connect_timeout: float = 5.0, reconnect_attempts: int = 3
+) -> "serial.Serial | SocketTransport":
+    """Open the port a VMX is connected to.
+
+    Args:
+        port (str): serial device, eg /dev/ttyUSB0, or socket://host:port for a
+            serial-to-Ethernet bridge. Other pyserial URLs, eg rfc2217://host:port, are opened by pyserial.
+        connect_timeout (float): For socket:// ports, time to wait for a connection, in seconds.
+            Defaults to 5.0.
+        reconnect_attempts (int): For socket:// ports, how many times to try reconnecting
+            when the connection drops. Defaults to 3.
+
+    Returns:
+        serial.Serial | SocketTransport: the open port, with reads not blocking
+    """
+    if port.startswith("socket://"):
+        transport = SocketTransport.from_url(
+            port, connect_timeout=connect_timeout, reconnect_attempts=reconnect_attempts
+        )
+        transport.timeout = 0
+        return transport
+    if "://" in port:
+        return serial.serial_for_url(port, timeout=0)
+    return serial.Serial(port, timeout=0)
+
+
+class Direction(IntEnum):
+    """Direction of a captured chunk of bytes."""
+
+    # Written by the host
+    WRITE = 0
+    # Read from the VMX
+    READ = 1
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    """A chunk of bytes written or read.
+
+    Attributes:
+        direction (Direction): Whether the host wrote or read the bytes.
+        time (float): Seconds since the capture started.
+        data (bytes): The bytes.
+    """
+
+    direction: Direction
+    time: float
+    data: bytes
+
+
+def read_capture(path: str | Path) -> Iterator[CaptureRecord]:
+    """Read the records of a capture file.
+
+    Args:
+        path (str | Path): capture file
+
+    Yields:
+        CaptureRecord: records, in the order they were captured
+
+    Raises:
+        ValueError: Raised when the file is not a capture, or is truncated.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a serial capture.")
+        while header := f.read(RECORD.size):
+            if len(header) < RECORD.size:
+                raise ValueError(f"{path} is truncated.")
+            direction, t, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                raise ValueError(f"{path} is truncated.")
+            yield CaptureRecord(Direction(direction), t, data)
+
+
+class RecordingTransport:
+    """Wraps an open serial port, recording every byte written and read to a capture file."""
+
+    def __init__(self, port: serial.Serial, path: str | Path) -> None:
+        """Initialize RecordingTransport.
+
+        Args:
+            port (serial.Serial): open serial port to the VMX
+            path (str | Path): capture file to write. Overwritten if it exists.
+        """
+        self._port = port
+        self._file = open(Path(path).expanduser(), "wb")  # noqa: SIM115
+        self._file.write(CAPTURE_MAGIC)
+        # Reads happen on the reader thread, writes on the caller's
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        logger.info(f"Recording serial traffic to {path}")
+
+    @property
+    def timeout(self) -> float | None:
+        """Read timeout of the wrapped port, in seconds."""
+        return self._port.timeout
+
+    @timeout.setter
+    def timeout(self, value: float | None) -> None:
+        self._port.timeout = value
+
+    @property
+    def in_waiting(self) -> int:
+        """Number of bytes waiting to be read."""
+        return self._port.in_waiting
+
+    def fileno(self) -> int:
+        """File descriptor of the wrapped port."""
+        return self._port.fileno()
+
+    def read(self, size: int = 1) -> bytes:
+        """Read from the port, recording what was read.
+
+        Args:
+            size (int): maximum number of bytes to read
+
+        Returns:
+            bytes: bytes read
+        """
+        data = self._port.read(size)
+        if data:
+            self._record(Direction.READ, data)
+        return data
+
+    def write(self, data: bytes) -> int | None:
+        """Write to the port, recording what was written.
+
+        Args:
+            data (bytes): bytes to write
+
+        Returns:
+            int | None: number of bytes written
+        """
+        # Recorded first, so replies read on the reader thread are recorded after it
+        self._record(Direction.WRITE, data)
+        return self._port.write(data)
+
+    def cancel_read(self) -> None:
+        """Abort a blocking read on the wrapped port."""
+        self._port.cancel_read()
+
+    def close(self) -> None:
+        """Close the wrapped port and the capture file."""
+        self._port.close()
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _record(self, direction: Direction, data: bytes) -> None:
+        """Private method appending a record to the capture file.
+
+        Args:
+            direction (Direction): whether data was written or read
+            data (bytes): the bytes
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            t = time.monotonic() - self._start
+            self._file.write(RECORD.pack(direction, t, len(data)))
+            self._file.write(data)
+            # Host writes are rare, so flushing on each keeps a capture of a crashed run useful
+            if direction is Direction.WRITE:
+                self._file.flush()
+
+
+class ReplayTransport:
+    """Plays back a capture file in place of the VMX.
+
+    Writes must match what the host wrote when the capture was made, or ReplayMismatchError is
+    raised. Reads return the captured replies, each delayed after the write that preceded it
+    by the same time as when captured, divided by speed.
+    Chunking of writes may differ from the capture, as only the byte stream is compared.
+    """
+
+    def __init__(self, path: str | Path, speed: float = 1.0) -> None:
+        """Initialize ReplayTransport.
+
+        Args:
+            path (str | Path): capture file to play back
+            speed (float): How much faster than captured to reply, greater than 0.
+                math.inf replies at once. Defaults to 1.0, the captured timing.
+        """
+        self.timeout: float | None = None
+        self._records = list(read_capture(path))
+        self._speed = speed
+        self._next = 0
+        # Bytes written that have not yet matched a whole captured write
+        self._written = bytearray()
+        # Captured reads not yet due, as (time.monotonic() due, bytes)
+        self._due: deque[tuple[float, bytes]] = deque()
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._cancelled = False
+        self._closed = False
+        self._schedule(time.monotonic(), 0.0)
+
+    @property
+    def finished(self) -> bool:
+        """Whether every captured write has been matched and every captured read returned."""
+        with self._cond:
+            return (
+                self._next == len(self._records)
+                and not self._due
+                and not self._buffer
+                and not self._written
+            )
+
+    @property
+    def in_waiting(self) -> int:
+        """Number of captured bytes that are due to be read."""
+        with self._cond:
+            self._release(time.monotonic())
+            return len(self._buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        """Read captured replies that are due, waiting up to timeout for one.
+
+        Args:
+            size (int): maximum number of bytes to read
+
+        Returns:
+            bytes: bytes read, empty if none were due in time
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._release(now)
+                if self._buffer or self._cancelled or self._closed:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+                due = self._due[0][0] if self._due else None
+                wake = [t for t in (deadline, due) if t is not None]
+                self._cond.wait(min(wake) - now if wake else None)
+            self._cancelled = False
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def write(self, data: bytes) -> int:
+        """Check written bytes against the capture, and schedule the replies that followed them.
+
+        Args:
+            data (bytes): bytes to write
+
+        Returns:
+            int: number of bytes written
+
+        Raises:
+            ReplayMismatchError: Raised when data differs from what was captured.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self._written += data
+            while self._next < len(self._records):
+                record = self._records[self._next]
+                if not self._written.startswith(record.data):
+                    break
+                del self._written[: len(record.data)]
+                self._next += 1
+                self._schedule(now, record.time)
+            if self._written:
+                expected = (
+                    self._records[self._next].data
+                    if self._next < len(self._records)
+                    else b""
+                )
+                if not expected.startswith(self._written):
+                    raise ReplayMismatchError(
+                        f"Wrote {bytes(self._written)!r} where the capture has {expected!r}."
+                    )
+            self._cond.notify_all()
+        return len(data)
+
+    def cancel_read(self) -> None:
+        """Abort a blocking read."""
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Stop replaying."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _schedule(self, now: float, captured: float) -> None:
+        """Private method scheduling the captured reads up to the next captured write.
+
+        Args:
+            now (float): time.monotonic() of the write the reads follow
+            captured (float): capture time of that write
+        """
+        while self._next < len(self._records):
+            record = self._records[self._next]
+            if record.direction is Direction.WRITE:
+                return
+            delay = 0.0 if math.isinf(self._speed) else record.time - captured
+            self._due.append((now + max(0.0, delay) / self._speed, record.data))
+            self._next += 1
+
+    def _release(self, now: float) -> None:
+        """Private method moving captured reads that are due into the read buffer.
+
+        Args:
+            now (float): time.monotonic()
+        """
+        while self._due and self._due[0][0] <= now:
+            self._buffer += self._due.popleft()[1]
+
+
+class SocketTransport:
+    """Raw TCP connection to a serial-to-Ethernet bridge, eg ser2net, in place of a serial port.
+
+    Nagle's algorithm is disabled, so each write, and so each VMX send, goes out as soon as it
+    is made, in a single segment. If the connection drops, it is reopened on the next read or
+    write, up to reconnect_attempts times in a row. Anything in flight when it dropped is lost.
+    """
+
+    # Wait before the first reconnect attempt, doubled after each failed one, in seconds
+    RECONNECT_DELAY: float = 0.1
+    # Most bytes taken from the socket at once
+    CHUNK: int = 4096
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        connect_timeout: float = 5.0,
+        reconnect_attempts: int = 3,
+        nodelay: bool = True,
+    ) -> None:
+        """Initialize SocketTransport, connecting to the bridge.
+
+        Args:
+            host (str): host name or address of the bridge
+            port (int): TCP port of the bridge
+            connect_timeout (float): time to wait for a connection, and for a write, in seconds.
+                Defaults to 5.0.
+            reconnect_attempts (int): how many times to try reconnecting when the connection drops.
+                Defaults to 3.
+            nodelay (bool): Disable Nagle's algorithm. Defaults to True.
+
+        Raises:
+            VmxNotReadyError: Raised when the bridge cannot be connected to.
+        """
+        self.timeout: float | None = None
+        self.address = (host, port)
+        self.connect_timeout = connect_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.nodelay = nodelay
+        # Number of times the connection has been reopened
+        self.reconnects = 0
+        self._buffer = bytearray()
+        # Guards reconnecting, which both the reader thread and writers may do
+        self._lock = threading.Lock()
+        self._closed = False
+        # Written to by cancel_read to wake up a blocked read
+        self._wake_r, self._wake_w = socket.socketpair()
+        try:
+            self._socket = self._connect()
+        except OSError as e:
+            raise VmxNotReadyError(f"Could not connect to {host}:{port}: {e}") from e
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> Self:
+        """Initialize SocketTransport from a socket://host:port URL, as used by pyserial.
+
+        Args:
+            url (str): socket://host:port
+            **kwargs: passed on to SocketTransport
+
+        Returns:
+            SocketTransport: the connected transport
+
+        Raises:
+            ValueError: Raised when url is not a socket:// URL with a port.
+        """
+        parts = urlsplit(url)
+        if parts.scheme != "socket" or not parts.hostname or not parts.port:
+            raise ValueError(f"Expected socket://host:port, got {url}")
+        return cls(parts.hostname, parts.port, **kwargs)
+
+    @property
+    def in_waiting(self) -> int:
+        """Number of bytes waiting to be read."""
+        self._fill(0)
+        return len(self._buffer)
+
+    def fileno(self) -> int:
+        """File descriptor of the socket. Changes when the connection is reopened."""
+        return self._socket.fileno()
+
+    def read(self, size: int = 1) -> bytes:
+        """Read up to size bytes, waiting up to timeout for the first.
+
+        Args:
+            size (int): maximum number of bytes to read
+
+        Returns:
+            bytes: bytes read, empty if none arrived in time or the read was cancelled
+        """
+        if not self._buffer:
+            self._fill(self.timeout)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data: bytes) -> int:
+        """Write data in one go, reconnecting if the connection has dropped.
+
+        Args:
+            data (bytes): bytes to write
+
+        Returns:
+            int: number of bytes written
+        """
+        sock = self._socket
+        try:
+            sock.sendall(data)
+        except OSError as e:
+            self._reconnect(sock, e)
+            self._socket.sendall(data)
+        return len(data)
+
+    def cancel_read(self) -> None:
+        """Abort a blocking read."""
+        if not self._closed:
+            self._wake_w.send(b"\0")
+
+    def close(self) -> None:
+        """Close the connection, and the socket pair that wakes blocked reads."""
+        if self._closed:
+            return
+        self.cancel_read()
+        self._closed = True
+        self._socket.close()
+        self._wake_w.close()
+        self._wake_r.close()
+
+    def _connect(self) -> socket.socket:
+        """Private method opening the connection.
+
+        Returns:
+            socket.socket: connected socket
+        """
+        sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.debug(f"Connected to {self.address[0]}:{self.address[1]}")
+        return sock
+
+    def _reconnect(self, failed: socket.socket, error: Exception | str) -> None:
+        """Private method reopening a dropped connection.
+
+        Args:
+            failed (socket.socket): the socket that was found to have dropped.
+                If the connection has been reopened since, nothing is done.
+            error (Exception | str): what went wrong, for the log
+
+        Raises:
+            ConnectionError: Raised when every attempt fails, or the transport is closed.
+        """
+        with self._lock:
+            if self._socket is not failed:
+                return
+            if self._closed:
+                raise ConnectionError("Connection is closed.")
+            logger.warning(
+                f"Connection to {self.address[0]}:{self.address[1]} dropped ({error}), reconnecting."
+            )
+            failed.close()
+            self._buffer.clear()
+            delay = self.RECONNECT_DELAY
+            for attempt in range(1, self.reconnect_attempts + 1):
+                try:
+                    self._socket = self._connect()
+                except OSError as e:
+                    logger.warning(
+                        f"Reconnect {attempt} of {self.reconnect_attempts} failed: {e}"
+                    )
+                    time.sleep(delay)
+                    delay *= 2
+                else:
+                    self.reconnects += 1
+                    return
+            raise ConnectionError(
+                f"Could not reconnect to {self.address[0]}:{self.address[1]}."
+            )
+
+    def _fill(self, timeout: float | None) -> None:
+        """Private method reading what has arrived into the buffer.
+
+        Args:
+            timeout (float | None): time to wait for something to arrive, in seconds.
+                None waits until something does, or the read is cancelled.
+        """
+        sock = self._socket
+        try:
+            readable, _, _ = select.select([sock, self._wake_r], [], [], timeout)
+        except (OSError, ValueError):
+            # Closed under us, by close or another thread reconnecting
+            if self._closed:
+                return
+            readable = []
+        if self._wake_r in readable:
+            try:
+                self._wake_r.recv(self.CHUNK)
+            except OSError:
+                # Closed under us
+                pass
+            return
+        if sock not in readable:
+            return
+        try:
+            data = sock.recv(self.CHUNK)
+        except OSError as e:
+            self._reconnect(sock, e)
+            return
+        if not data:
+            if not self._closed:
+                self._reconnect(sock, "closed by the bridge")
+            return
+        self._buffer += data
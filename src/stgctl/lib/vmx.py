@@ -1,12 +1,13 @@
 """Class for VMX motor controller."""
 import functools
 import time
-from collections.abc import Callable
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable, Iterable
 from enum import IntEnum
 from pprint import pformat
 from typing import Any, Self, TypeVar
 
-import serial
 from loguru import logger
 from stgctl.core.settings import settings
 from stgctl.lib.exceptions import (
@@ -14,7 +15,14 @@ from stgctl.lib.exceptions import (
     UnsupportedVmxCommandError,
     VmxNotReadyError,
 )
-from stgctl.util.ports import grep_serial_ports
+from stgctl.lib.latency import COMPLETE, FIRST_BYTE, LatencyStats
+from stgctl.lib.motion import DurationStats, MotionModel
+from stgctl.lib.optimize import SPEED, AxisState, optimize
+from stgctl.lib.reader import Received, Reply, ReplyKind, ReplyReader
+from stgctl.lib.shadow import ShadowState
+from stgctl.lib.telemetry import PositionTelemetry
+from stgctl.lib.transport import RecordingTransport, open_port
+from stgctl.util.ports import find_serial_port
 
 
 class Motor(IntEnum):
@@ -59,14 +67,11 @@ class MandateImmediate:
             def wrapper(instance: Any, *args: Any, **kwargs: Any) -> T | None:
                 # Take the VMX instance and reset it
                 instance._reset()
-                # Reset serial buffer so we don't get any old VMX responses
-                instance._serial.reset_input_buffer()
                 # call the decorated method, which adds single command to queue
                 func(instance, *args, **kwargs)
-                # send command
-                instance.send()
-                # return readout
-                return instance._readall()
+                # send command and return readout
+                # (for the async driver, an awaitable of the readout)
+                return instance._transact()
 
             return wrapper
         else:
@@ -80,11 +85,8 @@ class MandateImmediate:
                 if now:
                     # see above wrapper comments.
                     instance._reset()
-                    instance._serial.reset_input_buffer()
                     func(instance, *args, **kwargs)
-                    instance.send()
-
-                    return instance._readall()
+                    return instance._transact()
                 else:
                     # if not now, just return the called method (ie self)
                     return func(instance, *args, **kwargs)
@@ -130,22 +132,54 @@ class Command:
 
 
 class SerialCommand(list):
-    """A custom list class specifically for storing Velmex program commands as strings."""
+    """A custom list class specifically for storing Velmex program commands as strings.
+
+    The encoded program is kept in a bytearray as commands are appended,
+    so encoding a long program does not re-join and re-encode every command.
+    Other changes to the list mark the encoding stale, and it is rebuilt on the next encode.
+    """
 
-    def ___init__(self, iterable: list[str] = []):
+    def __init__(self, iterable: Iterable[Any] = ()):
         """Initializes an instance of the SerialCommand class.
 
         Args:
-            iterable (list[str], optional): A list of command strings to initialize the SerialCommand with. Defaults to an empty list.
+            iterable (Iterable[Any], optional): Commands to initialize the SerialCommand with, converted to strings. Defaults to empty.
         """
         # Call the parent list's init function to populate it with the provided iterable,
         # converting each item into a string
         super().__init__(str(item) for item in iterable)
+        self._encoded = bytearray()
+        # Whether _encoded needs rebuilding from the list
+        self._stale = bool(self)
+
+    def __reduce__(self):
+        """Copy and pickle as the list of commands, leaving the encoding to be rebuilt."""
+        return type(self), (list(self),)
 
     def __setitem__(self, index, item):
         """Overloaded method to set an item at a specific position in the list, ensuring that the item is converted to a string."""
         # Convert the item to string and then call the parent list's setitem function
-        super().__setitem__(index, str(item))
+        if isinstance(index, slice):
+            super().__setitem__(index, [str(i) for i in item])
+        else:
+            super().__setitem__(index, str(item))
+        self._stale = True
+
+    def __delitem__(self, index):
+        """Overloaded method to delete items, marking the encoding stale."""
+        super().__delitem__(index)
+        self._stale = True
+
+    def __iadd__(self, other):
+        """Overloaded method so += converts items like extend."""
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        """Overloaded method to repeat the list in place, marking the encoding stale."""
+        super().__imul__(n)
+        self._stale = True
+        return self
 
     def __repr__(self) -> str:
         """Overrides the default representation of the SerialCommand list to be a comma-separated string of its items.
@@ -160,20 +194,61 @@ class SerialCommand(list):
         """Overloaded method to insert an item at a specific position in the list, ensuring that the item is converted to a string."""
         # Convert the item to string and then call the parent list's insert function
         super().insert(index, str(item))
+        self._stale = True
 
     def append(self, item):
         """Overloaded method to append an item to the end of the list, ensuring that the item is converted to a string."""
         # Convert the item to string and then call the parent list's append function
-        super().append(str(item))
+        item = str(item)
+        if not self._stale:
+            if self:
+                self._encoded += b","
+            self._encoded += item.encode()
+        super().append(item)
 
     def extend(self, other):
         """Overloaded method to extend the list with items from another list or iterable, ensuring that each new item is converted to a string."""
         # Check if the other object is of the same type (SerialCommand)
         if isinstance(other, type(self)):
+            if not self._stale and not other._stale:
+                # Copied first, as other may be this list
+                encoded = bytes(other._encoded)
+                if self and other:
+                    self._encoded += b","
+                self._encoded += encoded
+            else:
+                self._stale = True
             super().extend(other)
         else:
             # If other object is not of the same type, convert each item to string before extending the list
-            super().extend(str(item) for item in other)
+            for item in other:
+                self.append(item)
+
+    def pop(self, index=-1):
+        """Overloaded method to pop an item, marking the encoding stale."""
+        self._stale = True
+        return super().pop(index)
+
+    def remove(self, value):
+        """Overloaded method to remove an item, marking the encoding stale."""
+        super().remove(value)
+        self._stale = True
+
+    def clear(self):
+        """Overloaded method to empty the list, and its encoding."""
+        super().clear()
+        self._encoded.clear()
+        self._stale = False
+
+    def reverse(self):
+        """Overloaded method to reverse the list, marking the encoding stale."""
+        super().reverse()
+        self._stale = True
+
+    def sort(self, *args, **kwargs):
+        """Overloaded method to sort the list, marking the encoding stale."""
+        super().sort(*args, **kwargs)
+        self._stale = True
 
     def encode(self):
         """Encodes the comma-separated string representation of the list into bytes.
@@ -181,9 +256,11 @@ class SerialCommand(list):
         Returns:
             bytes: The byte-encoded string representation of the SerialCommand list.
         """
-        # Join all items in the list into a single string, separated by commas, and then encode it into bytes
-        joined = ",".join(self)
-        return joined.encode()
+        if self._stale:
+            # Join all items in the list into a single string, separated by commas, and then encode it into bytes
+            self._encoded = bytearray(",".join(self).encode())
+            self._stale = False
+        return bytes(self._encoded)
 
     @property
     def encoded(self):
@@ -195,9 +272,24 @@ class SerialCommand(list):
         # Use the encode method to get the byte-encoded string representation of the list
         return self.encode()
 
+    @property
+    def size(self) -> int:
+        """Length of the encoded program in bytes, without encoding it.
+
+        Returns:
+            int: encoded length
+        """
+        if self._stale:
+            self.encode()
+        return len(self._encoded)
 
-class VMX:
-    """Class for VMX motor controller."""
+
+class BaseVMX(ABC):
+    """Protocol core for the VMX motor controller.
+
+    Builds command programs and knows the shape of every reply, but does no I/O itself.
+    The sync VMX and AsyncVMX drivers subclass it and provide the reads and writes.
+    """
 
     # ImMx
     # x pos or neg
@@ -214,10 +306,19 @@ class VMX:
     IDX_NEG_LIMIT: str = "I{m}M-0"
     # SmMx
     SET_SPEED: str = "S{m}M{x}"
+    # AmMx
+    # x from 1 to 127, in units of 2000 idx/s^2
+    SET_ACCEL: str = "A{m}M{x}"
     # Px
     # x in tenths of a second
     # -x tenths of a millisecond
     SET_PAUSE: str = "P{x}"
+    # (cmd,cmd,)
+    # Index commands within parentheses run on their motors at the same time
+    SIMULTANEOUS: str = "({cmds},)"
+    # U6
+    # Send W to the host and wait for G before continuing the program
+    USER_WAIT: str = "U6"
 
     # Operation commands
     OP_CMDS: tuple[str, ...] = (
@@ -233,6 +334,7 @@ class VMX:
         "res",
         "!",
         "J",
+        "G",
     )
 
     # Status request commands
@@ -241,148 +343,206 @@ class VMX:
 
     PROG_COMPLETE: str = "^"
 
-    def __init__(self, port=None) -> None:
-        """Initialize a VMX instance.
+    # The VMX holds up to 5 programs (0-4) of 256 bytes each
+    PROGRAM_SLOTS: int = 5
+    PROGRAM_BYTES: int = 256
+    # PMn
+    # Select program n; following commands are stored in it and R runs it
+    SELECT_PROG: str = "PM{n}"
+    # PM-n
+    # Select program n and clear it
+    CLEAR_PROG: str = "PM-{n}"
+    # JMn
+    # Jump to the start of program n, used to chain programs
+    JUMP_PROG: str = "JM{n}"
+    # LM0
+    # Mark the start of a loop
+    LOOP_START: str = "LM0"
+    # Lx
+    # Loop back to the last loop marker, so the block between runs x times in total
+    LOOP_END: str = "L{x}"
+
+    # Startup: how often to poll for ready after a reset, how long to wait for it,
+    # and how many resets to try before giving up
+    READY_POLL: float = 0.05
+    RESET_TIMEOUT: float = 5.0
+    RESET_ATTEMPTS: int = 3
+    # Time to wait for programs the motion model cannot predict, in seconds
+    UNPREDICTED_TIMEOUT: float = 600.0
+
+    # Reply shape and deadline, in seconds, for commands that answer the host.
+    # Anything not listed here sends nothing back.
+    REPLIES: dict[str, tuple[Reply, float]] = {
+        "V": (Reply.STATE, 0.5),
+        "X": (Reply.INTEGER, 0.5),
+        "Y": (Reply.INTEGER, 0.5),
+        "M": (Reply.INTEGER, 0.5),
+        # At most FIFO_DEPTH recorded positions, a few tens of ms at 9600 baud.
+        # Nothing comes back if nothing was recorded, so these wait out their whole deadline
+        "x": (Reply.TEXT, 0.1),
+        "y": (Reply.TEXT, 0.1),
+        "lst": (Reply.TEXT, 1.0),
+    }
+
+    def __init__(self) -> None:
+        """Initialize the command queue and the host's view of the VMX."""
+        self._cmd = SerialCommand()
+        # Whether the VMX echoes commands back
+        self._echoing = False
+        # Programs started (with R) whose completion has not been waited for
+        self._outstanding = 0
+        # Speeds set by programs that have been run, which persist on the VMX
+        self._axes = AxisState()
+        # Seconds from starting startup to the VMX reporting ready
+        self.startup_time: float | None = None
+        # Samples positions while waiting for programs to complete, if set
+        self.telemetry: PositionTelemetry | None = None
+        # Round trip latencies, by command
+        self.latency = LatencyStats()
+        # Name and time.monotonic() of the last send, and times and predicted durations
+        # of runs not yet complete
+        self._sent: tuple[str, float] = ("", 0.0)
+        self._runs: deque[tuple[float, float | None]] = deque()
+        # Everything known of the VMX, from the commands sent and replies read.
+        # The travel is unknown until XYStage measures it between the limit switches
+        self.shadow = ShadowState(MotionModel())
+        # Predicted against actual program durations
+        self.durations = DurationStats()
+        # Time programs not yet complete were held at a user wait by the host,
+        # and when the current hold began
+        self._held = 0.0
+        self._held_since: float | None = None
+
+    @staticmethod
+    def _find_port(port: str | None = None) -> str:
+        """Private method for finding the port the VMX is connected to.
 
         Args:
-            port (str, optional): The port on which the motor controller is connected. If not provided, the port will be determined automatically.
+            port (str | None): Port to use. If not provided, the port will be determined automatically.
+
+        Returns:
+            str: port to open
 
         Raises:
-            VmxNotReadyError: Returns error if VMX does not send ready response
+            VmxNotReadyError: Returns error if no port is given and none can be found
         """
-        logger.debug(f"Using settings:\n{pformat(settings.dict())}")
         if not port:
-            # grep for serial ports using regex provided in settings
-            matched_serial_ports = grep_serial_ports(settings.VMX_DEVICE_REGEX)
-            logger.debug(f"Matched serial ports: {matched_serial_ports}")
-            if settings.VMX_DEVICE_PORT:
-                # if the port is explicitly given, use it
-                port = settings.VMX_DEVICE_PORT
-            elif matched_serial_ports:
-                # Take first port if multiple are matched.
-                port = matched_serial_ports[0].device
-                logger.success(
-                    f"Found serial device matching regex {settings.VMX_DEVICE_REGEX}: {matched_serial_ports[0].name}"
-                )
-                if len(matched_serial_ports) > 1:
-                    logger.warning(
-                        "Multiple serial ports matched, selecting first one.",
-                        stacklevel=2,
-                    )
-            else:
+            # if the port is explicitly given, use it
+            port = settings.VMX_DEVICE_PORT or find_serial_port(
+                settings.VMX_DEVICE_REGEX,
+                serial_number=settings.VMX_DEVICE_SERIAL,
+                cache=settings.PORT_CACHE,
+            )
+            if not port:
                 raise VmxNotReadyError(
                     "Could not find serial port. Please specify the port."
                 )
-        logger.debug(f"Using serial port '{port}'")
-        self._serial = serial.Serial(port, timeout=0)
-        self._cmd = SerialCommand()
-        # start startup sequence.
-        self.startup()
-
-    def __enter__(self) -> Self:
-        return self
-
-    def __exit__(self) -> None:
-        self.close()
-
-    def __del__(self) -> None:
-        self.close()
-
-    def startup(self) -> None:
-        """Initialize VMX.
-
-        Puts the motor controller in jog mode, resets it to the power on state,
-        and waits for "R" response.
-
-
-        Raises:
-            VmxNotReadyError: Returns error if VMX does not send ready response
-        """
-        # If VMX receives reset command while in on-line (E or F) mode,
-        # it will error out (eg respond to V status request with B)
-        # Put into jogging mode first.
-        self.jog()
-        # Reset, returns to powered-on state
-        self.reset()
-        # Give it time to restart
-        time.sleep(1)
-        # Set state to online with echo on
-        self.echo(echo_state=True)
-        wait_time = 0.1
-        timeout = 5
-        # After activating online state, may delay returning ready state
-        start_time = time.time()
-        while not self.isready():
-            time.sleep(wait_time)
-            if abs(start_time - time.time()) > timeout:
-                raise VmxNotReadyError("Connecting to the VMX has timed out.")
-
-    def close(self) -> None:
-        """Close VMX by closing out serial connection."""
-        # Account for case where object is closed before serial port is initialized
-        # eg when port finding fails
-        if hasattr(self, "_serial"):
-            logger.debug("Closing serial connection to VMX.")
-            self._serial.close()
+        return port
 
+    @abstractmethod
     def _write(self, cmd: SerialCommand) -> None:
-        """Private method for writing commands to VMX.
+        """Private method for writing commands to VMX. Provided by drivers.
 
         Args:
             cmd (SerialCommand): Serial command to send to VMX
         """
-        logger.debug(f"Writing command: {cmd}")
-        self._serial.write(cmd.encode())
 
-    def _readall(self) -> bytes:
-        """Private readall method for reading out entire serial buffer.
+    @abstractmethod
+    def _transact(self) -> Any:
+        """Private method for sending the queued command and reading its reply. Provided by drivers."""
 
-        Returns all bytes from serial buffer
+    def _expected_reply(self) -> tuple[Reply, float]:
+        """Private method for looking up the reply to the currently queued command.
 
         Returns:
-            bytes: Returned bytes from serial buffer.
+            tuple[Reply, float]: reply shape and deadline in seconds
         """
-        # Since most commands using read write first, need to always wait for response
-        time.sleep(0.1)
-        readout = self._serial.readall()
-        logger.debug(f"Serial readall: {readout}")
-        return readout
-
-    def _read(self) -> bytes:
-        """Private method wrapping reading last entry in serial buffer.
-
-        Returns:
-            bytes: Returned bytes from serial buffer
-        """
-        readout = self._serial.read()
-        return readout
+        if not self._cmd:
+            return Reply.NONE, 0.0
+        return BaseVMX.REPLIES.get(self._cmd[0], (Reply.NONE, 0.0))
 
     def _reset(self) -> None:
         """Private method for resetting command que."""
         self._cmd = SerialCommand()
 
-    def wait_for_complete(self, timeout: float = 60.0) -> None:
-        """Wait until VMX program returns program-complete response.
+    def _save_latency(self) -> None:
+        """Private method merging the latency histograms into settings.LATENCY_FILE, if set."""
+        if not settings.LATENCY_FILE or not getattr(self, "latency", None):
+            return
+        if not self.latency.histograms:
+            return
+        try:
+            self.latency.save(settings.LATENCY_FILE)
+        except OSError as e:
+            logger.warning(f"Could not save latency histograms: {e}")
+        # Saved once, so a second close does not count them again
+        self.latency = LatencyStats()
+
+    def _record_reply(self, received: Received) -> None:
+        """Private method recording the latency of a reply to the last send.
 
-        Typically used in try-except-finally block.
+        Args:
+            received (Received): the reply
+        """
+        command, sent = self._sent
+        self.latency.record(command, FIRST_BYTE, received.start - sent)
+        self.latency.record(command, COMPLETE, received.end - sent)
+
+    def _record_complete(self, received: Received) -> None:
+        """Private method recording the latency of a program, from its run to its ^.
 
         Args:
-            timeout (float): Time to wait until program considered a failure. Defaults to 60.0.
+            received (Received): the ^
+        """
+        if not self._runs:
+            return
+        sent, predicted = self._runs.popleft()
+        self.latency.record("run", COMPLETE, received.end - sent)
+        if predicted is not None:
+            actual = received.end - sent - self._held
+            self.durations.record(predicted, actual)
+            logger.debug(
+                "Program took {:.3f} s, predicted {:.3f} s.", actual, predicted
+            )
+        self._held = 0.0
 
-        Raises:
-            TimeoutError: Raised when program takes longer than timeout.
+    def _complete_within(self, timeout: float | None) -> float:
+        """Private method for how long to wait for the programs not yet complete.
+
+        Args:
+            timeout (float | None): time to wait, in seconds, or None to go by the motion model
+
+        Returns:
+            float: time to wait, in seconds. With the motion model, the programs' predicted
+            durations from the first one's run, scaled by settings.TIMEOUT_SCALE, plus any time
+            they were held at user waits and settings.TIMEOUT_MARGIN.
         """
-        start = time.time()
-        # We want to clear anything int he buffer so we do not
-        # accidentally pick up old program complete responses
-        self._serial.reset_input_buffer()
-        while abs(time.time() - start) < timeout:
-            data = self._serial.read(1)
-            # VMX returns ^ when program completes
-            if data.decode() == "^":
-                return
-        msg = "Waiting for program to complete timed out."
-        raise TimeoutError(msg)
+        if timeout is not None:
+            return timeout
+        predicted = [p for _, p in self._runs]
+        if not predicted or None in predicted:
+            return BaseVMX.UNPREDICTED_TIMEOUT
+        deadline = (
+            self._runs[0][0]
+            + self._held
+            + settings.TIMEOUT_SCALE * sum(predicted)
+            + settings.TIMEOUT_MARGIN
+        )
+        return max(deadline - time.monotonic(), settings.TIMEOUT_MARGIN)
+
+    def _log_durations(self) -> None:
+        """Private method logging how long programs took against their predicted durations."""
+        if not getattr(self, "durations", None):
+            return
+        summary = self.durations.summary()
+        if summary:
+            logger.info(
+                f"{summary['count']} programs took {summary['actual']:.1f} s, "
+                f"predicted {summary['predicted']:.1f} s "
+                f"(median difference {1e3 * summary['median_error']:+.0f} ms, "
+                f"largest {1e3 * summary['max_error']:+.0f} ms)."
+            )
+        self.durations = DurationStats()
 
     def send(self) -> None:
         """Send current command string to VMX serial port.
@@ -391,10 +551,73 @@ class VMX:
         The VMX chains calls itself unless cleared.
         Programs won't run until R is sent.
         """
+        if settings.OPTIMIZE_PROGRAMS:
+            self._optimize()
+        self._sent = (LatencyStats.command_name(self._cmd), time.monotonic())
+        self.shadow.update(self._cmd)
+        if "R" in self._cmd:
+            self._outstanding += 1
+            self._runs.append((self._sent[1], self.shadow.predicted))
+        if "G" in self._cmd and self._held_since is not None:
+            self._held += self._sent[1] - self._held_since
+            self._held_since = None
         self._write(self._cmd)
         # clear command que
         self._reset()
 
+    def _local_reply(self) -> bytes | None:
+        """Private method answering the queued status request from the shadow state, if it can.
+
+        V is answered R if the VMX answered R within settings.SHADOW_TTL, and X and Y with the
+        last commanded position, as long as no program is running. Anything else is left to the VMX.
+
+        Returns:
+            bytes | None: reply the VMX would give, or None if it has to be asked
+        """
+        if not settings.SHADOW_TTL or self._outstanding or len(self._cmd) != 1:
+            return None
+        match self._cmd[0]:
+            case "V":
+                if self.shadow.is_ready(time.monotonic(), settings.SHADOW_TTL):
+                    return b"R"
+            case "X" | "Y" as axis:
+                position = self.shadow.position(Motor[axis])
+                if position is not None:
+                    return b"%+08d\r" % position
+        return None
+
+    def _observe(self, cmd: list[str], reply: bytes) -> None:
+        """Private method updating the shadow state from the VMX's reply to a status request.
+
+        Args:
+            cmd (list[str]): commands sent
+            reply (bytes): VMX reply
+        """
+        if len(cmd) == 1:
+            self.shadow.observe(cmd[0], reply, time.monotonic())
+
+    def _optimize(self) -> None:
+        """Private method dropping commands from the queue that would not change anything on the VMX.
+
+        Speeds persist on the VMX, so a program that is cleared and run in one send is
+        optimized against the speeds set by earlier such programs. Anything else is optimized
+        on its own, since it is appended to, or runs, a program the host has not tracked.
+        """
+        if "C" in self._cmd and "R" in self._cmd:
+            self._axes.positions.clear()
+            optimized = optimize(self._cmd, self._axes)
+        else:
+            optimized = optimize(self._cmd)
+            # A speed set here, a reset, or a stopped program means the tracked speeds
+            # can no longer be trusted
+            if set(self._cmd) & {"res", "K", "D"} or any(
+                SPEED.match(cmd) for cmd in self._cmd
+            ):
+                self._axes.forget()
+        if len(optimized) < len(self._cmd):
+            logger.debug("Optimized {} to {}", self._cmd, ",".join(optimized))
+        self._cmd = SerialCommand(optimized)
+
     # Start of op commands
 
     @Command("OP_CMDS")
@@ -479,6 +702,7 @@ class VMX:
         Returns:
             bytes: The current echo mode setting if echo_state is not given, or an acknowledgement of setting echo mode if it is.
         """  # noqa: DAR202
+        self._echoing = echo_state
         if echo_state:
             self.op_cmd("F")
         else:
@@ -517,6 +741,15 @@ class VMX:
         """
         self.op_cmd("D")
 
+    @MandateImmediate()
+    def go(self) -> bytes:
+        """Continue a program waiting at `user_wait`.
+
+        Returns:
+            bytes: VMX response
+        """
+        self.op_cmd("G")
+
     @MandateImmediate()
     def record_posn(self) -> bytes:
         """Records the current positions into the FIFO buffer.
@@ -551,19 +784,6 @@ class VMX:
         """
         self.status_cmd("V")
 
-    def isready(self) -> bool:
-        """Checks for VMX ready response.
-
-        Returns:
-            bool: If the VMX returns R, returns True.
-        """
-        # query state of VMX
-        state = self.verify()
-        logger.debug(f"isready state is {state!r}")
-        if state == b"R":
-            return True
-        return False
-
     @MandateImmediate()
     def posn(self, axis: Motor = Motor.X, recorded=False) -> bytes:
         """Queries motor position for a particular axis.
@@ -591,6 +811,89 @@ class VMX:
         """
         self.status_cmd("lst")
 
+    @MandateImmediate()
+    def memory(self) -> bytes:
+        """Query program memory available, in bytes, in the current program.
+
+        Returns:
+            bytes: bytes available, as a signed integer terminated by a carriage return
+        """
+        self.status_cmd("M")
+
+    # Start of program slot commands
+
+    @MandateImmediate(False)
+    def program(self, n: int = 0, clear: bool = False) -> Self:
+        """Select program slot n.
+
+        Commands sent afterwards are stored in the selected program, and R runs it.
+
+        Supports running with `now`.
+
+        Args:
+            n (int): Program slot, 0 to 4. Defaults to 0.
+            clear (bool): Whether to also clear the program. Defaults to False.
+
+        Raises:
+            InvalidVMXCommandError: Raised when n is not a valid slot.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        if n not in range(BaseVMX.PROGRAM_SLOTS):
+            raise InvalidVMXCommandError(f"There is no program slot {n}.")
+        template = BaseVMX.CLEAR_PROG if clear else BaseVMX.SELECT_PROG
+        self._cmd.append(template.format(n=n))
+        return self
+
+    @MandateImmediate(False)
+    def jump(self, n: int = 0) -> Self:
+        """Jump to the start of program n.
+
+        Placed at the end of a program to chain it to the next one.
+
+        Args:
+            n (int): Program slot, 0 to 4. Defaults to 0.
+
+        Raises:
+            InvalidVMXCommandError: Raised when n is not a valid slot.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        if n not in range(BaseVMX.PROGRAM_SLOTS):
+            raise InvalidVMXCommandError(f"There is no program slot {n}.")
+        self._cmd.append(BaseVMX.JUMP_PROG.format(n=n))
+        return self
+
+    @MandateImmediate(False)
+    def mark_loop(self) -> Self:
+        """Mark the start of a loop, closed by `loop`.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        self._cmd.append(BaseVMX.LOOP_START)
+        return self
+
+    @MandateImmediate(False)
+    def loop(self, times: int) -> Self:
+        """Loop back to the last `mark_loop`, so the commands in between run `times` times in total.
+
+        Args:
+            times (int): number of times the loop body runs
+
+        Raises:
+            InvalidVMXCommandError: Raised when times is less than 1.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        if times < 1:
+            raise InvalidVMXCommandError("A loop must run at least once.")
+        self._cmd.append(BaseVMX.LOOP_END.format(x=times))
+        return self
+
     # Start of motor commands
 
     @MandateImmediate(False)
@@ -608,12 +911,68 @@ class VMX:
             Self: VMX instance with appended commands.
         """
         if relative:
-            self._cmd.append(VMX.IDX_INCR.format(m=motor, x=idx))
+            self._cmd.append(BaseVMX.IDX_INCR.format(m=motor, x=idx))
         else:
-            self._cmd.append(VMX.IDX_ABS.format(m=motor, x=idx))
+            self._cmd.append(BaseVMX.IDX_ABS.format(m=motor, x=idx))
+
+        return self
+
+    @MandateImmediate(False)
+    def move_many(self, moves: dict[Motor, int], relative: bool = True) -> Self:
+        """Index several motors at the same time.
+
+        The VMX runs the moves together, so the program takes as long as the longest move
+        rather than the sum of them. A single motor is sent as a plain move.
+
+        Supports running with `now`.
+
+        Args:
+            moves (dict[Motor, int]): where to index each motor, in steps
+            relative (bool): Whether positions are relative to current positions. Defaults to True.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        template = BaseVMX.IDX_INCR if relative else BaseVMX.IDX_ABS
+        self._simultaneous([template.format(m=m, x=x) for m, x in moves.items()])
+        return self
+
+    @MandateImmediate(False)
+    def to_limits(self, limits: dict[Motor, bool]) -> Self:
+        """Index several motors to a limit switch at the same time.
+
+        Supports running with `now`.
+
+        Args:
+            limits (dict[Motor, bool]): for each motor, whether to index to the positive limit switch
 
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        self._simultaneous(
+            [
+                (BaseVMX.IDX_POS_LIMIT if pos else BaseVMX.IDX_NEG_LIMIT).format(m=m)
+                for m, pos in limits.items()
+            ]
+        )
         return self
 
+    def _simultaneous(self, cmds: list[str]) -> None:
+        """Private method appending index commands to run at the same time.
+
+        Args:
+            cmds (list[str]): index commands, at most one per motor
+
+        Raises:
+            InvalidVMXCommandError: Raised when there are no commands.
+        """
+        if not cmds:
+            raise InvalidVMXCommandError("No motors given to index.")
+        if len(cmds) == 1:
+            self._cmd.append(cmds[0])
+        else:
+            self._cmd.append(BaseVMX.SIMULTANEOUS.format(cmds=",".join(cmds)))
+
     @MandateImmediate(False)
     def to_limit(self, motor: Motor = Motor.X, pos: bool = True) -> Self:
         """Index until reaching a limit switch.
@@ -630,9 +989,9 @@ class VMX:
             Self: VMX instance with appended commands.
         """
         if pos:
-            self._cmd.append(VMX.IDX_POS_LIMIT.format(m=motor))
+            self._cmd.append(BaseVMX.IDX_POS_LIMIT.format(m=motor))
         else:
-            self._cmd.append(VMX.IDX_NEG_LIMIT.format(m=motor))
+            self._cmd.append(BaseVMX.IDX_NEG_LIMIT.format(m=motor))
         return self
 
     @MandateImmediate(False)
@@ -649,7 +1008,7 @@ class VMX:
         Returns:
             Self: VMX instance with appended commands.
         """
-        self._cmd.append(VMX.IDX_ABS_ZERO.format(m=motor))
+        self._cmd.append(BaseVMX.IDX_ABS_ZERO.format(m=motor))
         return self
 
     @MandateImmediate(False)
@@ -666,7 +1025,7 @@ class VMX:
         Returns:
             Self: VMX wirh appended command.
         """
-        self._cmd.append(VMX.SET_ABS_ZERO.format(m=motor))
+        self._cmd.append(BaseVMX.SET_ABS_ZERO.format(m=motor))
         return self
 
     @MandateImmediate(False)
@@ -684,7 +1043,35 @@ class VMX:
         Returns:
             Self: VMX with appended commands.
         """
-        self._cmd.append(VMX.SET_SPEED.format(m=motor, x=speed))
+        self._cmd.append(BaseVMX.SET_SPEED.format(m=motor, x=speed))
+        return self
+
+    @MandateImmediate(False)
+    def accel(self, accel: int, motor: Motor = Motor.X) -> Self:
+        """Set acceleration for motor, in units of 2000 idx/sec^2.
+
+        This setting is saved across programs if not explicitly set.
+
+        Supports running with `now`.
+
+        Args:
+            accel (int): acceleration setting, from 1 to 127
+            motor (Motor): Motor to set acceleration for. Defaults to Motor.X.
+
+        Returns:
+            Self: VMX with appended commands.
+        """
+        self._cmd.append(BaseVMX.SET_ACCEL.format(m=motor, x=accel))
+        return self
+
+    @MandateImmediate(False)
+    def user_wait(self) -> Self:
+        """Make the program send W to the host and wait for `go` before continuing.
+
+        Returns:
+            Self: VMX instance with appended commands.
+        """
+        self._cmd.append(BaseVMX.USER_WAIT)
         return self
 
     @MandateImmediate(False)
@@ -698,7 +1085,7 @@ class VMX:
             Self: VMX instance with appended commands.
         """
         time = round(time, 2) * 10
-        self._cmd.append(VMX.SET_PAUSE.format(x=time))
+        self._cmd.append(BaseVMX.SET_PAUSE.format(x=time))
         return self
 
     @property
@@ -725,3 +1112,254 @@ class VMX:
                 "Value assigned to command_que must be of type SerialCommand."
             )
         self._cmd = value
+
+
+class VMX(BaseVMX):
+    """Class for VMX motor controller."""
+
+    def __init__(self, port=None, transport=None) -> None:
+        """Initialize a VMX instance.
+
+        Args:
+            port (str, optional): The port on which the motor controller is connected, or socket://host:port for a serial-to-Ethernet bridge. If not provided, the port will be determined automatically.
+            transport (optional): Stands in for the serial port, eg a ReplayTransport. If provided, port is ignored.
+                If not, and settings.CAPTURE is set, traffic on the serial port is recorded there.
+
+        Raises:
+            VmxNotReadyError: Returns error if VMX does not send ready response
+        """
+        logger.opt(lazy=True).debug(
+            "Using settings:\n{}", lambda: pformat(settings.dict())
+        )
+        if transport is None:
+            port = self._find_port(port)
+            logger.debug(f"Using serial port '{port}'")
+            transport = open_port(
+                port,
+                connect_timeout=settings.CONNECT_TIMEOUT,
+                reconnect_attempts=settings.RECONNECT_ATTEMPTS,
+            )
+            if settings.CAPTURE:
+                transport = RecordingTransport(transport, settings.CAPTURE)
+        super().__init__()
+        self._serial = transport
+        if settings.TELEMETRY_INTERVAL:
+            self.telemetry = PositionTelemetry(interval=settings.TELEMETRY_INTERVAL)
+        # From here on, only the reader thread reads from the port
+        self._reader = ReplyReader(self._serial)
+        self._reader.start()
+        # start startup sequence.
+        self.startup()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    def startup(self) -> None:
+        """Initialize VMX.
+
+        Probes the motor controller first: if it is already ready once put on-line with echo on,
+        as when left by an earlier session, there is nothing more to do.
+        Otherwise, it is put in jog mode, reset to the power on state, and polled for "R",
+        retrying the reset a bounded number of times.
+
+        Raises:
+            VmxNotReadyError: Returns error if VMX does not send ready response
+        """
+        start_time = time.monotonic()
+        # Setting echo is harmless if already set, and puts the VMX on-line
+        self.echo(echo_state=True)
+        state = self.verify()
+        if state != b"R":
+            logger.info(f"VMX reports {state!r} rather than ready, resetting it.")
+            self._recover()
+        self.startup_time = time.monotonic() - start_time
+        logger.info(f"VMX ready {1e3 * self.startup_time:.0f} ms after connecting.")
+
+    def _recover(self) -> None:
+        """Private method resetting the VMX until it reports ready.
+
+        Raises:
+            VmxNotReadyError: Raised when the VMX is not ready after RESET_ATTEMPTS resets.
+        """
+        for attempt in range(1, BaseVMX.RESET_ATTEMPTS + 1):
+            # If VMX receives reset command while in on-line (E or F) mode,
+            # it will error out (eg respond to V status request with B)
+            # Put into jogging mode first.
+            self.jog()
+            # Reset, returns to powered-on state
+            self.reset()
+            # Set state to online with echo on as soon as the VMX answers again
+            deadline = time.monotonic() + BaseVMX.RESET_TIMEOUT
+            while time.monotonic() < deadline:
+                self.echo(echo_state=True)
+                state = self.verify()
+                if state == b"R":
+                    return
+                time.sleep(BaseVMX.READY_POLL)
+            logger.warning(
+                f"VMX reports {state!r} after reset {attempt} of {BaseVMX.RESET_ATTEMPTS}."
+            )
+        raise VmxNotReadyError("Connecting to the VMX has timed out.")
+
+    def close(self) -> None:
+        """Close VMX by closing out serial connection."""
+        # Account for case where object is closed before serial port is initialized
+        # eg when port finding fails
+        if hasattr(self, "_reader"):
+            self._reader.stop()
+        self._save_latency()
+        self._log_durations()
+        if hasattr(self, "_serial"):
+            logger.debug("Closing serial connection to VMX.")
+            self._serial.close()
+
+    def _write(self, cmd: SerialCommand) -> None:
+        """Private method for writing commands to VMX.
+
+        Args:
+            cmd (SerialCommand): Serial command to send to VMX
+        """
+        logger.debug("Writing command: {}", cmd)
+        data = cmd.encode()
+        if self._echoing:
+            self._reader.expect_echo(data)
+        self._serial.write(data)
+
+    def _transact(self) -> bytes:
+        """Private method for sending the queued command and reading its reply.
+
+        Returns:
+            bytes: VMX reply
+        """
+        local = self._local_reply()
+        if local is not None:
+            logger.debug("Answered {} from shadow state: {}", self._cmd, local)
+            self._reset()
+            return local
+        # look up reply shape and command before send clears the queue
+        reply = self._expected_reply()
+        cmd = list(self._cmd)
+        # Tell the reader what to look for before the VMX can answer
+        self._reader.expect(reply[0])
+        self.send()
+        readout = self._read_reply(*reply)
+        self._observe(cmd, readout)
+        return readout
+
+    def _read_reply(self, reply: Reply, timeout: float) -> bytes:
+        """Private method for waiting on a single framed reply from the reader thread.
+
+        Returns as soon as a complete reply of the given shape has arrived.
+
+        Args:
+            reply (Reply): shape of the expected reply
+            timeout (float): time, in seconds, to wait for a complete reply
+
+        Returns:
+            bytes: VMX reply. May be partial if the deadline passed.
+        """
+        if reply is Reply.NONE:
+            return b""
+        try:
+            received = self._reader.get(ReplyKind.STATUS, timeout)
+            self._record_reply(received)
+            readout = received.data
+        except TimeoutError:
+            logger.warning(f"Timed out waiting for {reply.name} reply.")
+            readout = self._reader.cancel()
+        logger.debug("Serial read: {}", readout)
+        return readout
+
+    def wait_for_complete(self, timeout: float | None = 60.0) -> None:
+        """Wait until VMX program returns program-complete response.
+
+        Typically used in try-except-finally block.
+
+        Args:
+            timeout (float | None): Time to wait until program considered a failure. Defaults to 60.0.
+                None waits as long as the motion model predicts, plus a margin, so a stall is noticed
+                within seconds; programs it cannot predict get UNPREDICTED_TIMEOUT.
+
+        Raises:
+            TimeoutError: Raised when program takes longer than timeout.
+        """
+        deadline = time.monotonic() + self._complete_within(timeout)
+        # The reader thread queues every ^ as it arrives, so none are lost and none need flushing.
+        # Completions of earlier programs that were never waited for (eg speed settings)
+        # are consumed here, so only the most recent program's ^ ends the wait.
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                received = self._reader.get(
+                    ReplyKind.COMPLETE, self._sample_within(remaining)
+                )
+            except TimeoutError:
+                if self.telemetry is not None:
+                    # Recording is allowed mid-program, unlike status requests
+                    self.record_posn()
+                    self.telemetry.stamp(time.monotonic())
+                continue
+            self._record_complete(received)
+            self._outstanding = max(0, self._outstanding - 1)
+            if not self._outstanding:
+                self._runs.clear()
+                # Reading back an empty FIFO would only wait out the deadline
+                if self.telemetry is not None and self.telemetry.pending:
+                    self.telemetry.collect(
+                        self.posn(axis=Motor.X, recorded=True),
+                        self.posn(axis=Motor.Y, recorded=True),
+                    )
+                return
+        # The program may still be running, or the VMX may have stopped answering
+        self.shadow.forget()
+        msg = "Waiting for program to complete timed out."
+        raise TimeoutError(msg)
+
+    def wait_for_user(self, timeout: float = 60.0) -> None:
+        """Wait until a running program reaches `user_wait` and sends W.
+
+        Args:
+            timeout (float): Time to wait, in seconds. Defaults to 60.0.
+
+        Raises:
+            TimeoutError: Raised when no W arrives within timeout.
+        """
+        try:
+            self._held_since = self._reader.get(ReplyKind.USER_WAIT, timeout).end
+        except TimeoutError:
+            msg = "Waiting for program to reach a user wait timed out."
+            raise TimeoutError(msg) from None
+
+    def _sample_within(self, remaining: float) -> float:
+        """Private method for how long to wait for a completion before recording positions.
+
+        Args:
+            remaining (float): time left to wait, in seconds
+
+        Returns:
+            float: time to wait, in seconds
+        """
+        if self.telemetry is None:
+            return remaining
+        return min(remaining, self.telemetry.interval)
+
+    def isready(self) -> bool:
+        """Checks for VMX ready response.
+
+        Returns:
+            bool: If the VMX returns R, returns True.
+        """
+        # query state of VMX
+        state = self.verify()
+        logger.debug("isready state is {!r}", state)
+        if state == b"R":
+            return True
+        return False
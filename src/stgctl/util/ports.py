@@ -1,10 +1,16 @@
 """Helper functions for dealing with serial ports."""
 
+import json
+import os
+from pathlib import Path
 from re import Pattern
 
 from loguru import logger
 from serial.tools.list_ports import grep
 
+# Where the kernel describes tty devices
+SYSFS_TTY = Path("/sys/class/tty")
+
 
 def grep_serial_ports(regex: str | Pattern[str]) -> list:
     """Searches attached devices for valid serial ports using regex matching on port name, description, and hwid.
@@ -18,3 +24,119 @@ def grep_serial_ports(regex: str | Pattern[str]) -> list:
     logger.debug(f"Using regex {regex}")
 
     return [*grep(regex)]
+
+
+def usb_attributes(device: str) -> dict | None:
+    """Read the USB identity of a serial device node from sysfs, without enumerating every port.
+
+    Args:
+        device (str): device node, eg /dev/ttyUSB0. Symlinks are followed.
+
+    Returns:
+        dict | None: vid, pid and serial_number of the USB device,
+        or None if the node does not exist or is not a USB device described by sysfs.
+    """
+    if not os.path.exists(device):
+        return None
+    name = Path(os.path.realpath(device)).name
+    try:
+        path = (SYSFS_TTY / name / "device").resolve(strict=True)
+    except OSError:
+        return None
+    # The tty hangs off a USB interface, a few levels below the USB device itself
+    for usb_device in [path, *path.parents][:4]:
+        if (usb_device / "idVendor").exists():
+            serial = usb_device / "serial"
+            return {
+                "vid": int((usb_device / "idVendor").read_text(), 16),
+                "pid": int((usb_device / "idProduct").read_text(), 16),
+                "serial_number": serial.read_text().strip()
+                if serial.exists()
+                else None,
+            }
+    return None
+
+
+def find_serial_port(
+    regex: str | Pattern[str], serial_number: str = "", cache: str = ""
+) -> str | None:
+    """Find the serial port of a USB adapter, using a cache of earlier searches.
+
+    A cached port is used if its device node still has the same USB vid, pid and serial number,
+    which is checked in sysfs without enumerating every serial device.
+    Otherwise, attached devices are searched with grep_serial_ports and the cache is updated.
+
+    Args:
+        regex (str | Pattern[str]): regex to grep serial port name, description, and hwid.
+        serial_number (str): If given, only the adapter with this USB serial number matches,
+            to pin one when several match regex. Defaults to any.
+        cache (str): Path of the JSON cache file. Defaults to no cache.
+
+    Returns:
+        str | None: device of the matched port, or None if nothing matched
+    """
+    pattern = regex.pattern if isinstance(regex, Pattern) else regex
+    key = f"{pattern}|{serial_number}"
+    cached = _read_cache(cache)
+    entry = cached.get(key)
+    if entry:
+        identity = {k: entry[k] for k in ("vid", "pid", "serial_number")}
+        if usb_attributes(entry["device"]) == identity:
+            logger.debug(f"Using cached serial port {entry['device']}")
+            return entry["device"]
+        logger.debug(f"Cached serial port {entry['device']} is stale, rescanning.")
+
+    matched = grep_serial_ports(regex)
+    if serial_number:
+        matched = [port for port in matched if port.serial_number == serial_number]
+    logger.debug(f"Matched serial ports: {matched}")
+    if not matched:
+        return None
+    port = matched[0]
+    logger.success(f"Found serial device matching regex {pattern}: {port.name}")
+    if len(matched) > 1:
+        logger.warning(
+            "Multiple serial ports matched, selecting first one. Set a serial number to pin one.",
+            stacklevel=2,
+        )
+    if cache and port.vid is not None:
+        cached[key] = {
+            "device": port.device,
+            "vid": port.vid,
+            "pid": port.pid,
+            "serial_number": port.serial_number,
+        }
+        _write_cache(cache, cached)
+    return port.device
+
+
+def _read_cache(cache: str) -> dict:
+    """Private function reading the port cache.
+
+    Args:
+        cache (str): Path of the JSON cache file, or "" for none.
+
+    Returns:
+        dict: cached ports by search, empty if there is no readable cache
+    """
+    if not cache:
+        return {}
+    try:
+        return json.loads(Path(cache).expanduser().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache: str, cached: dict) -> None:
+    """Private function writing the port cache. Failing to write it is not an error.
+
+    Args:
+        cache (str): Path of the JSON cache file.
+        cached (dict): cached ports by search
+    """
+    path = Path(cache).expanduser()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(cached, indent=2))
+    except OSError as e:
+        logger.warning(f"Could not write serial port cache {cache}: {e}")
@@ -0,0 +1,53 @@
+"""Aggregated progress logging for loops over many points."""
+import time
+
+from loguru import logger
+from stgctl.core.settings import settings
+
+
+class ProgressLog:
+    """Logs progress through a number of steps at most once per interval, and on the last step.
+
+    Replaces a log line per step in loops that are too long or too fast to log every step.
+
+    Example:
+        progress = ProgressLog(len(points), "points")
+        for i, point in enumerate(points):
+            ...
+            progress.update(i + 1)
+    """
+
+    def __init__(
+        self, total: int, unit: str = "points", interval: float | None = None
+    ) -> None:
+        """Initialize ProgressLog, starting the clock.
+
+        Args:
+            total (int): number of steps
+            unit (str): what a step is, for the log. Defaults to "points".
+            interval (float, optional): Least time between log lines, in seconds.
+                Defaults to settings.LOG_INTERVAL.
+        """
+        self.total = total
+        self.unit = unit
+        self.interval = settings.LOG_INTERVAL if interval is None else interval
+        self._start = self._last = time.monotonic()
+
+    def update(self, done: int) -> None:
+        """Note that steps are done, logging if it is time to.
+
+        Args:
+            done (int): steps done so far
+        """
+        now = time.monotonic()
+        if done < self.total and now - self._last < self.interval:
+            return
+        self._last = now
+        logger.info(
+            "Done {}/{} {}, {:.3f} s per {}.",
+            done,
+            self.total,
+            self.unit,
+            (now - self._start) / max(done, 1),
+            self.unit.removesuffix("s"),
+        )
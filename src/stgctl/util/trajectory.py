@@ -56,3 +56,109 @@ def gen_2d_trajectory(grid_size: Size, step_size: Size) -> numpy.ndarray:
     """
     path = path_2d_numpy(*linear_grid(grid_size, step_size))
     return path
+
+
+def raster_step(grid_size: Size, travel: Size) -> Size:
+    """Step between raster points that spreads the grid over the stage travel.
+
+    An inch (1/30 of the travel) is left clear of the limit switches at each end.
+
+    Args:
+        grid_size (Size): number of raster points in (x,y)
+        travel (Size): idx between the limit switches in (x,y)
+
+    Returns:
+        Size: steps between raster points (x,y)
+    """
+    return Size(
+        (travel.X - travel.X * (2 * 1 / 30)) / grid_size.X,
+        (travel.Y - travel.Y * (2 * 1 / 30)) / grid_size.Y,
+    )
+
+
+def grid_travel(grid_size: Size, step_size: Size) -> Size:
+    """Stage travel a grid spans, were it spread over the travel as raster_step does.
+
+    Args:
+        grid_size (Size): number of raster points in (x,y)
+        step_size (Size): steps between raster points (x,y)
+
+    Returns:
+        Size: idx between the limit switches in (x,y)
+    """
+    return Size(
+        grid_size.X * step_size.X / (1 - 2 * 1 / 30),
+        grid_size.Y * step_size.Y / (1 - 2 * 1 / 30),
+    )
+
+
+def limit_travel(limit_switch_positions: list) -> Size:
+    """Stage travel between the limit switches, from the positions recorded at them.
+
+    Args:
+        limit_switch_positions (list): (x, y) positions at the limit switches, in the order visited
+
+    Returns:
+        Size: idx between the limit switches in (x,y)
+    """
+    # gather positions into array where each row is a coordinate
+    lsp = numpy.array(limit_switch_positions)
+    # diff sequential rows to get coordinate distance between points
+    stg_len = numpy.abs(numpy.diff(lsp, axis=0))
+    # Since we traveled on each side twice, might as well average them.
+    # Sometimes the VMX reports a 1-10 index difference at the limit switches.
+    # Just ignore anything below the mean, should catch these small glitches
+    x_total_idx = numpy.mean(
+        stg_len[:, 0][stg_len[:, 0] > numpy.mean(numpy.abs(stg_len[:, 0]))]
+    )
+    y_total_idx = numpy.mean(
+        stg_len[:, 1][stg_len[:, 1] > numpy.mean(numpy.abs(stg_len[:, 1]))]
+    )
+    return Size(float(x_total_idx), float(y_total_idx))
+
+
+def raster_geometry(
+    grid_size: Size, step_size: Size | None, travel: Size | None
+) -> tuple[Size, Size]:
+    """Step between raster points, and the travel to offset them within.
+
+    A given step size is used as is; otherwise the grid is spread over the travel.
+    Without a measured travel, the grid is offset as if the step size had been spread over one.
+
+    Args:
+        grid_size (Size): number of raster points in (x,y)
+        step_size (Size, optional): steps between raster points (x,y), if set
+        travel (Size, optional): idx between the limit switches in (x,y), if measured
+
+    Raises:
+        ValueError: Raised when neither the step size nor the travel is known.
+
+    Returns:
+        tuple[Size, Size]: step size and travel
+    """
+    if step_size:
+        return step_size, travel or grid_travel(grid_size, step_size)
+    if travel:
+        return raster_step(grid_size, travel), travel
+    raise ValueError(
+        "The raster needs STGCTL_STEP_SIZE, or limit switch positions from startup "
+        "or a saved file."
+    )
+
+
+def stage_trajectory(grid_size: Size, step_size: Size, travel: Size) -> numpy.ndarray:
+    """Raster trajectory in stage idx, offset an inch from the +X,+Y limit switches.
+
+    The origin is at the +X,+Y limit switches, so the stages can only index to negative numbers.
+
+    Args:
+        grid_size (Size): number of raster points in (x,y)
+        step_size (Size): steps between raster points (x,y)
+        travel (Size): idx between the limit switches in (x,y)
+
+    Returns:
+        numpy.ndarray: raster points, one (X, Y) row per point
+    """
+    trajectory = gen_2d_trajectory(grid_size, step_size)
+    trajectory += [int(travel.X * (1 * 1 / 30)), int(travel.Y * (1 * 1 / 30))]
+    return -trajectory
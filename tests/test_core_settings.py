@@ -0,0 +1,40 @@
+"""Tests for settings and logging configuration"""
+import pytest
+from loguru import logger
+from stgctl.core import settings as settings_module
+from stgctl.core.settings import Settings, configure_logging, settings
+
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    path = tmp_path / "stgctl.log"
+    monkeypatch.setattr(settings_module, "log_path", path)
+    yield path
+    monkeypatch.undo()
+    configure_logging(settings.LOGURU_LEVEL)
+
+
+def test_log_level_applies_to_both_sinks(log_file, monkeypatch, capsys):
+    monkeypatch.setenv("STGCTL_LOG_LEVEL", "WARNING")
+    configure_logging(Settings().LOGURU_LEVEL)
+    logger.info("dropped")
+    logger.warning("kept")
+    logger.complete()
+    stderr = capsys.readouterr().err
+    assert "kept" in stderr
+    assert "dropped" not in stderr
+    written = log_file.read_text()
+    assert "kept" in written
+    assert "dropped" not in written
+
+
+def test_reconfiguring_keeps_other_handlers(log_file):
+    lines = []
+    handler_id = logger.add(lines.append, format="{message}")
+    try:
+        configure_logging("DEBUG")
+        configure_logging("INFO")
+        logger.info("still here")
+    finally:
+        logger.remove(handler_id)
+    assert [line.rstrip() for line in lines] == ["still here"]
@@ -0,0 +1,97 @@
+"""Tests for AsyncVMX lib"""
+import asyncio
+import os
+import pty
+import re
+import tty
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.async_vmx import AsyncVMX
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import Motor
+
+
+@pytest.fixture
+def controller():
+    # Minimal controller on the master side of a pty:
+    # answers V with R, X with a position, and R with ^
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    written = []
+
+    def respond():
+        data = os.read(master, 1024)
+        written.append(data)
+        # Commands written back to back can arrive together
+        for token in re.findall(rb"res|I\dM-?\d+|[A-Z]", data):
+            match token:
+                case b"V":
+                    os.write(master, b"R")
+                case b"X":
+                    os.write(master, b"-0001234\r")
+                case b"R":
+                    os.write(master, b"^")
+
+    yield os.ttyname(slave), master, respond, written
+    os.close(master)
+    os.close(slave)
+
+
+def test_async_vmx_round_trip(controller):
+    port, master, respond, written = controller
+
+    async def main():
+        asyncio.get_running_loop().add_reader(master, respond)
+        async with AsyncVMX(port=port) as vmx:
+            vmx.clear().move(idx=-400, motor=Motor.X).run().send()
+            await vmx.wait_for_complete(timeout=1)
+            return await vmx.posn(axis=Motor.X)
+
+    assert asyncio.run(main()) == b"-0001234\r"
+    assert b"C,I1M-400,R" in written
+
+
+def test_async_vmx_concurrent_waits(controller):
+    port, master, respond, _ = controller
+
+    async def main():
+        asyncio.get_running_loop().add_reader(master, respond)
+        async with AsyncVMX(port=port) as vmx:
+            vmx.clear().run().send()
+            # the event loop stays free while waiting on the VMX
+            results = await asyncio.gather(
+                vmx.wait_for_complete(timeout=1), asyncio.sleep(0, result="free")
+            )
+            return results[1]
+
+    assert asyncio.run(main()) == "free"
+
+
+def test_async_vmx_wait_times_out(controller):
+    port, master, respond, _ = controller
+
+    async def main():
+        asyncio.get_running_loop().add_reader(master, respond)
+        async with AsyncVMX(port=port) as vmx:
+            await vmx.wait_for_complete(timeout=0.05)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(main())
+
+
+def test_async_vmx_gathered_queries(monkeypatch):
+    # Both have to go over the wire, rather than be answered from the shadow state
+    monkeypatch.setattr(settings, "SHADOW_TTL", 0.0)
+
+    async def main(port):
+        async with AsyncVMX(port=port) as vmx:
+            vmx.clear().origin().send()
+            vmx.clear().move(idx=-400, motor=Motor.X).run().send()
+            await vmx.wait_for_complete(timeout=5)
+            return await asyncio.gather(
+                vmx.posn(axis=Motor.X), vmx.verify(), vmx.posn(axis=Motor.Y)
+            )
+
+    with SimulatedVMX(time_scale=0) as sim:
+        assert asyncio.run(main(sim.port)) == [b"-0000400\r", b"R", b"+0000000\r"]
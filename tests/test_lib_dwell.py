@@ -0,0 +1,94 @@
+"""Tests for raster dwell strategies"""
+import os
+import socket
+import threading
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.dwell import (
+    CallbackEvent,
+    DaqEvent,
+    DwellStrategy,
+    FileEvent,
+    HandshakeDwell,
+    SocketEvent,
+    event_from_url,
+)
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.vmx import VMX
+from stgctl.schema.models import Size
+
+
+@pytest.mark.parametrize("mode", [RasterMode.POINT, RasterMode.PACKED])
+def test_handshake_raster(mode):
+    acquired = []
+
+    def acquire(point, timeout):
+        acquired.append(point)
+        return True
+
+    with SimulatedVMX(time_scale=0) as sim:
+        dwell = HandshakeDwell(CallbackEvent(acquire), timeout=1)
+        stg = XYStage(vmx=VMX(port=sim.port), dwell=dwell)
+        stg.grid_size = Size(3, 2)
+        stg.limit_switch_positions = [(0, 0), (0, -4000), (-4000, -4000), (-4000, 0)]
+        stg.raster(signal=False, mode=mode)
+        stg.VMX.close()
+    dwells = [p for run in sim.runs for p in run.dwells]
+    assert dwells == [tuple(p) for p in stg.trajectory]
+    assert acquired == list(range(6))
+    assert dwell.points == 6
+
+
+def test_handshake_moves_on_without_daq():
+    with SimulatedVMX(time_scale=0) as sim:
+        vmx = VMX(port=sim.port)
+        dwell = HandshakeDwell(CallbackEvent(lambda point, timeout: False), timeout=0)
+        vmx.clear().move(idx=100).user_wait().run().send()
+        dwell.serve(vmx, 1, timeout=5)
+        vmx.wait_for_complete(timeout=5)
+        vmx.close()
+
+
+def test_file_event(tmp_path):
+    event = event_from_url(f"file://{tmp_path}/done")
+    assert isinstance(event, FileEvent)
+    event.arm(0)
+    assert not event.wait(0.01)
+    threading.Timer(0.02, (tmp_path / "done").touch).start()
+    assert event.wait(1)
+    event.arm(1)
+    assert not event.wait(0.01)
+    os.utime(tmp_path / "done", ns=(0, 0))
+    assert event.wait(1)
+
+
+def test_socket_event():
+    event = event_from_url("udp://127.0.0.1:0")
+    assert isinstance(event, SocketEvent)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as daq:
+        # Sent before the stages got to the point
+        daq.sendto(b"done", event.address)
+        event.arm(0)
+        assert not event.wait(0.01)
+        daq.sendto(b"done", event.address)
+        assert event.wait(1)
+    event.close()
+
+
+def test_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        DaqEvent()
+    with pytest.raises(TypeError):
+        DwellStrategy()
+
+
+def test_stage_closes_daq_event(monkeypatch):
+    monkeypatch.setattr(settings, "DAQ_EVENT", "udp://127.0.0.1:0")
+    with SimulatedVMX(time_scale=0) as sim:
+        with XYStage(vmx=VMX(port=sim.port)) as stg:
+            event = stg.dwell.event
+            assert event._socket.fileno() != -1
+    assert event._socket.fileno() == -1
@@ -0,0 +1,52 @@
+"""Tests for latency histograms"""
+import math
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.latency import COMPLETE, FIRST_BYTE, LatencyHistogram, LatencyStats
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX
+
+
+def test_histogram_percentiles():
+    h = LatencyHistogram()
+    assert math.isnan(h.percentile(50))
+    for ms in range(1, 101):
+        h.record(ms * 1e-3)
+    assert h.count == 100
+    assert h.mean == pytest.approx(50.5e-3)
+    assert h.percentile(50) == pytest.approx(50e-3, rel=0.05)
+    assert h.percentile(99) == pytest.approx(99e-3, rel=0.05)
+    assert h.percentile(100) == pytest.approx(100e-3)
+    assert h.percentile(0) == pytest.approx(1e-3)
+
+
+def test_histogram_round_trip(tmp_path):
+    stats = LatencyStats()
+    stats.record("V", COMPLETE, 1e-3)
+    stats.record("V", COMPLETE, 0)
+    stats.save(tmp_path / "latency.json")
+    stats.save(tmp_path / "latency.json")
+    loaded = LatencyStats.load(tmp_path / "latency.json")
+    h = loaded.histograms[("V", COMPLETE)]
+    assert h.count == 4
+    assert h.min == 0
+    assert h.max == 1e-3
+    # Only the file itself is left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["latency.json"]
+
+
+def test_vmx_records_latencies(monkeypatch):
+    # Ask the VMX every time, rather than answering from the shadow state
+    monkeypatch.setattr(settings, "SHADOW_TTL", 0.0)
+    with SimulatedVMX(time_scale=0.05) as sim:
+        vmx = VMX(port=sim.port)
+        vmx.verify()
+        vmx.clear().move(idx=4000).run().send()
+        vmx.wait_for_complete(timeout=5)
+        vmx.close()
+    rows = {(row["command"], row["to"]): row for row in vmx.latency.summary()}
+    assert rows["V", FIRST_BYTE]["count"] == rows["V", COMPLETE]["count"] >= 2
+    assert rows["V", FIRST_BYTE]["p50"] <= rows["V", COMPLETE]["p50"]
+    # 4000 idx is 2.5 s of simulated time
+    assert rows["run", COMPLETE]["max"] == pytest.approx(2.5 * 0.05, rel=0.3)
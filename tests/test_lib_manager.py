@@ -0,0 +1,56 @@
+"""Tests for driving several controllers at once"""
+import asyncio
+import time
+from contextlib import ExitStack
+
+import pytest
+from stgctl.lib.exceptions import VmxNotReadyError
+from stgctl.lib.manager import ControllerManager
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import Motor
+
+
+@pytest.fixture
+def sims():
+    with ExitStack() as stack:
+        yield {
+            name: stack.enter_context(SimulatedVMX(time_scale=0.05))
+            for name in ("a", "b", "c")
+        }
+
+
+def test_runs_in_parallel(sims):
+    async def main():
+        async with ControllerManager({n: s.port for n, s in sims.items()}) as ctl:
+            start = time.monotonic()
+            await ctl.run(lambda vmx: vmx.clear().move(idx=4000, motor=Motor.X))
+            elapsed = time.monotonic() - start
+            return elapsed, await ctl.query(lambda vmx: vmx.posn(axis=Motor.X))
+
+    elapsed, positions = asyncio.run(main())
+    # One 4000 idx move is 2.5 s of simulated time
+    assert elapsed < 2 * 2.5 * 0.05
+    assert positions == dict.fromkeys(sims, b"+0004000\r")
+
+
+def test_runs_programs_by_name(sims):
+    async def main():
+        async with ControllerManager({n: s.port for n, s in sims.items()}) as ctl:
+            await ctl.run(
+                {
+                    "a": lambda vmx: vmx.clear().move(idx=100),
+                    "b": lambda vmx: vmx.clear().move(idx=-100),
+                }
+            )
+            return await ctl.query(lambda vmx: vmx.posn(axis=Motor.X))
+
+    assert asyncio.run(main()) == {
+        "a": b"+0000100\r",
+        "b": b"-0000100\r",
+        "c": b"+0000000\r",
+    }
+
+
+def test_bad_port_closes_all(sims):
+    with pytest.raises(VmxNotReadyError):
+        ControllerManager([sims["a"].port, "socket://127.0.0.1:1"])
@@ -0,0 +1,81 @@
+"""Tests for the motion-time model"""
+import time
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.motion import MotionModel
+from stgctl.lib.optimize import AxisState
+from stgctl.lib.shadow import ShadowState
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX, Motor
+
+
+def test_command_time():
+    model = MotionModel(travel=40000)
+    axes = AxisState(positions={1: 0}, speeds={1: 2000, 2: 1000})
+    accels = {1: 2, 2: 2}
+    # 4000 idx at 2000 idx/s, accelerating at 4000 idx/s^2
+    assert model.command_time("IA1M-4000", axes, accels) == pytest.approx(2.5)
+    assert model.command_time("I2M4000", axes, accels) == pytest.approx(4.25)
+    # Moves together take as long as the longest
+    assert model.command_time("(IA1M-4000,I2M4000,)", axes, accels) == 4.25
+    assert model.command_time("P150", axes, accels) == 15
+    assert model.command_time("U6", axes, accels) == 0
+    # Limit moves are assumed to cross the whole travel
+    assert model.command_time("I1M0", axes, accels) == pytest.approx(20.5)
+    # Motor 3's speed is not known
+    assert model.command_time("I3M100", axes, accels) is None
+    assert model.command_time("K", axes, accels) is None
+
+
+def test_shadow_predicts_loops():
+    shadow = ShadowState(MotionModel(travel=40000))
+    shadow.update(["J", "res", "N", "S1M2000", "A1M2", "P10", "LM0", "I1M4000", "L3"])
+    shadow.update(["R"])
+    assert shadow.position(1) == 12000
+    assert shadow.predicted == pytest.approx(1 + 3 * 2.5)
+    shadow.update(["PM1", "C", "JM0", "PM0", "C", "JM1", "R"])
+    assert shadow.predicted is None
+
+
+def test_predictions_match_simulator():
+    time_scale = 0.05
+    with SimulatedVMX(time_scale=time_scale) as sim:
+        vmx = VMX(port=sim.port)
+        # Reset, so accelerations are known to be at their power on settings
+        vmx._recover()
+        vmx.clear().origin().send()
+        vmx.clear().speed(speed=2000, motor=Motor.X).speed(speed=1000, motor=Motor.Y)
+        vmx.move_many(moves={Motor.X: -4000, Motor.Y: 2000}, relative=False)
+        vmx.pause(time=0.5).run().send()
+        vmx.wait_for_complete(timeout=None)
+        summary = vmx.durations.summary()
+        vmx.close()
+    # Y takes 2.5 s, then the pause
+    assert summary["count"] == 1
+    assert summary["predicted"] == pytest.approx(3.0)
+    assert summary["actual"] == pytest.approx(3.0 * time_scale, abs=0.05)
+
+
+def test_stall_noticed_quickly(monkeypatch):
+    monkeypatch.setattr(settings, "TIMEOUT_MARGIN", 0.2)
+    # The simulator runs three times slower than the model predicts
+    with SimulatedVMX(time_scale=3) as sim:
+        vmx = VMX(port=sim.port)
+        vmx.clear().origin().send()
+        vmx.clear().speed(speed=2000).move(idx=-400, relative=False).run().send()
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            vmx.wait_for_complete(timeout=None)
+        assert time.monotonic() - start < 1.5
+        vmx.close()
+
+
+def test_unknown_distance_needs_travel():
+    axes = AxisState(positions={}, speeds={1: 2000})
+    accels = {1: 2}
+    assert MotionModel().command_time("I1M0", axes, accels) is None
+    assert MotionModel().command_time("IA1M-400", axes, accels) is None
+    assert MotionModel().command_time("I1M-400", axes, accels) == pytest.approx(
+        0.632, abs=1e-3
+    )
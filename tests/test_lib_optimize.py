@@ -0,0 +1,34 @@
+"""Tests for VMX program optimization"""
+import pytest
+from stgctl.lib.optimize import AxisState, optimize
+
+
+@pytest.mark.parametrize(
+    "cmds, expected",
+    [
+        # Y is already there
+        (["IA1M0", "IA2M0", "IA1M100", "IA2M0"], ["IA1M0", "IA2M0", "IA1M100"]),
+        (["(IA1M0,IA2M0,)", "(IA1M100,IA2M0,)"], ["(IA1M0,IA2M0,)", "IA1M100"]),
+        (["IA1M0", "(IA1M0,)"], ["IA1M0"]),
+        # Relative moves track position
+        (["IA1M0", "I1M100", "IA1M100"], ["IA1M0", "I1M100"]),
+        # ImM0 indexes to a limit, so is never a no-op, and position is unknown after
+        (["IA1M0", "I1M0", "IA1M0"], ["IA1M0", "I1M0", "IA1M0"]),
+        # IAmM-0 sets zero
+        (["I1M0", "IA1M-0", "IA1M0"], ["I1M0", "IA1M-0"]),
+        (
+            ["S1M1500", "S2M1500", "S1M1500", "S1M2000"],
+            ["S1M1500", "S2M1500", "S1M2000"],
+        ),
+        # Loops make the pass forget
+        (["IA1M0", "LM0", "IA1M0", "L3"], ["IA1M0", "LM0", "IA1M0", "L3"]),
+    ],
+)
+def test_optimize(cmds, expected):
+    assert optimize(cmds) == expected
+
+
+def test_optimize_carries_state():
+    state = AxisState(speeds={1: 1500})
+    assert optimize(["C", "S1M1500", "S2M1500", "R"], state) == ["C", "S2M1500", "R"]
+    assert state.speeds == {1: 1500, 2: 1500}
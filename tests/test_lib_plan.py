@@ -0,0 +1,97 @@
+"""Tests for dry-run raster planning"""
+import numpy
+import pytest
+from stgctl.lib.motion import ACCEL_UNIT, POWER_ON_ACCEL, move_time
+from stgctl.lib.plan import describe_motion, fastest_motion, moving_time, plan_raster
+from stgctl.lib.program import (
+    RasterMode,
+    chain,
+    loop_programs,
+    pack_points,
+    point_commands,
+)
+from stgctl.lib.vmx import BaseVMX
+from stgctl.schema.models import Size
+from stgctl.util.trajectory import raster_step, stage_trajectory
+
+
+@pytest.fixture
+def grid_size():
+    return Size(X=23, Y=7)
+
+
+@pytest.fixture
+def trajectory(grid_size):
+    travel = Size(40000, 30000)
+    return stage_trajectory(grid_size, raster_step(grid_size, travel), travel)
+
+
+@pytest.mark.parametrize("pause", [0.5, 15])
+def test_plan_matches_programs(trajectory, grid_size, pause):
+    packed = plan_raster(
+        trajectory, grid_size, pause, RasterMode.PACKED, Size(1500, 1500)
+    )
+    programs = pack_points(trajectory, pause)
+    assert packed.uploads == len(programs)
+    pipelined = plan_raster(
+        trajectory, grid_size, pause, RasterMode.PIPELINED, Size(1500, 1500)
+    )
+    segments = pack_points(trajectory, pause, budget=BaseVMX.PROGRAM_BYTES - len(",U6"))
+    assert pipelined.uploads == len(segments)
+    assert pipelined.program_bytes == sum(program.size for program in segments) + (
+        len(segments) - 1
+    ) * len(",U6,JM0")
+    chained = [program for batch in chain(programs) for program in batch]
+    assert packed.program_bytes == sum(program.size for program in chained)
+
+    looped = plan_raster(
+        trajectory, grid_size, pause, RasterMode.LOOPED, Size(1500, 1500)
+    )
+    programs = loop_programs(trajectory, grid_size, pause).programs
+    assert looped.uploads == len(programs)
+    assert looped.program_bytes == sum(program.size for program in programs)
+
+    point = plan_raster(
+        trajectory, grid_size, pause, RasterMode.POINT, Size(1500, 1500)
+    )
+    assert point.program_bytes == sum(
+        len("C,,R") + point_commands(coord, pause).size for coord in trajectory
+    )
+    assert point.round_trips == len(trajectory)
+
+
+def test_plan_moving_time(trajectory, grid_size):
+    plan = plan_raster(trajectory, grid_size, 1, RasterMode.PACKED, Size(1500, 1500))
+    previous = numpy.zeros(2)
+    moving = 0.0
+    for coord in trajectory:
+        moving += max(
+            move_time(d, 1500, POWER_ON_ACCEL * ACCEL_UNIT) for d in coord - previous
+        )
+        previous = coord
+    assert plan.moving == pytest.approx(moving)
+    assert plan.dwelling == len(trajectory)
+    assert plan.travel == Size(
+        *numpy.abs(numpy.diff(trajectory, axis=0, prepend=0)).sum(axis=0)
+    )
+
+
+def test_fastest_motion(trajectory):
+    limit = Size(6000, 3000)
+    speed, accel = fastest_motion(trajectory, limit, Size(10, 4))
+    assert accel == Size(10, 4)
+    fastest = moving_time(trajectory, limit, accel)
+    assert moving_time(trajectory, speed, accel) == pytest.approx(fastest)
+    # Any slower is slower overall
+    assert speed.X < limit.X
+    slower = Size(speed.X - 1, speed.Y)
+    assert moving_time(trajectory, slower, accel) > fastest
+    assert moving_time(trajectory, speed) > fastest
+
+
+def test_describe_motion(trajectory):
+    # At the default limits, nothing is saved, so nothing is claimed
+    description = describe_motion(trajectory, Size(1500, 1500), Size(2, 2))
+    assert "less" not in description
+    speed, accel = fastest_motion(trajectory, Size(1500, 1500), Size(4, 4))
+    assert "s less than at 1500 idx/s" in describe_motion(trajectory, speed, accel)
@@ -0,0 +1,82 @@
+"""Tests for raster program compilation"""
+from unittest.mock import MagicMock
+
+import numpy
+import pytest
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.program import chain, loop_programs, pack_points, upload_program
+from stgctl.lib.vmx import VMX
+from stgctl.schema.models import Size
+from stgctl.util.trajectory import gen_2d_trajectory
+
+
+@pytest.fixture
+def trajectory():
+    return -numpy.array([[x * 1867, y * 1867] for y in range(4) for x in range(60)])
+
+
+def test_pack_points_fits_budget(trajectory):
+    programs = pack_points(trajectory, 15)
+    assert sum(program.points for program in programs) == len(trajectory)
+    # room is left for chaining
+    assert all(program.size + len(",JM0") <= VMX.PROGRAM_BYTES for program in programs)
+    assert str(programs[0].commands).startswith(
+        "(IA1M0,IA2M0,),P150,IA1M-1867,P150,IA1M-3734,P150"
+    )
+
+
+def test_pack_points_single_point_too_large(trajectory):
+    with pytest.raises(InvalidVMXCommandError):
+        pack_points(trajectory, 15, budget=10)
+
+
+def test_chain_jumps_between_slots(trajectory):
+    programs = pack_points(trajectory, 15)
+    batches = list(chain(programs))
+    assert [len(batch) for batch in batches[:-1]] == [VMX.PROGRAM_SLOTS] * (
+        len(batches) - 1
+    )
+    first = batches[0]
+    assert [str(program.commands).split(",")[-1] for program in first[:-1]] == [
+        "JM1",
+        "JM2",
+        "JM3",
+        "JM4",
+    ]
+    assert str(first[-1].commands).split(",")[-1].startswith("P")
+
+
+@pytest.mark.parametrize("rows", [1, 4, 5])
+def test_loop_programs_cover_grid(rows):
+    grid_size = Size(X=7, Y=rows)
+    trajectory = gen_2d_trajectory(grid_size, Size(X=-100, Y=-100))
+    looped = loop_programs(trajectory, grid_size, pause=0.5)
+    assert sum(points for _, points in looped.schedule) == 7 * rows
+    assert looped.schedule[0][0] == 0
+
+
+def test_loop_programs_constant_size():
+    def sizes(n):
+        grid_size = Size(X=n, Y=n)
+        trajectory = gen_2d_trajectory(grid_size, Size(X=-1867, Y=-1867))
+        return [p.size for p in loop_programs(trajectory, grid_size, 15).programs]
+
+    # the loop counts have as many digits for both
+    assert sizes(20) == sizes(90)
+    assert max(sizes(90)) <= VMX.PROGRAM_BYTES
+
+
+def test_loop_programs_zero_step():
+    trajectory = numpy.zeros((6, 2), dtype=int)
+    with pytest.raises(InvalidVMXCommandError):
+        loop_programs(trajectory, Size(X=3, Y=2), pause=0.5)
+
+
+def test_upload_program_checks_free_memory(trajectory):
+    vmx = MagicMock()
+    vmx.memory.return_value = b"+0000010\r"
+    program = pack_points(trajectory, 15)[0]
+    with pytest.raises(InvalidVMXCommandError):
+        upload_program(vmx, 1, program)
+    vmx.program.assert_called_once_with(now=True, n=1, clear=True)
+    vmx.send.assert_not_called()
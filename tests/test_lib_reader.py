@@ -0,0 +1,63 @@
+"""Tests for VMX reply demultiplexing"""
+from stgctl.lib.reader import Reply, ReplyDemux, ReplyKind
+
+
+def test_complete_and_user_wait_without_status():
+    demux = ReplyDemux()
+    received = demux.feed(b"W^", 1.0)
+    assert [r.kind for r in received] == [ReplyKind.USER_WAIT, ReplyKind.COMPLETE]
+
+
+def test_integer_status_split_across_reads():
+    demux = ReplyDemux()
+    demux.expect(Reply.INTEGER)
+    assert demux.feed(b"-000", 1.0) == []
+    (received,) = demux.feed(b"1234\r", 2.0)
+    assert received.kind is ReplyKind.STATUS
+    assert received.data == b"-0001234\r"
+    assert (received.start, received.end) == (1.0, 2.0)
+
+
+def test_complete_inside_status_reply():
+    demux = ReplyDemux()
+    demux.expect(Reply.INTEGER)
+    received = demux.feed(b"+01^2\r", 1.0)
+    assert [(r.kind, r.data) for r in received] == [
+        (ReplyKind.COMPLETE, b"^"),
+        (ReplyKind.STATUS, b"+012\r"),
+    ]
+
+
+def test_text_ends_when_quiet():
+    demux = ReplyDemux()
+    demux.expect(Reply.TEXT)
+    demux.feed(b"I1M100,R", 1.0)
+    assert demux.pending_text
+    assert demux.idle(1.0 + ReplyDemux.TEXT_QUIET / 2) == []
+    (received,) = demux.idle(1.0 + ReplyDemux.TEXT_QUIET)
+    assert received.data == b"I1M100,R"
+    assert not demux.pending_text
+
+
+def test_echo_is_separated_from_reply():
+    demux = ReplyDemux()
+    demux.expect_echo(b"V")
+    demux.expect(Reply.STATE)
+    received = demux.feed(b"VR", 1.0)
+    assert [(r.kind, r.data) for r in received] == [
+        (ReplyKind.ECHO, b"V"),
+        (ReplyKind.STATUS, b"R"),
+    ]
+
+
+def test_missing_echo_is_abandoned():
+    demux = ReplyDemux()
+    demux.expect_echo(b"V")
+    demux.expect(Reply.STATE)
+    (received,) = demux.feed(b"R", 1.0)
+    assert (received.kind, received.data) == (ReplyKind.STATUS, b"R")
+
+
+def test_unexpected_bytes_are_dropped():
+    demux = ReplyDemux()
+    assert demux.feed(b"R", 1.0) == []
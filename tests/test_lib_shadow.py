@@ -0,0 +1,68 @@
+"""Tests for the shadow VMX state"""
+from stgctl.lib.shadow import Mode, ShadowState
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.vmx import VMX, Motor
+
+
+def test_shadow_follows_programs():
+    shadow = ShadowState()
+    shadow.update(["F", "PM-0", "S1M1500", "IA1M100", "I2M-50"])
+    assert shadow.mode is Mode.ONLINE and shadow.echo
+    # Nothing moves until the program runs
+    assert shadow.position(1) is None
+    shadow.update(["N", "R"])
+    assert shadow.position(1) == 100
+    assert shadow.position(2) == -50
+    assert shadow.axes.speeds == {1: 1500}
+    # Running it again indexes motor 2 relative to where it is now
+    shadow.update(["R"])
+    assert shadow.position(2) == -100
+
+
+def test_shadow_follows_jumps():
+    shadow = ShadowState()
+    shadow.update(["J", "res", "PM1", "IA1M300", "PM0", "IA1M100", "JM1", "R"])
+    assert shadow.programs[1] == ["IA1M300"]
+    assert shadow.position(1) == 300
+    # A chain back to its start loops forever
+    shadow.update(["PM1", "JM0", "PM0", "R"])
+    assert shadow.position(1) is None
+
+
+def test_shadow_forgets_conservatively():
+    shadow = ShadowState()
+    shadow.update(["N"])
+    assert shadow.position(1) == 0
+    # The selected program is unknown until cleared
+    shadow.update(["R"])
+    assert shadow.position(1) is None
+    shadow.update(["N", "C", "R"])
+    assert shadow.position(1) == 0
+    shadow.update(["PM2", "R"])
+    assert shadow.position(1) is None
+    shadow.update(["N", "C", "I1M0", "R"])
+    assert shadow.position(1) is None
+    shadow.update(["N", "K"])
+    assert shadow.position(1) is None
+    shadow.observe("V", b"R", 1.0)
+    assert shadow.is_ready(1.5, ttl=1.0)
+    assert not shadow.is_ready(2.5, ttl=1.0)
+    shadow.observe("V", b"B", 3.0)
+    assert shadow.mode is Mode.UNKNOWN
+    # A reset while on-line faults the VMX rather than clearing its programs
+    shadow.update(["F", "C", "res"])
+    assert 0 not in shadow.programs
+
+
+def test_shadow_agrees_with_simulator():
+    with SimulatedVMX(time_scale=0) as sim:
+        vmx = VMX(port=sim.port)
+        vmx.clear().to_limits(limits={Motor.X: True, Motor.Y: True}).run().send()
+        vmx.wait_for_complete(timeout=5)
+        vmx.clear().origin().send()
+        vmx.clear().move_many(moves={Motor.X: -1200, Motor.Y: -300}).run().send()
+        vmx.clear().move(idx=-400, motor=Motor.Y, relative=False).run().send()
+        vmx.wait_for_complete(timeout=5)
+        assert vmx.posn(axis=Motor.X) == b"%+08d\r" % sim.position(Motor.X)
+        assert vmx.posn(axis=Motor.Y) == b"%+08d\r" % sim.position(Motor.Y)
+        vmx.close()
@@ -0,0 +1,60 @@
+"""Tests for the simulated VMX"""
+import time
+
+import pytest
+from stgctl.lib.simulator import SimulatedVMX, move_time
+from stgctl.lib.vmx import VMX, Motor
+
+
+@pytest.fixture
+def sim():
+    with SimulatedVMX(time_scale=0.05) as sim:
+        yield sim
+
+
+@pytest.fixture
+def vmx(sim):
+    vmx = VMX(port=sim.port)
+    yield vmx
+    vmx.close()
+
+
+def test_move_time():
+    # 4000 idx at 2000 idx/s with 4000 idx/s^2: 2 s at speed, plus half of each 0.5 s ramp
+    assert move_time(4000, 2000, 4000) == pytest.approx(2.5)
+    # too short to reach full speed
+    assert move_time(100, 2000, 4000) == pytest.approx(2 * (100 / 4000) ** 0.5)
+
+
+def test_moves_and_reports_position(sim, vmx):
+    vmx.clear().move(idx=-400, motor=Motor.X).move_many(
+        moves={Motor.X: 100, Motor.Y: 250}, relative=False
+    ).run().send()
+    vmx.wait_for_complete(timeout=5)
+    assert vmx.posn(axis=Motor.X) == b"+0000100\r"
+    assert vmx.posn(axis=Motor.Y) == b"+0000250\r"
+
+
+def test_simultaneous_moves_take_longest(sim, vmx):
+    def timed(program):
+        program.run().send()
+        start = time.monotonic()
+        vmx.wait_for_complete(timeout=5)
+        return time.monotonic() - start
+
+    sequential = timed(vmx.clear().move(idx=4000).move(idx=4000, motor=Motor.Y))
+    together = timed(vmx.clear().move_many(moves={Motor.X: 4000, Motor.Y: 4000}))
+    assert together == pytest.approx(sequential / 2, rel=0.3)
+
+
+def test_program_memory(sim, vmx):
+    vmx.clear().move(idx=100).send()
+    assert vmx.memory() == b"+%07d\r" % (VMX.PROGRAM_BYTES - len("I1M100"))
+
+
+def test_reset_while_online_faults(sim, vmx):
+    vmx.reset()
+    assert vmx.verify() == b"B"
+    # startup recovers it
+    vmx.startup()
+    assert vmx.verify() == b"R"
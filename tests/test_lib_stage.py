@@ -0,0 +1,115 @@
+"""Tests for the XYStage sequences, on the simulator"""
+from unittest.mock import MagicMock
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.exceptions import InvalidVMXCommandError
+from stgctl.lib.plan import fastest_motion, moving_time
+from stgctl.lib.program import RasterMode
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.stage import XYStage
+from stgctl.lib.vmx import VMX
+from stgctl.schema.models import Size
+
+
+def test_startup_records_limit_switches():
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        stg.startup()
+        stg.VMX.close()
+    low = sim.TRAVEL[0] - sim.TRAVEL[1]
+    # Same corners, in the same order, as visiting each in turn
+    assert stg.limit_switch_positions == [
+        (0, 0),
+        (0, low),
+        (low, low),
+        (low, 0),
+        (0, 0),
+    ]
+    # Home, then one program to each of -X,-Y and +X,+Y
+    assert len(sim.runs) == 3
+
+
+def test_pipelined_raster_chains_programs(monkeypatch):
+    monkeypatch.setattr(settings, "PIPELINED_UPLOADS", True)
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        stg.grid_size = Size(6, 6)
+        stg.observing_time = 0.1
+        stg.limit_switch_positions = [(0, 0), (0, -4000), (-4000, -4000), (-4000, 0)]
+        first = len(sim.runs)
+        stg.raster(signal=False, mode=RasterMode.PIPELINED)
+        stg.VMX.close()
+    # The speed is set, then every segment runs from one R, chained by U6 and G
+    assert len(sim.runs) == first + 2
+    dwells = sim.runs[-1].dwells
+    # Each segment but the last also waits at its last point, for the host
+    visited = [p for i, p in enumerate(dwells) if i == 0 or p != dwells[i - 1]]
+    assert visited == [tuple(p) for p in stg.trajectory]
+    assert len(dwells) > len(visited)
+
+
+def test_pipelined_raster_times_last_segment(monkeypatch):
+    monkeypatch.setattr(settings, "PIPELINED_UPLOADS", True)
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        stg.grid_size = Size(6, 6)
+        stg.observing_time = 0.1
+        stg.limit_switch_positions = [(0, 0), (0, -4000), (-4000, -4000), (-4000, 0)]
+        timeouts = []
+        wait_for_complete = stg.VMX.wait_for_complete
+
+        def record(timeout=None):
+            timeouts.append(timeout)
+            return wait_for_complete(timeout=timeout)
+
+        monkeypatch.setattr(stg.VMX, "wait_for_complete", record)
+        stg.raster(signal=False, mode=RasterMode.PIPELINED)
+        stg.VMX.close()
+    # The last segment alone, and not the whole raster, bounds its wait
+    speed, accel = fastest_motion(
+        stg.trajectory, Size(*settings.SPEED_LIMIT), Size(*settings.ACCEL_LIMIT)
+    )
+    whole = moving_time(stg.trajectory, speed, accel)
+    whole += len(stg.trajectory) * stg.observing_time
+    assert timeouts[-1] is not None
+    assert settings.TIMEOUT_MARGIN < timeouts[-1]
+    assert timeouts[-1] < whole * settings.TIMEOUT_SCALE + settings.TIMEOUT_MARGIN
+
+
+def test_pipelined_raster_needs_opt_in(monkeypatch):
+    monkeypatch.setattr(settings, "PIPELINED_UPLOADS", False)
+    stg = XYStage(vmx=MagicMock())
+    with pytest.raises(InvalidVMXCommandError):
+        stg.raster(signal=False, mode=RasterMode.PIPELINED)
+
+
+def test_travel_measured_from_limit_switches():
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        # Until startup, how far a limit move goes is unknown
+        assert stg.VMX.shadow.model.travel is None
+        stg.startup()
+        stg.VMX.close()
+    assert stg.VMX.shadow.model.travel == sim.TRAVEL[1] - sim.TRAVEL[0]
+
+
+def test_raster_speed_defaults_to_1500():
+    assert settings.SPEED_LIMIT == (1500, 1500)
+    with SimulatedVMX(time_scale=0) as sim:
+        stg = XYStage(vmx=VMX(port=sim.port))
+        stg.grid_size = Size(3, 2)
+        stg.observing_time = 0
+        stg.limit_switch_positions = [(0, 0), (0, -4000), (-4000, -4000), (-4000, 0)]
+        stg.raster(signal=False)
+        stg.VMX.close()
+    assert max(stg.VMX.shadow.axes.speeds.values()) <= 1500
+
+
+def test_limit_approach_ignores_raster_speed_limit(monkeypatch):
+    monkeypatch.setattr(settings, "SPEED_LIMIT", (6000, 6000))
+    monkeypatch.setattr(settings, "HOMING_FAST_SPEED", 2000)
+    vmx = MagicMock()
+    XYStage(vmx=vmx)._approach_limits(True)
+    speeds = [c.kwargs["speed"] for c in vmx.speed.call_args_list]
+    assert speeds == [2000, 2000, settings.HOMING_SPEED, settings.HOMING_SPEED]
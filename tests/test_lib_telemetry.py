@@ -0,0 +1,72 @@
+"""Tests for position telemetry"""
+import time
+
+import numpy
+from stgctl.lib.simulator import SimulatedVMX
+from stgctl.lib.telemetry import SAMPLE, PositionTelemetry, TelemetryBuffer
+from stgctl.lib.vmx import VMX, Motor
+
+
+def samples(times):
+    s = numpy.zeros(len(times), dtype=SAMPLE)
+    s["time"] = times
+    return s
+
+
+def test_ring_buffer_wraps():
+    buffer = TelemetryBuffer(capacity=4)
+    sub = buffer.subscribe()
+    buffer.push(samples([1, 2, 3]))
+    assert list(sub.read()["time"]) == [1, 2, 3]
+    buffer.push(samples([4, 5, 6, 7]))
+    assert list(buffer.latest()["time"]) == [4, 5, 6, 7]
+    assert list(buffer.latest(2)["time"]) == [6, 7]
+    assert list(sub.read()["time"]) == [4, 5, 6, 7]
+    buffer.push(samples(range(8, 14)))
+    assert list(sub.read()["time"]) == [10, 11, 12, 13]
+    assert sub.missed == 2
+    assert len(sub.wait(timeout=0.01)) == 0
+
+
+def test_samples_during_motion():
+    with SimulatedVMX(time_scale=0.05) as sim:
+        vmx = VMX(port=sim.port)
+        vmx.telemetry = PositionTelemetry(interval=0.01)
+        sub = vmx.telemetry.subscribe()
+        vmx.clear().move_many(moves={Motor.X: 4000, Motor.Y: -4000}).run().send()
+        vmx.wait_for_complete(timeout=5)
+        got = sub.read()
+        assert vmx.verify() == b"R"
+        vmx.close()
+    assert 0 < len(got) <= PositionTelemetry.FIFO_DEPTH
+    assert numpy.all(numpy.diff(got["time"]) > 0)
+    assert numpy.all(numpy.diff(got["x"]) >= 0)
+    assert numpy.abs(got["x"] + got["y"]).max() < 100
+    assert got["x"][-1] <= 4000
+
+
+def test_collect_aligns_to_last_stamps():
+    telemetry = PositionTelemetry()
+    for t in range(6):
+        telemetry.stamp(t)
+    assert telemetry.collect(b"+0000010\r+0000020\r", b"-0000001\r-0000002\r") == 2
+    got = telemetry.buffer.latest()
+    assert list(got["time"]) == [4, 5]
+    assert list(got["x"]) == [10, 20]
+    assert list(got["y"]) == [-1, -2]
+
+
+def test_short_program_not_read_back():
+    with SimulatedVMX(time_scale=0.05) as sim:
+        vmx = VMX(port=sim.port)
+        vmx.telemetry = PositionTelemetry(interval=0.5)
+        sub = vmx.telemetry.subscribe()
+        vmx.clear().move(idx=100).run().send()
+        start = time.monotonic()
+        vmx.wait_for_complete(timeout=5)
+        elapsed = time.monotonic() - start
+        vmx.close()
+    # Done within one interval, so nothing was recorded, and x and y are not asked for
+    assert elapsed < 0.2
+    assert not vmx.telemetry.pending
+    assert len(sub.read()) == 0
@@ -0,0 +1,102 @@
+"""Tests for recording and replaying serial traffic"""
+import math
+import socket
+import time
+
+import pytest
+from stgctl.core.settings import settings
+from stgctl.lib.exceptions import ReplayMismatchError, VmxNotReadyError
+from stgctl.lib.simulator import SimulatedVMX, TcpBridge
+from stgctl.lib.transport import (
+    Direction,
+    ReplayTransport,
+    SocketTransport,
+    read_capture,
+)
+from stgctl.lib.vmx import VMX, Motor
+
+
+def session(vmx):
+    vmx.clear().move_many(moves={Motor.X: 300, Motor.Y: -200}).run().send()
+    vmx.wait_for_complete(timeout=5)
+    return vmx.posn(axis=Motor.X), vmx.posn(axis=Motor.Y)
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    path = tmp_path / "session.cap"
+    monkeypatch.setattr(settings, "CAPTURE", str(path))
+    with SimulatedVMX(time_scale=0.05) as sim:
+        vmx = VMX(port=sim.port)
+        replies = session(vmx)
+        vmx.close()
+    return path, replies
+
+
+def test_records_both_directions(capture):
+    path, _ = capture
+    records = list(read_capture(path))
+    written = b"".join(r.data for r in records if r.direction is Direction.WRITE)
+    read = b"".join(r.data for r in records if r.direction is Direction.READ)
+    assert b"(I1M300,I2M-200,),R" in written
+    assert b"^" in read
+    assert [r.time for r in records] == sorted(r.time for r in records)
+
+
+@pytest.mark.parametrize("speed", [1.0, math.inf])
+def test_replay(capture, speed):
+    path, replies = capture
+    transport = ReplayTransport(path, speed=speed)
+    vmx = VMX(transport=transport)
+    assert session(vmx) == replies
+    assert transport.finished
+    vmx.close()
+
+
+def test_replay_mismatch(capture):
+    path, _ = capture
+    vmx = VMX(transport=ReplayTransport(path, speed=math.inf))
+    with pytest.raises(ReplayMismatchError):
+        vmx.clear().move(idx=1).send()
+    vmx.close()
+
+
+@pytest.fixture
+def bridge():
+    with SimulatedVMX(time_scale=0.05) as sim, TcpBridge(sim.port) as bridge:
+        yield bridge
+
+
+def test_socket_transport(bridge):
+    vmx = VMX(port=bridge.url)
+    assert vmx.isready()
+    assert vmx._serial._socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    assert session(vmx) == (b"+0000300\r", b"-0000200\r")
+    transport = vmx._serial
+    vmx.close()
+    # Nothing left open, including the pair that wakes the reader
+    for sock in (transport._socket, transport._wake_r, transport._wake_w):
+        assert sock.fileno() == -1
+
+
+def test_socket_transport_reconnects(bridge, monkeypatch):
+    # isready has to go over the connection, rather than be answered from the shadow state
+    monkeypatch.setattr(settings, "SHADOW_TTL", 0.0)
+    vmx = VMX(port=bridge.url)
+    bridge.drop()
+    # The drop may be noticed by the reader or by the next write
+    for _ in range(50):
+        if vmx._serial.reconnects:
+            break
+        time.sleep(0.01)
+    assert vmx.isready()
+    assert vmx._serial.reconnects == 1
+    assert bridge.connections == 2
+    vmx.close()
+
+
+def test_socket_transport_connect_fails():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    with pytest.raises(VmxNotReadyError):
+        SocketTransport("127.0.0.1", port, connect_timeout=0.5)
@@ -1,38 +1,59 @@
 """Tests for VMX lib"""
+import queue
 from unittest.mock import MagicMock, patch
 
 import pytest
 from serial import Serial
 from serial.tools.list_ports_common import ListPortInfo
-from stgctl.lib.vmx import VMX
+from stgctl.core.settings import settings
+from stgctl.lib.vmx import VMX, BaseVMX, Motor, SerialCommand
 
 
 @pytest.fixture()
 def mock_serial(mocker):
     # Create and return mock serial connection
     mock_serial = MagicMock(spec=Serial)
-    mock_serial.write.return_value = None
-    mock_serial.readall.return_value = b"R"
+    # Bytes the VMX "sends", read by the reader thread
+    incoming = queue.Queue()
+    # What the VMX answers to each write, as bytes or a list of chunks
+    mock_serial.replies = {b"V": b"R"}
+
+    def write(data):
+        reply = mock_serial.replies.get(data, [])
+        for chunk in [reply] if isinstance(reply, bytes) else reply:
+            incoming.put(chunk)
+
+    def read(size=1):
+        try:
+            return incoming.get(timeout=0.01)
+        except queue.Empty:
+            return b""
+
+    mock_serial.write.side_effect = write
+    mock_serial.read.side_effect = read
+    mock_serial.feed = incoming.put
+    mock_serial.in_waiting = 0
     mock_serial.port.return_value = "Test Serial Device"
     mocker.patch("serial.Serial", return_value=mock_serial)
     return mock_serial
 
 
 @pytest.fixture(autouse=True)
-def patched_list_ports_grep():
+def patched_list_ports_grep(monkeypatch):
     mock_port_info = ListPortInfo(device="Test Serial Device")
-    with patch("stgctl.lib.vmx.grep_serial_ports", return_value=[mock_port_info]):
+    monkeypatch.setattr(settings, "PORT_CACHE", "")
+    with patch("stgctl.util.ports.grep_serial_ports", return_value=[mock_port_info]):
         yield
 
 
 @pytest.fixture
 def vmx(mock_serial, monkeypatch):
-    mock_serial.readall.return_value = b"R"
     port = None
-    with patch("stgctl.lib.vmx.serial.Serial", return_value=mock_serial):
+    with patch("stgctl.lib.transport.serial.Serial", return_value=mock_serial):
         vmx = VMX(port=port)
     mock_serial.write.reset_mock()
-    return vmx
+    yield vmx
+    vmx.close()
 
 
 def test_vmx_class_with_patched_grep_serial_ports(patched_list_ports_grep, mock_serial):
@@ -40,9 +61,73 @@ def test_vmx_class_with_patched_grep_serial_ports(patched_list_ports_grep, mock_
     assert vmx._serial.port() == "Test Serial Device"
 
 
-def test_isready_when_not_ready(vmx, mock_serial):
+def test_driver_must_provide_io():
+    class WriteOnly(BaseVMX):
+        def _write(self, cmd):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+
+
+def _repeat(cmd):
+    cmd *= 2
+
+
+def _add(cmd):
+    cmd += ["C", 5]
+
+
+def _add_self(cmd):
+    cmd += cmd
+
+
+def _set_slice(cmd):
+    cmd[1:2] = ("P5", "P6")
+
+
+def _del_slice(cmd):
+    del cmd[:2]
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda cmd: cmd.append("R"),
+        lambda cmd: cmd.extend(SerialCommand(["S1M500", "R"])),
+        lambda cmd: cmd.extend(["S1M500", 7]),
+        lambda cmd: cmd.insert(1, "C"),
+        lambda cmd: cmd.pop(),
+        lambda cmd: cmd.pop(0),
+        lambda cmd: cmd.remove("P10"),
+        lambda cmd: cmd.clear(),
+        lambda cmd: cmd.reverse(),
+        lambda cmd: cmd.sort(),
+        lambda cmd: cmd.__setitem__(0, "IA2M0"),
+        _set_slice,
+        lambda cmd: cmd.__delitem__(0),
+        _del_slice,
+        _add,
+        _add_self,
+        _repeat,
+    ],
+)
+def test_serial_command_encoding_follows_mutations(mutate):
+    cmd = SerialCommand(["IA1M100", "P10", "IA1M0"])
+    # Encode first, so a mutation that leaves the encoding stale is caught
+    assert cmd.encode() == b"IA1M100,P10,IA1M0"
+    mutate(cmd)
+    assert cmd.encode() == ",".join(cmd).encode()
+    assert cmd.size == len(",".join(cmd))
+    cmd.append("R")
+    assert cmd.encode() == ",".join(cmd).encode()
+
+
+def test_isready_when_not_ready(vmx, mock_serial, monkeypatch):
+    # Ask the VMX rather than trusting its ready reply from startup
+    monkeypatch.setattr(settings, "SHADOW_TTL", 0.0)
     # Configure the mock serial connection to return something other than "R" when verify is called
-    mock_serial.readall.return_value = b""
+    mock_serial.replies = {}
 
     # Call the isready method and assert that it returns False
     assert vmx.isready() is False
@@ -127,8 +212,124 @@ def test_move_absolute(vmx, mock_serial):
 
 
 def test_to_limit_positive(vmx, mock_serial):
-    mock_serial.readall.return_value = b""
     # Call the to_limit method with pos=True
     vmx.to_limit(now=True, motor=1, pos=True)
     # Verify that the write method of the mock serial connection is called with the expected command
     mock_serial.write.assert_called_once_with(b"I1M0")
+
+
+def test_wait_for_complete_returns_on_complete(vmx, mock_serial):
+    vmx.clear().run().send()
+    mock_serial.feed(b"^")
+    vmx.wait_for_complete(timeout=1)
+
+
+def test_wait_for_complete_keeps_early_complete(vmx, mock_serial):
+    # ^ arriving before the wait starts is not thrown away
+    mock_serial.replies = {b"C,R": b"^"}
+    vmx.clear().run().send()
+    vmx.wait_for_complete(timeout=1)
+
+
+def test_wait_for_complete_skips_earlier_programs(vmx, mock_serial):
+    # speed programs are often run without waiting on them
+    vmx.clear().speed(speed=1500).run().send()
+    vmx.clear().move(idx=100).run().send()
+    mock_serial.feed(b"^")
+    with pytest.raises(TimeoutError):
+        vmx.wait_for_complete(timeout=0.05)
+    mock_serial.feed(b"^")
+    vmx.wait_for_complete(timeout=1)
+
+
+def test_wait_for_complete_times_out(vmx, mock_serial):
+    with pytest.raises(TimeoutError):
+        vmx.wait_for_complete(timeout=0.05)
+
+
+def test_posn_returns_once_terminated(vmx, mock_serial):
+    mock_serial.replies = {b"X": [b"+00", b"123", b"4\r"]}
+    assert vmx.posn(axis=Motor.X) == b"+001234\r"
+
+
+def test_status_reply_not_confused_by_complete(vmx, mock_serial):
+    mock_serial.replies = {b"V": b"^R"}
+    vmx.clear().run().send()
+    assert vmx.verify() == b"R"
+    vmx.wait_for_complete(timeout=1)
+
+
+def test_isready_answered_from_shadow(vmx, mock_serial):
+    # startup has just seen the VMX answer R
+    assert vmx.isready() is True
+    mock_serial.write.assert_not_called()
+
+
+def test_posn_answered_from_shadow(vmx, mock_serial):
+    mock_serial.replies = {b"C,IA1M100,R": b"^"}
+    vmx.clear().move(idx=100, relative=False).run().send()
+    vmx.wait_for_complete(timeout=1)
+    mock_serial.write.reset_mock()
+    assert vmx.posn(axis=Motor.X) == b"+0000100\r"
+    mock_serial.write.assert_not_called()
+    # Limit moves leave the position to the VMX
+    mock_serial.replies = {b"C,I1M0,R": b"^", b"X": b"+0002000\r"}
+    vmx.clear().to_limit().run().send()
+    vmx.wait_for_complete(timeout=1)
+    assert vmx.posn(axis=Motor.X) == b"+0002000\r"
+    mock_serial.write.assert_called_with(b"X")
+
+
+def test_lst_reads_until_quiet(vmx, mock_serial):
+    mock_serial.replies = {b"lst": [b"I1M100,", b"R"]}
+    assert vmx.lst() == b"I1M100,R"
+
+
+def test_move_many_simultaneous(vmx, mock_serial):
+    vmx.move_many(now=True, moves={Motor.X: 100, Motor.Y: -200}, relative=False)
+    mock_serial.write.assert_called_once_with(b"(IA1M100,IA2M-200,)")
+
+
+def test_to_limits_single_motor(vmx, mock_serial):
+    vmx.to_limits(now=True, limits={Motor.Y: False})
+    mock_serial.write.assert_called_once_with(b"I2M-0")
+
+
+def test_accel_keeps_speeds(vmx, mock_serial):
+    vmx.clear().speed(speed=1500).accel(accel=4, motor=Motor.Y).run().send()
+    mock_serial.write.assert_called_with(b"C,S1M1500,A2M4,R")
+    vmx.clear().speed(speed=1500).move(idx=100).run().send()
+    mock_serial.write.assert_called_with(b"C,I1M100,R")
+
+
+def test_repeated_speeds_not_resent(vmx, mock_serial):
+    vmx.clear().speed(speed=1500).run().send()
+    vmx.clear().speed(speed=1500).move(idx=100).run().send()
+    mock_serial.write.assert_called_with(b"C,I1M100,R")
+    vmx.reset()
+    vmx.clear().speed(speed=1500).run().send()
+    mock_serial.write.assert_called_with(b"C,S1M1500,R")
+
+
+def test_startup_skips_reset_when_ready(mock_serial):
+    vmx = VMX(port=None)
+    vmx.close()
+    written = [c.args[0] for c in mock_serial.write.call_args_list]
+    assert written == [b"F", b"V"]
+    assert vmx.startup_time is not None
+
+
+def test_startup_resets_when_not_ready(mock_serial):
+    mock_serial.replies = {b"V": b"B"}
+    write = mock_serial.write.side_effect
+
+    def ready_after_reset(data):
+        if data == b"res":
+            mock_serial.replies[b"V"] = b"R"
+        write(data)
+
+    mock_serial.write.side_effect = ready_after_reset
+    vmx = VMX(port=None)
+    vmx.close()
+    written = [c.args[0] for c in mock_serial.write.call_args_list]
+    assert written == [b"F", b"V", b"J", b"res", b"F", b"V"]
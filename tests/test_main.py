@@ -1,6 +1,9 @@
 """Test cases for the __main__ module."""
+import json
+
 import pytest
 from stgctl.cli import cli
+from stgctl.core.settings import settings
 from typer.testing import CliRunner
 
 
@@ -14,3 +17,23 @@ def test_main_succeeds(runner: CliRunner) -> None:
     """It exits with a status code of zero."""
     result = runner.invoke(cli, ["stages"])
     assert result.exit_code == 0
+
+
+def test_plan_needs_step_size_or_limit_switches(
+    runner: CliRunner, tmp_path, monkeypatch
+) -> None:
+    """It refuses to plan a raster over a travel it would have to guess."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "GRID_SIZE", (6, 6))
+    monkeypatch.setattr(settings, "STEP_SIZE", None)
+    result = runner.invoke(cli, ["stages", "plan"])
+    assert result.exit_code == 2
+    (tmp_path / "limit_switch_positions.json").write_text(
+        json.dumps([[0, 0], [0, -120000], [-120000, -120000], [-120000, 0], [0, 0]])
+    )
+    result = runner.invoke(cli, ["stages", "plan", "--use-saved", "--mode", "packed"])
+    assert result.exit_code == 0
+    assert "36 points on a 6x6 grid" in result.output
+    # The default limits are the speeds rasters always ran at, so nothing is saved
+    assert "Rastering at speeds (1500,1500) idx/s" in result.output
+    assert "less" not in result.output
@@ -0,0 +1,58 @@
+"""Tests for serial port discovery"""
+import json
+from unittest.mock import patch
+
+import pytest
+from serial.tools.list_ports_common import ListPortInfo
+from stgctl.util import ports
+
+
+def port_info(device, serial_number):
+    info = ListPortInfo(device=device)
+    info.vid, info.pid, info.serial_number = 0x0403, 0x6001, serial_number
+    return info
+
+
+@pytest.fixture
+def attached():
+    # Two matching adapters, with sysfs describing them
+    infos = [port_info("/dev/ttyUSB0", "A"), port_info("/dev/ttyUSB1", "B")]
+    sysfs = {
+        info.device: {
+            "vid": info.vid,
+            "pid": info.pid,
+            "serial_number": info.serial_number,
+        }
+        for info in infos
+    }
+    with patch.object(
+        ports, "grep_serial_ports", return_value=infos
+    ) as grep, patch.object(ports, "usb_attributes", side_effect=sysfs.get):
+        yield grep, sysfs
+
+
+def test_find_serial_port_pins_serial_number(attached):
+    assert ports.find_serial_port("USB", serial_number="B") == "/dev/ttyUSB1"
+    assert ports.find_serial_port("USB", serial_number="C") is None
+
+
+def test_find_serial_port_uses_cache(attached, tmp_path):
+    grep, _ = attached
+    cache = str(tmp_path / "ports.json")
+    assert ports.find_serial_port("USB", cache=cache) == "/dev/ttyUSB0"
+    assert ports.find_serial_port("USB", cache=cache) == "/dev/ttyUSB0"
+    assert grep.call_count == 1
+    assert (
+        json.loads((tmp_path / "ports.json").read_text())["USB|"]["serial_number"]
+        == "A"
+    )
+
+
+def test_find_serial_port_rescans_stale_cache(attached, tmp_path):
+    grep, sysfs = attached
+    cache = str(tmp_path / "ports.json")
+    ports.find_serial_port("USB", cache=cache)
+    # A different adapter now has the cached device node
+    sysfs["/dev/ttyUSB0"] = {"vid": 0x0403, "pid": 0x6001, "serial_number": "Z"}
+    ports.find_serial_port("USB", cache=cache)
+    assert grep.call_count == 2
@@ -0,0 +1,43 @@
+"""Tests for aggregated progress logging"""
+import pytest
+from loguru import logger
+from stgctl.util import progress
+from stgctl.util.progress import ProgressLog
+
+
+@pytest.fixture
+def messages():
+    lines = []
+    handler_id = logger.add(lines.append, level="INFO", format="{message}")
+    yield lines
+    logger.remove(handler_id)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(progress.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_logs_once_per_interval(messages, clock):
+    log = ProgressLog(100, "points", interval=10)
+    # A step every second: a line on reaching each 10 s, and none between
+    for done in range(1, 100):
+        clock[0] += 1
+        log.update(done)
+    assert len(messages) == 9
+    assert messages[0].startswith("Done 10/100 points, 1.000 s per point.")
+    # The last step is always logged, however soon after the previous line
+    log.update(100)
+    assert len(messages) == 10
+    assert messages[-1].startswith("Done 100/100 points")
+
+
+def test_fast_loop_logs_only_the_end(messages, clock):
+    log = ProgressLog(1000, "programs", interval=10)
+    for done in range(1, 1001):
+        log.update(done)
+    assert [m.rstrip() for m in messages] == [
+        "Done 1000/1000 programs, 0.000 s per program."
+    ]
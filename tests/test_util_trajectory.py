@@ -0,0 +1,41 @@
+"""Tests for raster trajectory generation"""
+import pytest
+from stgctl.schema.models import Size
+from stgctl.util.trajectory import (
+    grid_travel,
+    limit_travel,
+    raster_geometry,
+    raster_step,
+)
+
+LIMIT_SWITCH_POSITIONS = [
+    (0, 0),
+    (0, -120000),
+    (-119995, -120000),
+    (-119995, 3),
+    (0, 3),
+]
+
+
+def test_limit_travel():
+    assert limit_travel(LIMIT_SWITCH_POSITIONS) == Size(119995, 120001.5)
+
+
+def test_raster_geometry_from_travel():
+    grid = Size(60, 30)
+    travel = limit_travel(LIMIT_SWITCH_POSITIONS)
+    assert raster_geometry(grid, None, travel) == (raster_step(grid, travel), travel)
+
+
+def test_raster_geometry_from_step_size():
+    grid = Size(60, 30)
+    step, travel = raster_geometry(grid, Size(1867, 1000), None)
+    assert step == Size(1867, 1000)
+    # Offset as if the step size had been spread over the travel
+    assert raster_step(grid, travel) == pytest.approx(step)
+    assert travel == grid_travel(grid, step)
+
+
+def test_raster_geometry_refuses_to_guess():
+    with pytest.raises(ValueError):
+        raster_geometry(Size(60, 60), None, None)